@@ -11,6 +11,8 @@ class Agent(object):
     done = False  # If has one complete episode
     max_reached = False
 
+    _init_episode_capacity = 32  # The initial capacity of the episode arena, doubled when full
+
     def __init__(self, agent_id: int,
                  obs_shapes: List[Tuple],
                  action_size: int,
@@ -22,7 +24,7 @@ class Agent(object):
         self.seq_hidden_state_shape = seq_hidden_state_shape
         self.max_return_episode_trans = max_return_episode_trans
 
-        self._tmp_episode_trans = self._generate_empty_episode_trans()
+        self._reset_episode_trans()
 
     def _generate_empty_episode_trans(self, episode_length: int = 0):
         return {
@@ -70,31 +72,25 @@ class Agent(object):
             ep_probs: [1, episode_len], np.float32
             ep_seq_hidden_states: [1, episode_len, *seq_hidden_state_shape], np.float32
         """
-        expaned_transition = {
-            'index': np.expand_dims(self._last_steps if not is_padding else -1, 0),
-            'padding_mask': np.expand_dims(is_padding, 0).astype(bool),
-
-            'obs_list': [np.expand_dims(o, 0).astype(np.float32) for o in obs_list],
-            'action': np.expand_dims(action, 0).astype(np.float32),
-            'reward': np.expand_dims(reward, 0).astype(np.float32),
-            'local_done': np.expand_dims(local_done, 0).astype(bool),
-            'max_reached': np.expand_dims(max_reached, 0).astype(bool),
-            'next_obs_list': [o.astype(np.float32) for o in next_obs_list],
-            'prob': np.expand_dims(prob, 0).astype(np.float32),
-            'seq_hidden_state': np.expand_dims(seq_hidden_state, 0).astype(np.float32) if seq_hidden_state is not None else None,
-        }
-
-        for k in self._tmp_episode_trans:
-            if k == 'obs_list':
-                self._tmp_episode_trans[k] = [
-                    np.concatenate([o, t_o]) for o, t_o in zip(self._tmp_episode_trans[k],
-                                                               expaned_transition[k])
-                ]
-            elif k == 'next_obs_list':
-                self._tmp_episode_trans[k] = expaned_transition[k]
-            elif self._tmp_episode_trans[k] is not None:
-                self._tmp_episode_trans[k] = np.concatenate([self._tmp_episode_trans[k],
-                                                             expaned_transition[k]])
+        if self._episode_length == self._episode_capacity:
+            self._grow_episode_trans()
+
+        i = self._episode_length
+        tmp = self._tmp_episode_trans
+        tmp['index'][i] = self._last_steps if not is_padding else -1
+        tmp['padding_mask'][i] = is_padding
+        for o, t_o in zip(tmp['obs_list'], obs_list):
+            o[i] = t_o
+        tmp['action'][i] = action
+        tmp['reward'][i] = reward
+        tmp['local_done'][i] = local_done
+        tmp['max_reached'][i] = max_reached
+        tmp['next_obs_list'] = [o.astype(np.float32) for o in next_obs_list]
+        tmp['prob'][i] = prob
+        if tmp['seq_hidden_state'] is not None:
+            tmp['seq_hidden_state'][i] = seq_hidden_state
+
+        self._episode_length += 1
 
         if not self.done:
             self.reward += reward
@@ -120,13 +116,33 @@ class Agent(object):
 
         if local_done or self.episode_length == self.max_return_episode_trans:
             episode_trans = self.get_episode_trans()
-            self._tmp_episode_trans = self._generate_empty_episode_trans()
+            # The returned episode is a view of the arena, hand it over and start a new one
+            self._reset_episode_trans()
 
             return episode_trans
 
     @property
     def episode_length(self):
-        return len(self._tmp_episode_trans['obs_list'][0])
+        return self._episode_length
+
+    def _reset_episode_trans(self):
+        self._tmp_episode_trans = self._generate_empty_episode_trans(self._init_episode_capacity)
+        self._episode_capacity = self._init_episode_capacity
+        self._episode_length = 0
+
+    def _grow_episode_trans(self):
+        """
+        Double the capacity of the episode arena, amortized O(1) for each transition
+        """
+        for k, v in self._tmp_episode_trans.items():
+            if k == 'obs_list':
+                self._tmp_episode_trans[k] = [np.concatenate([o, np.empty_like(o)]) for o in v]
+            elif k == 'next_obs_list':
+                pass
+            elif v is not None:
+                self._tmp_episode_trans[k] = np.concatenate([v, np.empty_like(v)])
+
+        self._episode_capacity *= 2
 
     def _extra_log(self,
                    obs_list,
@@ -151,7 +167,17 @@ class Agent(object):
             ep_probs: [1, episode_len], np.float32
             ep_seq_hidden_states: [1, episode_len, *seq_hidden_state_shape], np.float32
         """
-        tmp = self._tmp_episode_trans.copy()
+        # Views of the filled part of the arena, no copy
+        tmp = {}
+        for k, v in self._tmp_episode_trans.items():
+            if k == 'obs_list':
+                tmp[k] = [o[:self._episode_length] for o in v]
+            elif k == 'next_obs_list':
+                tmp[k] = v
+            elif v is not None:
+                tmp[k] = v[:self._episode_length]
+            else:
+                tmp[k] = None
 
         if force_length is not None:
             delta = force_length - self.episode_length
@@ -208,7 +234,7 @@ class Agent(object):
         self.steps = 0
         self.done = False
         self.max_reached = False
-        self._tmp_episode_trans = self._generate_empty_episode_trans()
+        self._reset_episode_trans()
 
     def reset(self):
         """
@@ -220,6 +246,268 @@ class Agent(object):
         self.max_reached = False
 
 
+class AgentBatch(object):
+    """
+    Episode recorder of all agents in one environment,
+    holding [n_agents, capacity, ...] arrays and recording one step of all agents with vectorized writes
+    """
+
+    _init_episode_capacity = 32  # The initial capacity of the episode arena, doubled when full
+
+    def __init__(self, n_agents: int,
+                 obs_shapes: List[Tuple],
+                 action_size: int,
+                 seq_hidden_state_shape=None,
+                 max_return_episode_trans=-1):
+        self.n_agents = n_agents
+        self.obs_shapes = obs_shapes
+        self.action_size = action_size
+        self.seq_hidden_state_shape = seq_hidden_state_shape
+        self.max_return_episode_trans = max_return_episode_trans
+
+        self.reward = np.zeros(n_agents)  # The reward of the first complete episode
+        self._last_reward = np.zeros(n_agents)  # The reward of the last episode
+        self.steps = np.zeros(n_agents, dtype=int)  # The step count of the first complete episode
+        self._last_steps = np.zeros(n_agents, dtype=int)  # The step count of the last episode
+        self.done = np.zeros(n_agents, dtype=bool)  # If has one complete episode
+        self.max_reached = np.zeros(n_agents, dtype=bool)
+
+        self._tmp_episode_trans = self._generate_empty_episode_trans(self._init_episode_capacity)
+        self._episode_capacity = self._init_episode_capacity
+        self._episode_length = np.zeros(n_agents, dtype=int)
+
+    def __len__(self):
+        return self.n_agents
+
+    def _generate_empty_episode_trans(self, episode_length: int = 0):
+        n = self.n_agents
+        return {
+            'index': -np.ones((n, episode_length), dtype=int),
+            'padding_mask': np.ones((n, episode_length), dtype=bool),
+            'obs_list': [np.zeros((n, episode_length, *s), dtype=np.float32) for s in self.obs_shapes],
+            'action': np.zeros((n, episode_length, self.action_size), dtype=np.float32),
+            'reward': np.zeros((n, episode_length), dtype=np.float32),
+            'local_done': np.zeros((n, episode_length), dtype=bool),
+            'max_reached': np.zeros((n, episode_length), dtype=bool),
+            'next_obs_list': [np.zeros((n, *s), dtype=np.float32) for s in self.obs_shapes],
+            'prob': np.zeros((n, episode_length), dtype=np.float32),
+            'seq_hidden_state': np.zeros((n, episode_length, *self.seq_hidden_state_shape), dtype=np.float32) if self.seq_hidden_state_shape is not None else None,
+        }
+
+    def _ensure_episode_capacity(self, episode_length: int):
+        """
+        Double the capacity of the episode arena until it holds `episode_length` transitions
+        """
+        while self._episode_capacity < episode_length:
+            for k, v in self._tmp_episode_trans.items():
+                if k == 'obs_list':
+                    self._tmp_episode_trans[k] = [np.concatenate([o, np.empty_like(o)], axis=1) for o in v]
+                elif k == 'next_obs_list':
+                    pass
+                elif v is not None:
+                    self._tmp_episode_trans[k] = np.concatenate([v, np.empty_like(v)], axis=1)
+
+            self._episode_capacity *= 2
+
+    def add_padding(self,
+                    padding_length: int,
+                    action: np.ndarray,
+                    seq_hidden_state: Optional[np.ndarray] = None):
+        """
+        Burn-in padding of all empty agents
+
+        Args:
+            padding_length: int
+            action: [action_size, ]
+            seq_hidden_state: [*seq_hidden_state_shape]
+        """
+        agent_ids = np.where(self.is_empty())[0]
+        if padding_length == 0 or len(agent_ids) == 0:
+            return
+
+        self._ensure_episode_capacity(padding_length)
+
+        tmp = self._tmp_episode_trans
+        tmp['index'][agent_ids, :padding_length] = -1
+        tmp['padding_mask'][agent_ids, :padding_length] = True
+        for o, n_o in zip(tmp['obs_list'], tmp['next_obs_list']):
+            o[agent_ids, :padding_length] = 0
+            n_o[agent_ids] = 0
+        tmp['action'][agent_ids, :padding_length] = action
+        tmp['reward'][agent_ids, :padding_length] = 0
+        tmp['local_done'][agent_ids, :padding_length] = False
+        tmp['max_reached'][agent_ids, :padding_length] = False
+        tmp['prob'][agent_ids, :padding_length] = 0
+        if tmp['seq_hidden_state'] is not None:
+            tmp['seq_hidden_state'][agent_ids, :padding_length] = seq_hidden_state
+
+        self._episode_length[agent_ids] = padding_length
+        self.steps[agent_ids[~self.done[agent_ids]]] += padding_length
+
+    def add_transitions(self,
+                        obs_list: List[np.ndarray],
+                        action: np.ndarray,
+                        reward: np.ndarray,
+                        local_done: np.ndarray,
+                        max_reached: np.ndarray,
+                        next_obs_list: List[np.ndarray],
+                        prob: np.ndarray,
+                        seq_hidden_state: Optional[np.ndarray] = None):
+        """
+        Record one step of all agents
+
+        Args:
+            obs_list: List([n_agents, *obs_shapes_i], ...)
+            action: [n_agents, action_size]
+            reward: [n_agents, ]
+            local_done: [n_agents, ], bool
+            max_reached: [n_agents, ], bool
+            next_obs_list: List([n_agents, *obs_shapes_i], ...)
+            prob: [n_agents, ]
+            seq_hidden_state: [n_agents, *seq_hidden_state_shape]
+
+        Returns:
+            List of the finished episodes, each is the same as `Agent.get_episode_trans`
+        """
+        reward = np.asarray(reward)
+        local_done = np.asarray(local_done, dtype=bool)
+        max_reached = np.asarray(max_reached, dtype=bool)
+
+        self._ensure_episode_capacity(self._episode_length.max() + 1)
+
+        agent_ids = np.arange(self.n_agents)
+        i = self._episode_length
+        tmp = self._tmp_episode_trans
+        tmp['index'][agent_ids, i] = self._last_steps
+        tmp['padding_mask'][agent_ids, i] = False
+        for o, t_o in zip(tmp['obs_list'], obs_list):
+            o[agent_ids, i] = t_o
+        tmp['action'][agent_ids, i] = action
+        tmp['reward'][agent_ids, i] = reward
+        tmp['local_done'][agent_ids, i] = local_done
+        tmp['max_reached'][agent_ids, i] = max_reached
+        tmp['next_obs_list'] = [o.astype(np.float32) for o in next_obs_list]
+        tmp['prob'][agent_ids, i] = prob
+        if tmp['seq_hidden_state'] is not None:
+            tmp['seq_hidden_state'][agent_ids, i] = seq_hidden_state
+
+        self._episode_length += 1
+
+        self.reward[~self.done] += reward[~self.done]
+        self.steps[~self.done] += 1
+        self._last_reward += reward
+        self._last_steps += 1
+
+        self._extra_log(obs_list,
+                        action,
+                        reward,
+                        local_done,
+                        max_reached,
+                        next_obs_list,
+                        prob)
+
+        self.done[local_done] = True
+        self.max_reached[local_done] = max_reached[local_done]
+        self._last_reward[local_done] = 0
+        self._last_steps[local_done] = 0
+
+        finished = np.logical_or(local_done, self._episode_length == self.max_return_episode_trans)
+        episode_trans_list = [self._get_agent_episode_trans(i) for i in np.where(finished)[0]]
+        self._episode_length[finished] = 0
+
+        return episode_trans_list
+
+    @property
+    def episode_length(self):
+        return self._episode_length
+
+    def _extra_log(self,
+                   obs_list,
+                   action,
+                   reward,
+                   local_done,
+                   max_reached,
+                   next_obs_list,
+                   prob):
+        pass
+
+    def _get_agent_episode_trans(self, agent_id: int):
+        """
+        Copy the episode of one agent out of the arena, which is reused by its next episode
+
+        Returns:
+            The same as `Agent.get_episode_trans`
+        """
+        tmp = self._tmp_episode_trans
+        s = (slice(agent_id, agent_id + 1), slice(0, self._episode_length[agent_id]))
+
+        return (tmp['index'][s].copy(),
+                tmp['padding_mask'][s].copy(),
+                [o[s].copy() for o in tmp['obs_list']],
+                tmp['action'][s].copy(),
+                tmp['reward'][s].copy(),
+                [o[agent_id:agent_id + 1].copy() for o in tmp['next_obs_list']],
+                np.logical_and(tmp['local_done'][s], ~tmp['max_reached'][s]),
+                tmp['prob'][s].copy(),
+                tmp['seq_hidden_state'][s].copy() if tmp['seq_hidden_state'] is not None else None)
+
+    def get_episode_trans(self, force_length: int):
+        """
+        The last `force_length` transitions of all agents, left padded if an episode is shorter
+
+        Returns:
+            ep_indexes: [n_agents, force_length], int
+            ep_padding_masks: [n_agents, force_length], bool
+            ep_obses_list: List([n_agents, force_length, *obs_shapes_i], ...), np.float32
+            ep_actions: [n_agents, force_length, action_size], np.float32
+            ep_rewards: [n_agents, force_length], np.float32
+            next_obs_list: List([n_agents, *obs_shapes_i], ...), np.float32
+            ep_dones: [n_agents, force_length], bool
+            ep_probs: [n_agents, force_length], np.float32
+            ep_seq_hidden_states: [n_agents, force_length, *seq_hidden_state_shape], np.float32
+        """
+        pos = self._episode_length[:, None] - force_length + np.arange(force_length)  # [n_agents, force_length]
+        is_padding = pos < 0
+        pos[is_padding] = 0
+        agent_ids = np.arange(self.n_agents)[:, None]
+
+        def _gather(v, padding_value):
+            v = v[agent_ids, pos]
+            v[is_padding] = padding_value
+            return v
+
+        tmp = self._tmp_episode_trans
+
+        return (_gather(tmp['index'], -1),
+                _gather(tmp['padding_mask'], True),
+                [_gather(o, 0) for o in tmp['obs_list']],
+                _gather(tmp['action'], 0),
+                _gather(tmp['reward'], 0),
+                tmp['next_obs_list'],
+                np.logical_and(_gather(tmp['local_done'], False), ~_gather(tmp['max_reached'], False)),
+                _gather(tmp['prob'], 0),
+                _gather(tmp['seq_hidden_state'], 0) if tmp['seq_hidden_state'] is not None else None)
+
+    def is_empty(self):
+        return self._episode_length == 0
+
+    def clear(self):
+        self.reward[:] = 0
+        self.steps[:] = 0
+        self.done[:] = False
+        self.max_reached[:] = False
+        self._episode_length[:] = 0
+
+    def reset(self):
+        """
+        Agents may continue in a new iteration but save their last status
+        """
+        self.reward[:] = self._last_reward
+        self.steps[:] = self._last_steps
+        self.done[:] = False
+        self.max_reached[:] = False
+
+
 if __name__ == "__main__":
     obs_shapes = [(4,), (4, 4, 3)]
     action_size = 2
@@ -53,18 +53,24 @@ class BatchBuffer:
                                      l_probs=l_probs,
                                      l_seq_hidden_states=l_seq_hidden_states)
 
-        if self._rest_batch is not None:
-            ori_batch = traverse_lists((self._rest_batch, ori_batch), lambda rb, b: np.concatenate([rb, b]))
-            self._rest_batch = None
+        # ori_batch holds strided views of the episode,
+        # only the shuffled batches are materialized by fancy indexing
+        rest_batch = self._rest_batch
+        rest_batch_size = rest_batch[0].shape[0] if rest_batch is not None else 0
+        self._rest_batch = None
 
-        ori_batch_size = ori_batch[0].shape[0]
+        ori_batch_size = rest_batch_size + ori_batch[0].shape[0]
         idx = np.random.permutation(ori_batch_size)
-        ori_batch = traverse_lists(ori_batch, lambda b: b[idx])
 
         for i in range(math.ceil(ori_batch_size / self.batch_size)):
             b_i, b_j = i * self.batch_size, (i + 1) * self.batch_size
 
-            batch = traverse_lists(ori_batch, lambda b: b[b_i:b_j, :])
+            b_idx = idx[b_i:b_j]
+            if rest_batch is not None:
+                rb_idx, b_idx = b_idx[b_idx < rest_batch_size], b_idx[b_idx >= rest_batch_size] - rest_batch_size
+                batch = traverse_lists((rest_batch, ori_batch), lambda rb, b: np.concatenate([rb[rb_idx], b[b_idx]]))
+            else:
+                batch = traverse_lists(ori_batch, lambda b: b[b_idx])
 
             if b_j > ori_batch_size:
                 self._rest_batch = batch
@@ -1,8 +1,11 @@
 import math
+from contextlib import contextmanager
+from functools import lru_cache
 from typing import Optional, Tuple, Union
 
 import torch
 from torch import nn
+from torch.nn import functional
 
 from .linear_layers import LinearLayers
 
@@ -53,6 +56,19 @@ class MultiheadAttention(nn.MultiheadAttention):
                          dtype=dtype)
 
 
+@lru_cache(maxsize=64)
+def _get_causal_masks(key_length: int, query_length: int, device: torch.device):
+    """
+    Returns:
+        triu: [query_length, key_length], True if the key is after the query
+        not_eye: [query_length, key_length], False if the key is the query itself
+    """
+    triu = torch.triu(torch.ones(key_length, key_length, dtype=bool, device=device), diagonal=1)
+    eye = torch.eye(key_length, dtype=bool, device=device)
+
+    return triu[-query_length:], ~eye[-query_length:]
+
+
 class EpisodeMultiheadAttentionBlock(nn.Module):
     def __init__(self, embed_dim: int, num_heads: int,
                  use_residual: bool = True):
@@ -74,24 +90,39 @@ class EpisodeMultiheadAttentionBlock(nn.Module):
             key_length: int
             query_length: int
             key_padding_mask: [Batch, key_length]
-        """
-        triu = torch.triu(torch.ones(key_length, key_length, dtype=bool, device=device), diagonal=1)
-        attn_mask = triu[-query_length:]  # [query_length, key_length]
 
-        if key_padding_mask is not None:
-            batch_size = key_padding_mask.shape[0]
+        Returns:
+            attn_mask: [query_length, key_length] if key_padding_mask is None
+                       else [Batch * num_heads, query_length, key_length]
+        """
+        if key_padding_mask is None:
+            return _get_causal_masks(key_length, query_length, torch.device(device))[0]
 
-            attn_mask = attn_mask.repeat(batch_size * self.num_heads, 1, 1)  # [Batch * num_heads, query_length, key_length]
-            key_padding_mask = key_padding_mask.repeat(self.num_heads, 1)  # [Batch * num_heads, key_length]
-            key_padding_mask = key_padding_mask.unsqueeze(1)  # [Batch * num_heads, 1, key_length]
-            attn_mask = torch.logical_or(attn_mask, key_padding_mask)  # [Batch * num_heads, query_length, key_length]
-            eye = torch.eye(key_length, dtype=bool, device=device)
-            eye = ~eye[-query_length:]  # [query_length, key_length]
-            eye = eye.repeat(batch_size * self.num_heads, 1, 1)  # [Batch * num_heads, query_length, key_length]
-            attn_mask = torch.logical_and(attn_mask, eye)
+        attn_mask = self._get_batch_attn_mask(key_length, query_length, key_padding_mask)
+        if self.num_heads > 1:
+            # Batch-major as nn.MultiheadAttention expects
+            attn_mask = attn_mask.repeat_interleave(self.num_heads, dim=0)
 
         return attn_mask
 
+    def _get_batch_attn_mask(self,
+                             key_length: int,
+                             query_length: int,
+                             key_padding_mask: torch.Tensor):
+        """
+        Args:
+            key_length: int
+            query_length: int
+            key_padding_mask: [Batch, key_length]
+
+        Returns:
+            attn_mask: [Batch, query_length, key_length]
+        """
+        triu, not_eye = _get_causal_masks(key_length, query_length, key_padding_mask.device)
+
+        # A query always attends to itself even if it is padding
+        return torch.logical_and(torch.logical_or(triu, key_padding_mask.unsqueeze(1)), not_eye)
+
     def forward(self,
                 key: torch.Tensor,
                 query_length: int,
@@ -127,8 +158,134 @@ class EpisodeMultiheadAttentionBlock(nn.Module):
 
         return output, attn_weights
 
+    def project_key_value(self, key: torch.Tensor):
+        """
+        Args:
+            key: [Batch, key_length, embed_dim]
+
+        Returns:
+            projected_key: [Batch, key_length, embed_dim]
+            projected_value: [Batch, key_length, embed_dim]
+        """
+        w = self.attn.in_proj_weight[self.embed_dim:]
+        b = self.attn.in_proj_bias[self.embed_dim:] if self.attn.in_proj_bias is not None else None
+
+        return functional.linear(key, w, b).chunk(2, dim=-1)
+
+    def forward_incremental(self,
+                            query: torch.Tensor,
+                            cached_key: torch.Tensor,
+                            cached_value: torch.Tensor,
+                            key_padding_mask: torch.Tensor):
+        """
+        Attend the newest step to the projected keys / values of previous steps and itself
+
+        Args:
+            query: [Batch, 1, embed_dim]
+            cached_key: [Batch, cache_length, embed_dim], projected
+            cached_value: [Batch, cache_length, embed_dim], projected
+            key_padding_mask: [Batch, cache_length + 1]
+
+        Returns:
+            output: [Batch, 1, embed_dim]
+            attn_weights: [Batch, 1, cache_length + 1]
+            projected_key: [Batch, 1, embed_dim], the projected key of the query
+            projected_value: [Batch, 1, embed_dim], the projected value of the query
+        """
+        batch_size = query.shape[0]
+        head_dim = self.embed_dim // self.num_heads
+
+        q, k, v = functional.linear(query, self.attn.in_proj_weight, self.attn.in_proj_bias).chunk(3, dim=-1)
+        key = torch.concat([cached_key, k], dim=1)
+        value = torch.concat([cached_value, v], dim=1)
+        key_length = key.shape[1]
+
+        attn_mask = self._get_batch_attn_mask(key_length, 1, key_padding_mask)
+        attn_mask = attn_mask.unsqueeze(1)  # [Batch, 1, 1, key_length], broadcast to all heads
+
+        _q = q.view(batch_size, 1, self.num_heads, head_dim).transpose(1, 2)  # [Batch, num_heads, 1, head_dim]
+        _k = key.view(batch_size, key_length, self.num_heads, head_dim).transpose(1, 2)
+        _v = value.view(batch_size, key_length, self.num_heads, head_dim).transpose(1, 2)
+
+        attn_weights = torch.matmul(_q, _k.transpose(-2, -1)) / math.sqrt(head_dim)  # [Batch, num_heads, 1, key_length]
+        attn_weights = attn_weights.masked_fill(attn_mask, float('-inf')).softmax(dim=-1)
+
+        output = torch.matmul(attn_weights, _v)  # [Batch, num_heads, 1, head_dim]
+        output = output.transpose(1, 2).reshape(batch_size, 1, self.embed_dim)
+        output = self.attn.out_proj(output)
+
+        if self.use_residual:
+            output = output + query
+
+        return output, attn_weights.mean(dim=1), k, v
+
+
+class EpisodeKVCache:
+    """
+    Per-agent projected keys / values of previous steps in all layers of EpisodeMultiheadAttention modules,
+    so that choosing an action only feeds the newest step
+    """
+
+    def __init__(self, max_length: int = 512):
+        self.max_length = max_length  # The max number of cached steps
+
+        # {module: (key_padding_mask [Batch, cache_length],
+        #           [(key [Batch, cache_length, embed_dim], value [Batch, cache_length, embed_dim]), ...])}
+        self._caches = {}
+
+    def get(self, module: nn.Module, batch_size: int, device):
+        if module not in self._caches:
+            empty = torch.zeros(batch_size, 0, module.embed_dim, device=device)
+            self._caches[module] = (torch.zeros(batch_size, 0, dtype=torch.bool, device=device),
+                                    [(empty, empty)] * module.num_layers)
+
+        return self._caches[module]
+
+    def put(self, module: nn.Module, key_padding_mask: torch.Tensor, layer_caches):
+        """
+        Drop the steps exceeding `max_length` or masked for all agents
+        """
+        cache_length = key_padding_mask.shape[1]
+        valid = ~key_padding_mask.all(dim=0)
+        start = max(cache_length - self.max_length,
+                    int(valid.int().argmax()) if valid.any() else cache_length)
+        if start > 0:
+            key_padding_mask = key_padding_mask[:, start:]
+            layer_caches = [(key[:, start:], value[:, start:]) for key, value in layer_caches]
+
+        self._caches[module] = (key_padding_mask, layer_caches)
+
+    def reset(self, mask: torch.Tensor):
+        """
+        Mask all cached steps of agents whose episodes are done
+
+        Args:
+            mask: [Batch, ], bool, torch.Tensor or np.ndarray
+        """
+        for module, (key_padding_mask, layer_caches) in self._caches.items():
+            _mask = torch.as_tensor(mask, device=key_padding_mask.device)
+            self._caches[module] = (torch.logical_or(key_padding_mask, _mask.unsqueeze(1)), layer_caches)
+
+
+@contextmanager
+def episode_kv_cache(model: nn.Module, kv_cache: EpisodeKVCache):
+    """
+    All EpisodeMultiheadAttention modules in `model` attend incrementally with `kv_cache` in the context
+    """
+    modules = [m for m in model.modules() if isinstance(m, EpisodeMultiheadAttention)]
+    for m in modules:
+        m.kv_cache = kv_cache
+
+    try:
+        yield
+    finally:
+        for m in modules:
+            m.kv_cache = None
+
 
 class EpisodeMultiheadAttention(nn.Module):
+    kv_cache: Optional[EpisodeKVCache] = None  # Set by `episode_kv_cache()`
+
     def __init__(self, embed_dim: int, num_heads: int,
                  num_layers: int = 2,
                  use_residual: bool = True):
@@ -161,6 +318,9 @@ class EpisodeMultiheadAttention(nn.Module):
             next_hidden_state: [Batch, query_length, embed_dim * num_layers]
             attn_weights_list: List[[Batch, query_length, key_length_i], ...]
         """
+        if self.kv_cache is not None:
+            return self._forward_incremental(key, hidden_state, key_padding_mask)
+
         key_length = key.shape[1]
         assert query_length <= key_length
 
@@ -234,16 +394,74 @@ class EpisodeMultiheadAttention(nn.Module):
         else:
             return _q, torch.empty(key.shape[0], query_length, 1), attn_weights_list
 
+    def _forward_incremental(self,
+                             key: torch.Tensor,
+                             hidden_state: Optional[torch.Tensor] = None,
+                             key_padding_mask: Optional[torch.Tensor] = None):
+        """
+        The same as `forward(key_window, 1, hidden_state_window, False, key_padding_mask_window)`,
+        but keys of previous steps come from `self.kv_cache`
+
+        Args:
+            key: [Batch, 1, embed_dim], the newest step
+            hidden_state: [Batch, 1, embed_dim * (num_layers - 1)], the hidden state recorded with the newest step
+            key_padding_mask: [Batch, 1]
+        Returns:
+            encoded_query: [Batch, 1, embed_dim]
+            next_hidden_state: [Batch, 1, embed_dim * (num_layers - 1)]
+            attn_weights_list: List[[Batch, 1, key_length_i], ...]
+        """
+        assert key.shape[1] == 1
+
+        batch_size = key.shape[0]
+        if key_padding_mask is None:
+            key_padding_mask = torch.zeros(batch_size, 1, dtype=torch.bool, device=key.device)
+
+        cached_key_padding_mask, layer_caches = self.kv_cache.get(self, batch_size, key.device)
+        key_padding_mask = torch.concat([cached_key_padding_mask, key_padding_mask], dim=1)
+
+        next_hidden_state_list = []
+        attn_weights_list = []
+        next_layer_caches = []
+
+        if self.num_layers > 1:
+            if hidden_state is None:
+                hidden_state = torch.zeros(batch_size, 1, self.embed_dim * (self.num_layers - 1), device=key.device)
+            hidden_state_list = hidden_state.chunk(self.num_layers - 1, dim=-1)
+
+        output = key
+        for i, (attn, (cached_key, cached_value)) in enumerate(zip(self._attn_list, layer_caches)):
+            if i > 0:
+                next_hidden_state_list.append(output)
+
+            output, attn_weight, k, v = attn.forward_incremental(output, cached_key, cached_value,
+                                                                 key_padding_mask)
+            attn_weights_list.append(attn_weight)
+
+            # Keys of the first layer are the steps themselves,
+            # keys of the following layers are the hidden states recorded with steps
+            if i > 0:
+                k, v = attn.project_key_value(hidden_state_list[i - 1])
+            next_layer_caches.append((torch.concat([cached_key, k], dim=1),
+                                      torch.concat([cached_value, v], dim=1)))
+
+        self.kv_cache.put(self, key_padding_mask, next_layer_caches)
+
+        if self.num_layers > 1:
+            return output, torch.concat(next_hidden_state_list, dim=-1), attn_weights_list
+        else:
+            return output, torch.empty(batch_size, 1, 1), attn_weights_list
+
 
 class AbsolutePositionalEncoding(nn.Module):
     def __init__(self, d_model, max_seq_len=5000):
         super().__init__()
         self.d_model = d_model
+        pos = torch.arange(max_seq_len, dtype=torch.float64).unsqueeze(1)  # [max_seq_len, 1]
+        i = torch.arange(0, d_model, 2, dtype=torch.float64)  # [d_model / 2, ]
         pe = torch.zeros(max_seq_len, d_model)
-        for pos in range(max_seq_len):
-            for i in range(0, d_model, 2):
-                pe[pos, i] = math.sin(pos / (10000 ** ((2 * i) / d_model)))
-                pe[pos, i + 1] = math.cos(pos / (10000 ** ((2 * (i + 1)) / d_model)))
+        pe[:, 0::2] = torch.sin(pos / (10000 ** ((2 * i) / d_model)))
+        pe[:, 1::2] = torch.cos(pos / (10000 ** ((2 * (i + 1)) / d_model)))
         self.register_buffer('pe', pe)
 
     def forward(self, indexes):
@@ -65,15 +65,15 @@ class ModelPolicy(ModelBasePolicy):
         state = self.dense(state)
 
         if self.d_action_size:
-            logits = self.d_dense(state)
+            logits = self.d_dense(state).float()  # Distributions are built in fp32 under autocast
             d_policy = torch.distributions.OneHotCategorical(logits=logits)
         else:
             d_policy = None
 
         if self.c_action_size:
             l = self.c_dense(state)
-            mean = self.mean_dense(l)
-            logstd = self.logstd_dense(l)
+            mean = self.mean_dense(l).float()
+            logstd = self.logstd_dense(l).float()
             c_policy = torch.distributions.Normal(torch.tanh(mean / 5.) * 5., torch.exp(torch.clamp(logstd, -20, 0.5)))
         else:
             c_policy = None
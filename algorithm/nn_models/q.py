@@ -1,8 +1,11 @@
+import copy
+from itertools import chain
 from pathlib import Path
-from typing import Optional
+from typing import List, Optional
 
 import torch
 from torch import nn
+from torch.func import functional_call, stack_module_state, vmap
 
 from .layers import LinearLayers
 
@@ -81,3 +84,140 @@ class ModelQ(ModelBaseQ):
             c_q = None
 
         return d_q, c_q
+
+
+class EnsembleQMember(nn.Module):
+    """
+    A view of the i-th member of an `EnsembleQ`, callable like a single ModelQ.
+    The state dict is the one of the original ModelQ, so checkpoints are interchangeable.
+    train / eval and device moves are applied to the whole ensemble
+    """
+
+    def __init__(self, ensemble: 'EnsembleQ', index: int):
+        super().__init__()
+        # Not registered as a submodule, whose parameters are the ones of all members
+        self._ensemble = [ensemble]
+        self._index = index
+
+    def forward(self, state, c_action):
+        return self._ensemble[0].forward_member(self._index, state, c_action)
+
+    def parameters(self, recurse: bool = True):
+        return [p.detach()[self._index] for p in self._ensemble[0].stacked_params]
+
+    def state_dict(self, *args, **kwargs):
+        ensemble = self._ensemble[0]
+        return {n: t.detach()[self._index].clone()
+                for n, t in chain(zip(ensemble.param_names, ensemble.stacked_params),
+                                  zip(ensemble.buffer_names, ensemble.stacked_buffers))}
+
+    def load_state_dict(self, state_dict, strict: bool = True):
+        ensemble = self._ensemble[0]
+        for n, t in chain(zip(ensemble.param_names, ensemble.stacked_params),
+                          zip(ensemble.buffer_names, ensemble.stacked_buffers)):
+            t.data[self._index].copy_(state_dict[n])
+
+    def train(self, mode: bool = True):
+        super().train(mode)
+        self._ensemble[0].train(mode)
+        return self
+
+    def _apply(self, fn, *args, **kwargs):
+        self._ensemble[0]._apply(fn, *args, **kwargs)
+        return self
+
+
+class EnsembleQMemberOptimizer:
+    """
+    A view of the i-th member's state of the optimizer of an `EnsembleQ`,
+    whose state dict is the one of an optimizer of the original ModelQ, so checkpoints are interchangeable
+    """
+
+    def __init__(self, ensemble: 'EnsembleQ', optimizer: torch.optim.Optimizer, index: int):
+        self._ensemble = ensemble
+        self._optimizer = optimizer
+        self._index = index
+
+    def state_dict(self):
+        state_dict = self._optimizer.state_dict()
+        return {
+            'state': {j: {k: v[self._index].clone() if isinstance(v, torch.Tensor) and v.dim() > 0 else v
+                          for k, v in state.items()}
+                      for j, state in state_dict['state'].items()},
+            'param_groups': state_dict['param_groups']
+        }
+
+    def load_state_dict(self, state_dict):
+        for j, p in enumerate(self._ensemble.stacked_params):
+            if j not in state_dict['state']:
+                continue
+
+            state = self._optimizer.state[p]
+            for k, v in state_dict['state'][j].items():
+                if isinstance(v, torch.Tensor) and v.dim() > 0:
+                    if k not in state:
+                        state[k] = torch.zeros_like(p.detach())
+                    state[k][self._index].copy_(v)
+                else:
+                    # Scalars such as `step` are shared by all members
+                    state[k] = v.clone() if isinstance(v, torch.Tensor) else v
+
+        for group, loaded_group in zip(self._optimizer.param_groups, state_dict['param_groups']):
+            group.update({k: v for k, v in loaded_group.items() if k != 'params'})
+
+
+class EnsembleQ(nn.Module):
+    def __init__(self, model_q_list: List[ModelBaseQ]):
+        """
+        Stack parameters of all Qs and evaluate them in one vmap'd call
+
+        Returns d_q: [ensemble_q_num, Batch, ..., d_action_size] and c_q: [ensemble_q_num, Batch, ..., 1]
+        """
+        super().__init__()
+        self.d_action_size = model_q_list[0].d_action_size
+        self.c_action_size = model_q_list[0].c_action_size
+
+        params, buffers = stack_module_state(model_q_list)
+        self.param_names = list(params.keys())
+        self.stacked_params = nn.ParameterList([nn.Parameter(params[n].detach()) for n in self.param_names])
+        self.buffer_names = list(buffers.keys())
+        for i, n in enumerate(self.buffer_names):
+            self.register_buffer(f'stacked_buffer_{i}', buffers[n])
+
+        # The skeleton without storage, not registered as a submodule
+        self._base_model = [copy.deepcopy(model_q_list[0]).to('meta')]
+
+        self._vmap_forward = vmap(self._forward,
+                                  in_dims=(0, 0, None, None),
+                                  out_dims=(0 if self.d_action_size else None,
+                                            0 if self.c_action_size else None))
+
+        self.members = [EnsembleQMember(self, i) for i in range(len(model_q_list))]
+
+    @property
+    def stacked_buffers(self):
+        return [getattr(self, f'stacked_buffer_{i}') for i in range(len(self.buffer_names))]
+
+    def train(self, mode: bool = True):
+        super().train(mode)
+        self._base_model[0].train(mode)
+        return self
+
+    def member_optimizers(self, optimizer: torch.optim.Optimizer):
+        """
+        Views of each member's state of `optimizer`, which optimizes `parameters()`
+        """
+        return [EnsembleQMemberOptimizer(self, optimizer, i) for i in range(len(self.members))]
+
+    def _forward(self, params, buffers, state, c_action):
+        return functional_call(self._base_model[0], (params, buffers), (state, c_action))
+
+    def forward(self, state, c_action):
+        return self._vmap_forward(dict(zip(self.param_names, self.stacked_params)),
+                                  dict(zip(self.buffer_names, self.stacked_buffers)),
+                                  state, c_action)
+
+    def forward_member(self, index, state, c_action):
+        return self._forward({n: p[index] for n, p in zip(self.param_names, self.stacked_params)},
+                             {n: b[index] for n, b in zip(self.buffer_names, self.stacked_buffers)},
+                             state, c_action)
@@ -1,10 +1,13 @@
 import logging
 import math
+import shutil
+import tempfile
 import threading
+from pathlib import Path
 
 import numpy as np
 
-from .utils import ReadWriteLock
+from .utils import MutexLock, ReadWriteLock
 
 
 class DataStorage:
@@ -16,10 +19,18 @@ class DataStorage:
         self.capacity = capacity
         self.max_id = 10 * capacity
 
-    def add(self, data: dict):
+    def prepare(self, data: dict):
+        """
+        Preprocess data out of the lock of replay buffer,
+        returns `prepared` of `add`, None if nothing to prepare
+        """
+        return None
+
+    def add(self, data: dict, prepared=None):
         """
         args: list
             The first dimension of each element is the length of an episode
+        prepared: dict, the stored values of some keys returned by `prepare`
         """
         tmp_len = list(data.values())[0].shape[0]
 
@@ -29,17 +40,19 @@ class DataStorage:
             for k, v in data.items():
                 # Store uint8 if data is image
                 dtype = np.uint8 if len(v.shape[1:]) == 3 else v.dtype
-                self._buffer[k] = np.empty([self.capacity] + list(v.shape[1:]), dtype=dtype)
+                self._buffer[k] = self._allocate(k, [self.capacity] + list(v.shape[1:]), dtype)
 
         ids = (np.arange(tmp_len) + self._id) % self.max_id
         pointers = ids % self.capacity
 
-        self._buffer['_id'][pointers] = ids
+        self._set('_id', pointers, ids)
         for k, v in data.items():
+            if prepared is not None and k in prepared:
+                v = prepared[k]
             # Store uint8 [0, 255] if data is image
-            if len(self._buffer[k].shape[1:]) == 3:
+            elif self._is_image(k):
                 v = v * 255
-            self._buffer[k][pointers] = v
+            self._set(k, pointers, v)
 
         self._size = min(self._size + tmp_len, self.capacity)
 
@@ -49,18 +62,53 @@ class DataStorage:
 
         return pointers
 
+    def _is_image(self, key):
+        return len(self._buffer[key].shape[1:]) == 3
+
+    def _allocate(self, key, shape, dtype):
+        return np.empty(shape, dtype=dtype)
+
+    def _set(self, key, pointers, data):
+        self._buffer[key][pointers] = data
+
+    def _gather(self, key, pointers):
+        return self._buffer[key][pointers]
+
     def update(self, ids, key, data):
-        self._buffer[key][ids % self.capacity] = data
+        self._set(key, ids % self.capacity, data)
 
     def get(self, ids):
         """
         Get data from buffer without verifying whether ids in buffer
         """
-        data = {k: v[ids % self.capacity] for k, v in self._buffer.items() if k != '_id'}
+        data = {k: self._gather(k, ids % self.capacity) for k in self._buffer if k != '_id'}
 
         for k in data:
             # Restore float [0, 1] if data is image
-            if len(self._buffer[k].shape[1:]) == 3:
+            if self._is_image(k):
+                data[k] = data[k].astype(np.float32) / 255.
+
+        return data
+
+    def get_windows(self, ids, window):
+        """
+        Get [Batch, window] consecutive data from buffer in a single gather per key,
+        without verifying whether ids in buffer
+
+        Args:
+            ids: [Batch, ]
+            window: int
+
+        Returns:
+            data: dict, each value is [Batch, window, ...]
+        """
+        pointers = (np.expand_dims(ids.astype(np.int64), 1) + np.arange(window)) % self.capacity  # [Batch, window]
+
+        data = {k: self._gather(k, pointers) for k in self._buffer if k != '_id'}
+
+        for k in data:
+            # Restore float [0, 1] if data is image
+            if self._is_image(k):
                 data[k] = data[k].astype(np.float32) / 255.
 
         return data
@@ -71,6 +119,12 @@ class DataStorage:
         """
         return self._buffer['_id'][ids % self.capacity]
 
+    def is_valid(self, ids):
+        """
+        Whether data of ids are still in buffer, not overwritten by newer data
+        """
+        return self.get_ids(ids) == ids % self.max_id
+
     def copy(self, src):
         src: DataStorage = src
 
@@ -85,6 +139,34 @@ class DataStorage:
         self._size = src._size
         self._id = src._id
 
+    @property
+    def keys(self):
+        return [] if self._buffer is None else list(self._buffer.keys())
+
+    def get_raw_chunk(self, key, start, end):
+        """
+        Get a copy of stored data in [start, end) without converting images
+        """
+        return np.array(self._buffer[key][start:end])
+
+    def restore_raw_chunk(self, key, start, data):
+        """
+        Restore stored data from `start`, buffers are allocated by the first chunk of each key
+        """
+        if self._buffer is None:
+            self._buffer = dict()
+        if key not in self._buffer:
+            if key == '_id':
+                self._buffer[key] = np.empty(self.capacity, dtype=np.uint64)
+            else:
+                self._buffer[key] = self._allocate(key, [self.capacity] + list(data.shape[1:]), data.dtype)
+
+        self._buffer[key][start:start + len(data)] = data
+
+    def restore_state(self, size, _id):
+        self._size = int(size)
+        self._id = int(_id)
+
     def clear(self):
         self._size = 0
         self._id = 0
@@ -99,6 +181,274 @@ class DataStorage:
         return self._size == self.capacity
 
 
+class MemmapDataStorage(DataStorage):
+    """
+    DataStorage that keeps every key in a np.memmap file under `storage_dir`,
+    so that the capacity is limited by disk instead of memory.
+    The latest `cache_size` transitions are mirrored in RAM and served from there.
+    """
+
+    def __init__(self, capacity, storage_dir, cache_size=65536):
+        super().__init__(capacity)
+        self.storage_dir = Path(storage_dir)
+        self.storage_dir.mkdir(parents=True, exist_ok=True)
+        self.cache_size = int(min(cache_size, capacity))
+
+        self._cache = dict()
+        self._cache_ids = np.full(self.cache_size, -1, dtype=np.int64)
+
+    def _allocate(self, key, shape, dtype):
+        self._cache[key] = np.empty([self.cache_size] + list(shape[1:]), dtype=dtype)
+        return np.memmap(self.storage_dir.joinpath(f'{key}.mmap'), dtype=dtype, mode='w+', shape=tuple(shape))
+
+    def _set(self, key, pointers, data):
+        self._buffer[key][pointers] = data
+
+        ids = self._buffer['_id'][pointers].astype(np.int64)
+        slots = ids % self.cache_size
+        if key == '_id':
+            self._cache_ids[slots] = ids
+        else:
+            hit = self._cache_ids[slots] == ids
+            data = np.broadcast_to(data, (len(pointers), *self._buffer[key].shape[1:]))
+            self._cache[key][slots[hit]] = data[hit]
+
+    def _gather(self, key, pointers):
+        flat_pointers = pointers.reshape(-1)
+        ids = self._buffer['_id'][flat_pointers].astype(np.int64)
+        slots = ids % self.cache_size
+        hit = self._cache_ids[slots] == ids
+
+        buffer = self._buffer[key]
+        data = np.empty((len(flat_pointers), *buffer.shape[1:]), dtype=buffer.dtype)
+        data[hit] = self._cache[key][slots[hit]]
+        miss = ~hit
+        if miss.any():
+            data[miss] = buffer[flat_pointers[miss]]
+
+        return data.reshape(*pointers.shape, *buffer.shape[1:])
+
+    def copy(self, src):
+        src: DataStorage = src
+
+        if self._buffer is None:
+            self._buffer = dict()
+            self._buffer['_id'] = np.empty(self.capacity, dtype=np.uint64)
+            for k, v in src._buffer.items():
+                if k != '_id':
+                    self._buffer[k] = self._allocate(k, v.shape, v.dtype)
+
+        for k in self._buffer:
+            np.copyto(self._buffer[k], src._buffer[k])
+
+        self.restore_state(src._size, src._id)
+
+    def restore_state(self, size, _id):
+        super().restore_state(size, _id)
+
+        # Refill the cache with the latest transitions
+        self._cache_ids[:] = -1
+        if self._size > 0:
+            ids = (np.arange(-min(self._size, self.cache_size), 0) + self._id) % self.max_id
+            pointers = ids % self.capacity
+            self._cache_ids[ids % self.cache_size] = ids
+            for k in self._cache:
+                self._cache[k][ids % self.cache_size] = self._buffer[k][pointers]
+
+    def clear(self):
+        super().clear()
+        self._cache = dict()
+        self._cache_ids[:] = -1
+
+
+class _PreparedFrames:
+    """
+    Image frames hashed and matched against the frame pool out of the lock
+    """
+
+    def __init__(self, frames, hashes, firsts, candidates):
+        self.frames = frames  # [N, H, W, C]
+        self.hashes = hashes  # [N, ]
+        self.firsts = firsts  # [N, ], the first identical frame in `frames`
+        self.candidates = candidates  # [N, ], the identical frame in the pool, -1 if not found
+
+
+class FrameDedupDataStorage(DataStorage):
+    """
+    DataStorage that stores each unique image frame once.
+    For image keys, the buffer only keeps per-transition references into a frame pool,
+    identical frames (e.g. burn-in paddings, static scenes) share one reference-counted slot,
+    and [Batch, (window, ) H, W, C] is rebuilt by indexing the pool on sampling.
+    The frame pool starts small and grows geometrically up to `capacity`.
+    Frames are hashed in `prepare`, so that `add` only updates the frame pool.
+    """
+
+    def __init__(self, capacity, init_frame_capacity=1024):
+        super().__init__(capacity)
+        self.init_frame_capacity = int(min(init_frame_capacity, capacity))
+
+        self._frames = dict()  # key: [frame_capacity, H, W, C]
+        self._frame_ref_counts = dict()  # key: [frame_capacity, ]
+        self._frame_hashes = dict()  # key: [frame_capacity, ]
+        self._hash_to_frame = dict()  # key: {hash: frame index}
+        self._free_frames = dict()  # key: [frame index, ...]
+
+    def _is_image(self, key):
+        return key in self._frames or super()._is_image(key)
+
+    def _allocate(self, key, shape, dtype):
+        if len(shape[1:]) != 3:
+            return super()._allocate(key, shape, dtype)
+
+        self._frames[key] = np.empty([self.init_frame_capacity] + list(shape[1:]), dtype=dtype)
+        self._frame_ref_counts[key] = np.zeros(self.init_frame_capacity, dtype=np.int64)
+        self._frame_hashes[key] = np.zeros(self.init_frame_capacity, dtype=np.int64)
+        self._hash_to_frame[key] = dict()
+        self._free_frames[key] = list(range(self.init_frame_capacity - 1, -1, -1))
+
+        # Frame references, -1 indicates empty
+        return np.full(shape[0], -1, dtype=np.int64)
+
+    def _grow_frames(self, key):
+        frames = self._frames[key]
+        frame_capacity = len(frames)
+        new_frame_capacity = min(2 * frame_capacity, self.capacity)
+
+        self._frames[key] = np.empty((new_frame_capacity, *frames.shape[1:]), dtype=frames.dtype)
+        self._frames[key][:frame_capacity] = frames
+        self._frame_ref_counts[key] = np.concatenate([self._frame_ref_counts[key],
+                                                      np.zeros(new_frame_capacity - frame_capacity, dtype=np.int64)])
+        self._frame_hashes[key] = np.concatenate([self._frame_hashes[key],
+                                                  np.zeros(new_frame_capacity - frame_capacity, dtype=np.int64)])
+        self._free_frames[key] = list(range(new_frame_capacity - 1, frame_capacity - 1, -1))
+
+    def _release_frames(self, key, frame_idx):
+        frame_idx = frame_idx[frame_idx >= 0]
+        ref_counts = self._frame_ref_counts[key]
+        np.subtract.at(ref_counts, frame_idx, 1)
+
+        for i in np.unique(frame_idx[ref_counts[frame_idx] == 0]):
+            h = self._frame_hashes[key][i]
+            if self._hash_to_frame[key].get(h) == i:
+                del self._hash_to_frame[key][h]
+            self._free_frames[key].append(i)
+
+    def _prepare_frames(self, key, data):
+        """
+        Hash frames and look up identical frames in the pool,
+        which may be changed meanwhile and verified in `_insert_frames`
+        """
+        frames = self._frames.get(key)
+        if frames is not None:
+            data = np.broadcast_to(data, (len(data), *frames.shape[1:]))
+        data = np.ascontiguousarray(data, dtype=np.uint8)
+        hash_to_frame = self._hash_to_frame.get(key, {})
+
+        hashes = np.empty(len(data), dtype=np.int64)
+        firsts = np.arange(len(data))
+        candidates = np.full(len(data), -1, dtype=np.int64)
+        seen = dict()  # hash: the first frame in data
+        for j, frame in enumerate(data):
+            h = hash(frame.tobytes())
+            hashes[j] = h
+
+            f = seen.setdefault(h, j)
+            if f != j and np.array_equal(data[f], frame):
+                firsts[j] = f
+                continue
+
+            i = hash_to_frame.get(h)
+            if i is not None and i < len(frames) and np.array_equal(frames[i], frame):
+                candidates[j] = i
+
+        return _PreparedFrames(data, hashes, firsts, candidates)
+
+    def prepare(self, data: dict):
+        return {k: self._prepare_frames(k, v * 255) for k, v in data.items() if len(v.shape[1:]) == 3}
+
+    def _insert_frames(self, key, prepared_frames: _PreparedFrames):
+        hash_to_frame = self._hash_to_frame[key]
+
+        frame_idx = np.empty(len(prepared_frames.frames), dtype=np.int64)
+        for j, (h, f, i) in enumerate(zip(prepared_frames.hashes.tolist(),
+                                          prepared_frames.firsts.tolist(),
+                                          prepared_frames.candidates.tolist())):
+            if f != j:
+                i = frame_idx[f]
+            elif i == -1 or hash_to_frame.get(h) != i:
+                # Not found or released since prepared
+                if not self._free_frames[key]:
+                    self._grow_frames(key)
+                i = self._free_frames[key].pop()
+                self._frames[key][i] = prepared_frames.frames[j]
+                self._frame_hashes[key][i] = h
+                hash_to_frame[h] = i
+
+            frame_idx[j] = i
+
+        np.add.at(self._frame_ref_counts[key], frame_idx, 1)
+
+        return frame_idx
+
+    def _set(self, key, pointers, data):
+        if key not in self._frames:
+            return super()._set(key, pointers, data)
+
+        if not isinstance(data, _PreparedFrames):
+            data = self._prepare_frames(key, data)
+
+        self._release_frames(key, self._buffer[key][pointers])
+        self._buffer[key][pointers] = self._insert_frames(key, data)
+
+    def _gather(self, key, pointers):
+        if key not in self._frames:
+            return super()._gather(key, pointers)
+
+        return self._frames[key][self._buffer[key][pointers]]
+
+    def get_raw_chunk(self, key, start, end):
+        if key not in self._frames:
+            return super().get_raw_chunk(key, start, end)
+
+        return self._frames[key][self._buffer[key][start:end]]
+
+    def restore_raw_chunk(self, key, start, data):
+        if key != '_id' and len(data.shape[1:]) == 3:
+            if self._buffer is None:
+                self._buffer = dict()
+            if key not in self._buffer:
+                self._buffer[key] = self._allocate(key, [self.capacity] + list(data.shape[1:]), data.dtype)
+
+            self._set(key, np.arange(start, start + len(data)), data)
+        else:
+            super().restore_raw_chunk(key, start, data)
+
+    def copy(self, src):
+        src: FrameDedupDataStorage = src
+
+        super().copy(src)
+        self._frames = {k: v.copy() for k, v in src._frames.items()}
+        self._frame_ref_counts = {k: v.copy() for k, v in src._frame_ref_counts.items()}
+        self._frame_hashes = {k: v.copy() for k, v in src._frame_hashes.items()}
+        self._hash_to_frame = {k: v.copy() for k, v in src._hash_to_frame.items()}
+        self._free_frames = {k: v.copy() for k, v in src._free_frames.items()}
+
+    def clear(self):
+        super().clear()
+        self._frames = dict()
+        self._frame_ref_counts = dict()
+        self._frame_hashes = dict()
+        self._hash_to_frame = dict()
+        self._free_frames = dict()
+
+    @property
+    def frame_size(self):
+        """
+        The number of unique frames stored of each image key
+        """
+        return {k: int(np.count_nonzero(self._frame_ref_counts[k])) for k in self._frames}
+
+
 class SumTree:
     def __init__(self, capacity):
         capacity = int(capacity)
@@ -122,6 +472,11 @@ class SumTree:
         [--------------Parent nodes-------------][-------leaves to recode priority-------]
                     size: capacity - 1                       size: capacity
         """
+        self._max_tree = np.zeros(2 * capacity - 1, dtype=np.float32)
+        """
+        Same layout as `_tree`, but parent nodes store the max priority of their children,
+        so that the max priority is kept incrementally in `_max_tree[0]`
+        """
 
     def add(self, data_idx, p):
         self.update(data_idx, p)  # update tree_frame
@@ -129,6 +484,7 @@ class SumTree:
     def update(self, data_idx, p):
         tree_idx = self.data_idx_to_leaf_idx(data_idx)
         self._tree[tree_idx] = p
+        self._max_tree[tree_idx] = p
 
         for _ in range(self.depth - 1):
             parent_idx = (tree_idx - 1) // 2
@@ -136,6 +492,8 @@ class SumTree:
             node1 = self._tree[parent_idx * 2 + 1]
             node2 = self._tree[parent_idx * 2 + 2]
             self._tree[parent_idx] = node1 + node2
+            self._max_tree[parent_idx] = np.maximum(self._max_tree[parent_idx * 2 + 1],
+                                                    self._max_tree[parent_idx * 2 + 2])
 
             tree_idx = parent_idx
 
@@ -164,6 +522,7 @@ class SumTree:
 
     def clear(self):
         self._tree[:] = 0
+        self._max_tree[:] = 0
 
     def display(self):
         for i in range(self.depth):
@@ -172,6 +531,11 @@ class SumTree:
     def copy(self, src):
         src: SumTree = src
         np.copyto(self._tree, src._tree)
+        np.copyto(self._max_tree, src._max_tree)
+
+    def restore(self, tree, max_tree):
+        np.copyto(self._tree, tree)
+        np.copyto(self._max_tree, max_tree)
 
     @property
     def total_p(self):
@@ -179,7 +543,64 @@ class SumTree:
 
     @property
     def max(self):
-        return self._tree[self.capacity - 1:].max()
+        return self._max_tree[0]  # the root
+
+
+class VectorizedSumTree(SumTree):
+    """
+    SumTree with the same API, but propagates priorities level by level
+    without np.unique and descends the tree without boolean masking.
+    Levels that are smaller than the updated batch are recomputed as a whole.
+    """
+
+    def update(self, data_idx, p):
+        tree_idx = self.data_idx_to_leaf_idx(np.asarray(data_idx, dtype=np.int64))
+        self._tree[tree_idx] = p
+        self._max_tree[tree_idx] = p
+
+        for level in range(self.depth - 2, -1, -1):
+            level_start = 2**level - 1
+            level_size = 2**level
+
+            if level_size <= len(tree_idx):
+                # Recompute the whole level, children are contiguous
+                children = self._tree[2 * level_start + 1:2 * (level_start + level_size) + 1]
+                self._tree[level_start:level_start + level_size] = children[::2] + children[1::2]
+                children = self._max_tree[2 * level_start + 1:2 * (level_start + level_size) + 1]
+                self._max_tree[level_start:level_start + level_size] = np.maximum(children[::2], children[1::2])
+                # All upper levels are smaller, recompute them as well
+                tree_idx = np.arange(level_start, level_start + level_size)
+            else:
+                # Duplicated parents are assigned the same value, no need to unique.
+                # Only drop adjacent duplicates, which halves contiguous episode inserts
+                tree_idx = (tree_idx - 1) // 2
+                if len(tree_idx) > 1:
+                    tree_idx = tree_idx[np.concatenate([[True], tree_idx[1:] != tree_idx[:-1]])]
+                self._tree[tree_idx] = self._tree[tree_idx * 2 + 1] + self._tree[tree_idx * 2 + 2]
+                self._max_tree[tree_idx] = np.maximum(self._max_tree[tree_idx * 2 + 1],
+                                                      self._max_tree[tree_idx * 2 + 2])
+
+    def sample(self, batch_size):
+        pri_seg = self.total_p / batch_size       # priority segment
+        pri_seg_low = np.arange(batch_size)
+        pri_seg_high = pri_seg_low + 1
+        v = np.random.uniform(pri_seg_low * pri_seg, pri_seg_high * pri_seg)
+        leaf_idx = np.zeros(batch_size, dtype=np.int64)
+
+        for _ in range(self.depth - 1):
+            node1 = leaf_idx * 2 + 1
+            p1 = self._tree[node1]
+            t = np.logical_or(v <= p1, self._tree[node1 + 1] == 0)
+            leaf_idx = np.where(t, node1, node1 + 1)
+            v = np.where(t, v, v - p1)
+
+        return leaf_idx, self._tree[leaf_idx]
+
+
+SUM_TREE_ENGINES = {
+    'default': SumTree,
+    'vectorized': VectorizedSumTree
+}
 
 
 class PrioritizedReplayBuffer:
@@ -190,7 +611,15 @@ class PrioritizedReplayBuffer:
                  beta=0.4,  # Importance-sampling, from initial value increasing to 1
                  beta_increment_per_sampling=0.001,
                  td_error_min=0.01,  # Small amount to avoid zero priority
-                 td_error_max=1.):  # Clipped abs error
+                 td_error_max=1.,  # Clipped abs error
+                 sum_tree_engine='default',  # default | vectorized
+                 storage='ram',  # ram | memmap | dedup
+                 storage_dir=None,  # The directory of memmap files
+                 storage_cache_size=65536,  # Latest transitions cached in RAM if using memmap
+                 snapshot=False,  # Whether saving snapshots alongside checkpoints
+                 snapshot_compression=False,  # Whether compressing snapshot chunks
+                 snapshot_chunk_size=65536,  # The number of transitions in each snapshot chunk
+                 concurrency='rwlock'):  # rwlock | mutex
         self.batch_size = batch_size
         self.capacity = int(2**math.floor(math.log2(capacity)))
         self.alpha = alpha
@@ -198,21 +627,45 @@ class PrioritizedReplayBuffer:
         self.beta_increment_per_sampling = beta_increment_per_sampling
         self.td_error_min = td_error_min
         self.td_error_max = td_error_max
-        self._sum_tree = SumTree(self.capacity)
-        self._trans_storage = DataStorage(self.capacity)
+        self.snapshot = snapshot
+        self.snapshot_compression = snapshot_compression
+        self.snapshot_chunk_size = snapshot_chunk_size
+        self._sum_tree = SUM_TREE_ENGINES[sum_tree_engine](self.capacity)
+        self._snapshot_thread = None
+        # The number of transitions written, never reset. All transitions are written by clear, copy and restore
+        self._generation = 0
 
         self._logger = logging.getLogger('replay_buffer')
 
-        self._lock = ReadWriteLock(None, 1, 1, True, self._logger)
+        if storage == 'memmap':
+            if storage_dir is None:
+                storage_dir = tempfile.mkdtemp(prefix='replay_buffer_')
+                self._logger.warning(f'storage_dir is not specified, memmap files are stored in {storage_dir}')
+            self._trans_storage = MemmapDataStorage(self.capacity, storage_dir, storage_cache_size)
+        elif storage == 'dedup':
+            self._trans_storage = FrameDedupDataStorage(self.capacity)
+        else:
+            self._trans_storage = DataStorage(self.capacity)
+
+        # mutex: a plain lock for add / sample / update,
+        # and size / is_full are read without locking
+        self._lock_free_size = concurrency == 'mutex'
+        if concurrency == 'mutex':
+            self._lock = MutexLock()
+        else:
+            self._lock = ReadWriteLock(None, 1, 1, True, self._logger)
 
     def add(self, transitions: dict, ignore_size=0):
+        prepared = self._trans_storage.prepare(transitions)
+
         with self._lock.write():
             if self._trans_storage.size == 0:
                 max_p = self.td_error_max
             else:
                 max_p = self._sum_tree.max
 
-            data_pointers = self._trans_storage.add(transitions)
+            data_pointers = self._trans_storage.add(transitions, prepared)
+            self._generation += len(data_pointers)
             probs = np.full(len(data_pointers), max_p, dtype=np.float32)
 
             if ignore_size > 0:
@@ -225,8 +678,11 @@ class PrioritizedReplayBuffer:
         td_error = np.asarray(td_error)
         td_error = td_error.flatten()
 
+        prepared = self._trans_storage.prepare(transitions)
+
         with self._lock.write():
-            data_pointers = self._trans_storage.add(transitions)
+            data_pointers = self._trans_storage.add(transitions, prepared)
+            self._generation += len(data_pointers)
             clipped_errors = np.clip(td_error, self.td_error_min, self.td_error_max)
             if np.isnan(np.min(clipped_errors)):
                 self._logger.error('td_error has nan')
@@ -240,6 +696,17 @@ class PrioritizedReplayBuffer:
                 probs[-ignore_size:] = 0
             self._sum_tree.add(data_pointers, probs)
 
+    def _sample_data_pointers(self, batch_size):
+        leaf_pointers, p = self._sum_tree.sample(batch_size)
+
+        data_pointers = self._sum_tree.leaf_idx_to_data_idx(leaf_pointers)
+
+        is_weights = p / self._sum_tree.total_p
+        self.beta = np.min([1., self.beta + self.beta_increment_per_sampling])  # max = 1
+        is_weights = np.power(is_weights / np.min(is_weights), -self.beta).astype(np.float32)
+
+        return data_pointers, np.expand_dims(is_weights, axis=1)
+
     def sample(self):
         """
         Returns:
@@ -251,17 +718,33 @@ class PrioritizedReplayBuffer:
             if self._trans_storage.size < self.batch_size:
                 return None
 
-            leaf_pointers, p = self._sum_tree.sample(self.batch_size)
-
-            data_pointers = self._sum_tree.leaf_idx_to_data_idx(leaf_pointers)
+            data_pointers, is_weights = self._sample_data_pointers(self.batch_size)
             transitions = self._trans_storage.get(data_pointers)
             data_ids = self._trans_storage.get_ids(data_pointers)
 
-            is_weights = p / self._sum_tree.total_p
-            self.beta = np.min([1., self.beta + self.beta_increment_per_sampling])  # max = 1
-            is_weights = np.power(is_weights / np.min(is_weights), -self.beta).astype(np.float32)
+            return data_ids, transitions, is_weights
+
+    def sample_windows(self, batch_size=None, window=1):
+        """
+        Sample `batch_size` start points and gather `window` consecutive transitions
+        from each of them under one read lock
+
+        Returns:
+            data index: [Batch, ]
+            transitions: dict, each value is [Batch, window, ...]
+            priority weights: [Batch, 1]
+        """
+        batch_size = self.batch_size if batch_size is None else batch_size
+
+        with self._lock.read():
+            if self._trans_storage.size < batch_size:
+                return None
 
-            return data_ids, transitions, np.expand_dims(is_weights, axis=1)
+            data_pointers, is_weights = self._sample_data_pointers(batch_size)
+            data_ids = self._trans_storage.get_ids(data_pointers)
+            transitions = self._trans_storage.get_windows(data_ids, window)
+
+            return data_ids, transitions, is_weights
 
     def get_storage_data(self, data_ids):
         """
@@ -275,6 +758,9 @@ class PrioritizedReplayBuffer:
             return self._trans_storage.get_ids(data_ids)
 
     def update(self, data_ids, td_error):
+        """
+        Data overwritten since sampled are skipped
+        """
         with self._lock.write():
             td_error = np.asarray(td_error)
             td_error = td_error.flatten()
@@ -286,33 +772,162 @@ class PrioritizedReplayBuffer:
 
             probs = np.power(clipped_errors, self.alpha)
 
-            self._sum_tree.update(data_ids % self.capacity, probs)
+            valid = self._trans_storage.is_valid(data_ids)
+            self._sum_tree.update(data_ids[valid] % self.capacity, probs[valid])
 
     def update_transitions(self, data_ids, key, data):
+        """
+        Data overwritten since sampled are skipped
+        """
         with self._lock.write():
-            self._trans_storage.update(data_ids, key, data)
+            valid = self._trans_storage.is_valid(data_ids)
+            self._trans_storage.update(data_ids[valid], key, data[valid])
 
     def clear(self):
         self._trans_storage.clear()
         self._sum_tree.clear()
+        self._generation += self.capacity
 
     def copy(self, src):
         with self._lock.write(), src._lock.write():
             self._trans_storage.copy(src._trans_storage)
             self._sum_tree.copy(src._sum_tree)
+            self._generation += self.capacity
+
+    def save_snapshot(self, snapshot_path):
+        """
+        Save transitions, priorities and pointers into the directory `snapshot_path`.
+        Each key is written in chunks of `snapshot_chunk_size` transitions.
+        Each chunk is copied under its own read lock and written before the next one,
+        so that writers only wait for one chunk and memmap storages are not copied into memory.
+        Chunks overwritten by transitions added meanwhile, counted by `_generation`,
+        are copied again with the sum tree and pointers under one read lock at last.
+        Other snapshots in the same parent directory are removed after saving.
+        """
+        snapshot_path = Path(snapshot_path)
+        tmp_snapshot_path = snapshot_path.with_name(snapshot_path.name + '.tmp')
+        shutil.rmtree(tmp_snapshot_path, ignore_errors=True)
+        tmp_snapshot_path.mkdir(parents=True)
+
+        chunk_size = self.snapshot_chunk_size
+        save = np.savez_compressed if self.snapshot_compression else np.savez
+
+        def save_chunk(key, start, chunk):
+            save(tmp_snapshot_path.joinpath(f'{key}.{start // chunk_size}.npz'), data=chunk)
+
+        with self._lock.read():
+            generation = self._generation
+            size = self._trans_storage.size
+            _id = self._trans_storage._id
+            keys = self._trans_storage.keys
+
+        for k in keys:
+            for start in range(0, size, chunk_size):
+                with self._lock.read():
+                    chunk = self._trans_storage.get_raw_chunk(k, start, start + chunk_size)
+                save_chunk(k, start, chunk)
+
+        with self._lock.read():
+            n_written = self._generation - generation
+            size = self._trans_storage.size
+            if n_written >= self.capacity or self._trans_storage.keys != keys:
+                dirty_starts = range(0, size, chunk_size)
+            else:
+                # Transitions are written from the pointer `_id` in a ring
+                dirty_pointers = (_id + np.arange(n_written)) % self.capacity
+                dirty_starts = np.unique(dirty_pointers // chunk_size) * chunk_size
+            _id = self._trans_storage._id
+            keys = self._trans_storage.keys
+            tree = self._sum_tree._tree.copy()
+            max_tree = self._sum_tree._max_tree.copy()
+            dirty_chunks = [(k, start, self._trans_storage.get_raw_chunk(k, start, start + chunk_size))
+                            for k in keys for start in dirty_starts]
+
+        for k, start, chunk in dirty_chunks:
+            save_chunk(k, start, chunk)
+
+        np.savez(tmp_snapshot_path.joinpath('meta.npz'),
+                 capacity=self.capacity,
+                 size=size,
+                 id=_id,
+                 beta=self.beta,
+                 keys=np.array(keys),
+                 chunk_size=self.snapshot_chunk_size,
+                 tree=tree,
+                 max_tree=max_tree)
+
+        shutil.rmtree(snapshot_path, ignore_errors=True)
+        tmp_snapshot_path.rename(snapshot_path)
+
+        for p in snapshot_path.parent.glob(f'*{snapshot_path.suffix}'):
+            if p != snapshot_path:
+                shutil.rmtree(p, ignore_errors=True)
+
+        self._logger.info(f'Replay buffer snapshot saved at {snapshot_path}')
+
+    def save_snapshot_async(self, snapshot_path):
+        """
+        Save snapshot in a background thread.
+        Skipped if the previous snapshot is still being written.
+        """
+        if self._snapshot_thread is not None and self._snapshot_thread.is_alive():
+            self._logger.warning(f'The previous snapshot is still being saved, {snapshot_path} skipped')
+            return False
+
+        self._snapshot_thread = threading.Thread(target=self.save_snapshot, args=(snapshot_path, ))
+        self._snapshot_thread.start()
+        return True
+
+    def wait_snapshot(self):
+        if self._snapshot_thread is not None:
+            self._snapshot_thread.join()
+
+    def load_snapshot(self, snapshot_path):
+        snapshot_path = Path(snapshot_path)
+        meta = np.load(snapshot_path.joinpath('meta.npz'))
+
+        if int(meta['capacity']) != self.capacity:
+            self._logger.warning(f'Capacity of {snapshot_path} is {int(meta["capacity"])}, '
+                                 f'not {self.capacity}, snapshot ignored')
+            return False
+
+        with self._lock.write():
+            self._trans_storage.clear()
+            size = int(meta['size'])
+            chunk_size = int(meta['chunk_size'])
+            for k in meta['keys']:
+                for i, start in enumerate(range(0, size, chunk_size)):
+                    with np.load(snapshot_path.joinpath(f'{k}.{i}.npz')) as f:
+                        self._trans_storage.restore_raw_chunk(str(k), start, f['data'])
+            self._trans_storage.restore_state(size, meta['id'])
+            self._sum_tree.restore(meta['tree'], meta['max_tree'])
+            self.beta = float(meta['beta'])
+            self._generation += self.capacity
+
+        self._logger.info(f'Replay buffer restored from {snapshot_path}, size: {size}')
+        return True
 
     @property
     def is_full(self):
+        if self._lock_free_size:
+            return self._trans_storage.is_full
+
         with self._lock.read():
             return self._trans_storage.is_full
 
     @property
     def size(self):
+        if self._lock_free_size:
+            return self._trans_storage.size
+
         with self._lock.read():
             return self._trans_storage.size
 
     @property
     def is_lg_batch_size(self):
+        if self._lock_free_size:
+            return self._trans_storage.size > self.batch_size
+
         with self._lock.read():
             return self._trans_storage.size > self.batch_size
 
@@ -1,6 +1,10 @@
+import functools
 import logging
 import math
+import queue
+import threading
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from itertools import chain
 from pathlib import Path
 from typing import List, Optional, Tuple
@@ -17,6 +21,32 @@ from .replay_buffer import PrioritizedReplayBuffer
 from .utils import *
 
 
+@functools.lru_cache(maxsize=None)
+def get_normalized_model_rep_class(model_rep_class):
+    """
+    The class is created once per representation class and the normalizer is held by instances,
+    so compiled graphs are shared between instances
+    """
+    class NormalizedModelRep(model_rep_class):
+        def __init__(self, *args, normalizer, **kwargs):
+            super().__init__(*args, **kwargs)
+            self._normalizer_step, self._running_means, self._running_variances = normalizer
+
+        def forward(self, obs_list, *args, **kwargs):
+            obs_list = [
+                torch.clamp(
+                    (obs - mean) / torch.sqrt(variance / (self._normalizer_step + 1)),
+                    -5, 5
+                ) for obs, mean, variance in zip(obs_list,
+                                                 self._running_means,
+                                                 self._running_variances)
+            ]
+
+            return super().forward(obs_list, *args, **kwargs)
+
+    return NormalizedModelRep
+
+
 class SAC_Base(object):
     def __init__(self,
                  obs_shapes: List[Tuple],
@@ -36,9 +66,12 @@ class SAC_Base(object):
 
                  use_replay_buffer: bool = True,
                  use_priority: bool = True,
+                 async_write_back: bool = False,
+                 prefetch_batches: int = 0,
 
                  ensemble_q_num: int = 2,
                  ensemble_q_sample: int = 2,
+                 fused_ensemble_q: bool = False,
 
                  burn_in_step: int = 0,
                  n_step: int = 1,
@@ -71,6 +104,8 @@ class SAC_Base(object):
                  use_normalization: bool = False,
                  use_add_with_td: bool = False,
                  action_noise: Optional[List[float]] = None,
+                 mixed_precision: Optional[str] = None,
+                 use_compile: bool = False,
 
                  replay_config=None):
         """
@@ -89,6 +124,7 @@ class SAC_Base(object):
 
         ensemble_q_num: 2 # Number of Qs
         ensemble_q_sample: 2 # Number of min Qs
+        fused_ensemble_q: Whether evaluating all Qs in one vmap'd call with a single optimizer
 
         burn_in_step: Burn-in steps in R2D2
         n_step: Update Q function by `n_step` steps
@@ -107,6 +143,10 @@ class SAC_Base(object):
         clip_epsilon: Epsilon for q clip
 
         use_priority: If using PER importance ratio
+        async_write_back: If reusing the training forward to refresh priorities, mu_probs and seq_hidden_states,
+            and writing them back to the replay buffer in a background thread
+        prefetch_batches: Number of batches sampled and copied to the device ahead by a background thread,
+            0 to sample in `train`
         use_n_step_is: If using importance sampling
         siamese: ATC | BYOL
         siamese_use_q: If using contrastive q
@@ -120,6 +160,8 @@ class SAC_Base(object):
         rnd_n_sample: RND sample times
         use_normalization: If using observation normalization
         use_add_with_td: If add transitions in replay buffer with td-error
+        mixed_precision: None | bf16 | fp16, training under autocast with gradient scaling
+        use_compile: If compiling representation, policy and Q models with torch.compile
         """
         self.obs_shapes = obs_shapes
         self.d_action_size = d_action_size
@@ -129,9 +171,16 @@ class SAC_Base(object):
 
         self.use_replay_buffer = use_replay_buffer
         self.use_priority = use_priority
+        self.async_write_back = async_write_back
+        self._write_back_future = None
+        self.prefetch_batches = prefetch_batches
+        self._prefetch_queue = queue.Queue(maxsize=max(prefetch_batches, 1))
+        self._prefetch_thread = None
+        self._prefetch_stopped = threading.Event()
 
         self.ensemble_q_num = ensemble_q_num
         self.ensemble_q_sample = ensemble_q_sample
+        self.fused_ensemble_q = fused_ensemble_q
 
         self.burn_in_step = burn_in_step
         self.n_step = n_step
@@ -164,12 +213,16 @@ class SAC_Base(object):
         self.use_normalization = use_normalization
         self.use_add_with_td = use_add_with_td
         self.action_noise = action_noise
+        self.mixed_precision = mixed_precision
+        self.use_compile = use_compile
 
         if device is None:
             self.device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
         else:
             self.device = torch.device(device)
 
+        self._init_mixed_precision()
+
         if seed is not None:
             torch.manual_seed(seed)
             torch.cuda.manual_seed_all(seed)
@@ -182,8 +235,14 @@ class SAC_Base(object):
 
         if self.train_mode:
             if self.use_replay_buffer:
-                replay_config = {} if replay_config is None else replay_config
+                replay_config = {} if replay_config is None else dict(replay_config)
+                if replay_config.get('storage') == 'memmap' and replay_config.get('storage_dir') is None and model_abs_dir:
+                    replay_config['storage_dir'] = Path(model_abs_dir).joinpath('replay_buffer')
                 self.replay_buffer = PrioritizedReplayBuffer(batch_size=batch_size, **replay_config)
+                if self.async_write_back:
+                    # A single worker keeps write-backs in order
+                    self._write_back_executor = ThreadPoolExecutor(max_workers=1,
+                                                                   thread_name_prefix='write_back')
             else:
                 self.batch_buffer = BatchBuffer(self.burn_in_step,
                                                 self.n_step,
@@ -194,6 +253,21 @@ class SAC_Base(object):
         self._build_model(model, model_config, init_log_alpha, learning_rate)
         self._init_or_restore(int(last_ckpt) if last_ckpt is not None else None)
 
+    def _init_mixed_precision(self):
+        self._autocast_dtype = {
+            None: None,
+            'bf16': torch.bfloat16,
+            'fp16': torch.float16
+        }[self.mixed_precision]
+
+        # Gradient scaling is only needed by fp16, whose exponent range is narrow
+        self._grad_scaler = torch.amp.GradScaler(self.device.type, enabled=self.mixed_precision == 'fp16')
+
+    def _autocast(self):
+        return torch.autocast(self.device.type,
+                              dtype=self._autocast_dtype,
+                              enabled=self._autocast_dtype is not None)
+
     def _build_model(self, model, model_config: Optional[dict], init_log_alpha: float, learning_rate: float):
         """
         Initialize variables, network models and optimizers
@@ -223,20 +297,8 @@ class SAC_Base(object):
                 self.running_means.append(torch.zeros(shape, device=self.device))
                 self.running_variances.append(torch.ones(shape, device=self.device))
 
-            p_self = self
-
-            class ModelRep(model.ModelRep):
-                def forward(self, obs_list, *args, **kwargs):
-                    obs_list = [
-                        torch.clamp(
-                            (obs - mean) / torch.sqrt(variance / (p_self.normalizer_step + 1)),
-                            -5, 5
-                        ) for obs, mean, variance in zip(obs_list,
-                                                         p_self.running_means,
-                                                         p_self.running_variances)
-                    ]
-
-                    return super().forward(obs_list, *args, **kwargs)
+            ModelRep = functools.partial(get_normalized_model_rep_class(model.ModelRep),
+                                         normalizer=(self.normalizer_step, self.running_means, self.running_variances))
         else:
             ModelRep = model.ModelRep
 
@@ -323,7 +385,23 @@ class SAC_Base(object):
             for param in model_target_q.parameters():
                 param.requires_grad = False
 
-        self.optimizer_q_list = [adam_optimizer(self.model_q_list[i].parameters()) for i in range(self.ensemble_q_num)]
+        if self.fused_ensemble_q and self.siamese_use_q:
+            self._logger.warning('fused_ensemble_q is not supported with siamese_use_q, falling back to separate Qs')
+            self.fused_ensemble_q = False
+
+        if self.fused_ensemble_q:
+            self.model_q_ensemble = EnsembleQ(self.model_q_list)
+            self.model_target_q_ensemble = EnsembleQ(self.model_target_q_list)
+            for param in self.model_target_q_ensemble.parameters():
+                param.requires_grad = False
+
+            # Members are views of the stacked parameters
+            self.model_q_list = self.model_q_ensemble.members
+            self.model_target_q_list = self.model_target_q_ensemble.members
+
+            self.optimizer_q_list = [adam_optimizer(self.model_q_ensemble.parameters())]
+        else:
+            self.optimizer_q_list = [adam_optimizer(self.model_q_list[i].parameters()) for i in range(self.ensemble_q_num)]
 
         """ POLICY """
         self.model_policy: ModelBasePolicy = model.ModelPolicy(state_size, self.d_action_size, self.c_action_size,
@@ -396,6 +474,41 @@ class SAC_Base(object):
                 param.requires_grad = False
             self.optimizer_rnd = adam_optimizer(self.model_rnd.parameters())
 
+        """ COMPILE """
+        if self.use_compile:
+            # Losses are backpropagated with retain_graph=True, which donated buffers do not support
+            torch._functorch.config.donated_buffer = False
+
+            # Modules are compiled in place, so state dicts and parameters are untouched
+            self.model_rep.compile(dynamic=False)
+            self.model_target_rep.compile(dynamic=False)
+            self.model_policy.compile(dynamic=False)
+            if self.fused_ensemble_q:
+                self.model_q_ensemble.compile(dynamic=False)
+                self.model_target_q_ensemble.compile(dynamic=False)
+            else:
+                for model_q in chain(self.model_q_list, self.model_target_q_list):
+                    model_q.compile(dynamic=False)
+
+        """ TARGET NETWORKS """
+        target = self.model_target_rep.parameters()
+        source = self.model_rep.parameters()
+
+        if self.fused_ensemble_q:
+            target = chain(target, self.model_target_q_ensemble.parameters())
+            source = chain(source, self.model_q_ensemble.parameters())
+        else:
+            for i in range(self.ensemble_q_num):
+                target = chain(target, self.model_target_q_list[i].parameters())
+                source = chain(source, self.model_q_list[i].parameters())
+
+        if self.siamese == SIAMESE.BYOL:
+            target = chain(target, *[t_pro.parameters() for t_pro in self.model_target_rep_projection_list])
+            source = chain(source, *[pro.parameters() for pro in self.model_rep_projection_list])
+
+        self._target_params = list(target)
+        self._source_params = list(source)
+
     def _init_or_restore(self, last_ckpt: int):
         """
         Initialize network weights from scratch or restore from model_abs_dir
@@ -418,10 +531,15 @@ class SAC_Base(object):
             ckpt_dict['optimizer_rep'] = self.optimizer_rep
 
         """ Q """
+        # Fused Qs are saved as separate ones, so that checkpoints are interchangeable
+        if self.fused_ensemble_q:
+            optimizer_q_list = self.model_q_ensemble.member_optimizers(self.optimizer_q_list[0])
+        else:
+            optimizer_q_list = self.optimizer_q_list
         for i in range(self.ensemble_q_num):
             ckpt_dict[f'model_q_{i}'] = self.model_q_list[i]
             ckpt_dict[f'model_target_q_{i}'] = self.model_target_q_list[i]
-            ckpt_dict[f'optimizer_q_{i}'] = self.optimizer_q_list[i]
+            ckpt_dict[f'optimizer_q_{i}'] = optimizer_q_list[i]
 
         """ POLICY """
         ckpt_dict['model_policy'] = self.model_policy
@@ -503,6 +621,11 @@ class SAC_Base(object):
                                 model.eval()
 
                 self._logger.info(f'Restored from {ckpt_restore_path}')
+
+                if self.train_mode and self.use_replay_buffer:
+                    snapshot_path = ckpt_dir.joinpath(f'{last_ckpt}.replay')
+                    if snapshot_path.exists():
+                        self.replay_buffer.load_snapshot(snapshot_path)
             else:
                 self._logger.info('Initializing from scratch')
                 self._update_target_variables()
@@ -518,6 +641,10 @@ class SAC_Base(object):
             }, ckpt_path)
             self._logger.info(f"Model saved at {ckpt_path}")
 
+            if self.train_mode and self.use_replay_buffer and self.replay_buffer.snapshot:
+                self.wait_write_back()
+                self.replay_buffer.save_snapshot_async(self.ckpt_dir.joinpath(f'{global_step}.replay'))
+
     def write_constant_summaries(self, constant_summaries, iteration=None):
         """
         Write constant information from sac_main.py, such as reward, iteration, etc.
@@ -560,21 +687,11 @@ class SAC_Base(object):
         """
         Soft (momentum) update target networks (default hard)
         """
-        target = self.model_target_rep.parameters()
-        source = self.model_rep.parameters()
-
-        for i in range(self.ensemble_q_num):
-            target = chain(target, self.model_target_q_list[i].parameters())
-            source = chain(source, self.model_q_list[i].parameters())
-
-        if self.siamese == 'BYOL':
-            target = chain(target, *[t_pro.parameters() for t_pro in self.model_target_rep_projection_list])
-            source = chain(source, *[pro.parameters() for pro in self.model_rep_projection_list])
-
-        for target_param, param in zip(target, source):
-            target_param.data.copy_(
-                target_param.data * (1. - tau) + param.data * tau
-            )
+        if tau == 1.:
+            torch._foreach_copy_(self._target_params, self._source_params)
+        else:
+            # target = target * (1 - tau) + source * tau
+            torch._foreach_lerp_(self._target_params, self._source_params, tau)
 
     @torch.no_grad()
     def _udpate_normalizer(self, obs_list: List[torch.Tensor]):
@@ -599,34 +716,36 @@ class SAC_Base(object):
                     l_padding_masks: torch.Tensor,
                     l_obses_list: List[torch.Tensor],
                     l_actions: torch.Tensor,
-                    f_seq_hidden_states: torch.Tensor = None):
+                    f_seq_hidden_states: torch.Tensor = None,
+                    l_states: torch.Tensor = None):
         """
         Args:
             l_indexes: [Batch, l]
             l_padding_masks: [Batch, l]
             l_obses_list: list([Batch, l, *obs_shapes_i], ...)
-            l_states: [Batch, l, state_size]
             l_actions: [Batch, l, action_size]
             f_seq_hidden_states: [Batch, 1, *seq_hidden_state_shape]
+            l_states: [Batch, l, state_size], skip the representation model if given
 
         Returns:
             l_probs: [Batch, l]
         """
 
-        if self.seq_encoder == SEQ_ENCODER.RNN:
-            l_states, _ = self.model_rep(l_obses_list,
-                                         gen_pre_n_actions(l_actions),
-                                         f_seq_hidden_states[:, 0])
-        elif self.seq_encoder == SEQ_ENCODER.ATTN:
-            l_states, *_ = self.model_rep(l_indexes,
-                                          l_obses_list,
-                                          gen_pre_n_actions(l_actions),
-                                          query_length=l_indexes.shape[1],
-                                          hidden_state=f_seq_hidden_states,
-                                          is_prev_hidden_state=True,
-                                          padding_mask=l_padding_masks)
-        else:
-            l_states = self.model_rep(l_obses_list)
+        if l_states is None:
+            if self.seq_encoder == SEQ_ENCODER.RNN:
+                l_states, _ = self.model_rep(l_obses_list,
+                                             gen_pre_n_actions(l_actions),
+                                             f_seq_hidden_states[:, 0])
+            elif self.seq_encoder == SEQ_ENCODER.ATTN:
+                l_states, *_ = self.model_rep(l_indexes,
+                                              l_obses_list,
+                                              gen_pre_n_actions(l_actions),
+                                              query_length=l_indexes.shape[1],
+                                              hidden_state=f_seq_hidden_states,
+                                              is_prev_hidden_state=True,
+                                              padding_mask=l_padding_masks)
+            else:
+                l_states = self.model_rep(l_obses_list)
         #  l_states: [Batch, l, state_size]
 
         d_policy, c_policy = self.model_policy(l_states, l_obses_list)
@@ -687,6 +806,29 @@ class SAC_Base(object):
 
             return l_attn_states
 
+    def _get_stacked_q(self, state: torch.Tensor, c_action: torch.Tensor, target: bool = False):
+        """
+        Args:
+            state: [Batch, ..., state_size]
+            c_action: [Batch, ..., c_action_size]
+            target: If using target Qs
+
+        Returns:
+            d_q: [ensemble_q_num, Batch, ..., d_action_size]
+            c_q: [ensemble_q_num, Batch, ..., 1]
+        """
+        if self.fused_ensemble_q:
+            model_q_ensemble = self.model_target_q_ensemble if target else self.model_q_ensemble
+            return model_q_ensemble(state, c_action)
+
+        model_q_list = self.model_target_q_list if target else self.model_q_list
+        q_list = [q(state, c_action) for q in model_q_list]
+
+        d_q = torch.stack([q[0] for q in q_list]) if self.d_action_size else None
+        c_q = torch.stack([q[1] for q in q_list]) if self.c_action_size else None
+
+        return d_q, c_q
+
     @torch.no_grad()
     def get_dqn_like_d_y(self,
                          n_rewards: torch.Tensor,
@@ -719,7 +861,7 @@ class SAC_Base(object):
         # [ensemble_q_sample, Batch, 1]
 
         next_q, _ = torch.min(stacked_max_next_target_q, dim=0)
-        # [Batch, 1]
+        next_q = next_q.float()  # [Batch, 1]
 
         g = torch.sum(self._gamma_ratio * n_rewards, dim=-1, keepdim=True)  # [Batch, 1]
         y = g + self.gamma**self.n_step * next_q * ~done  # [Batch, 1]
@@ -743,6 +885,11 @@ class SAC_Base(object):
             y: [Batch, 1]
         """
 
+        # V-trace products are kept in fp32 under mixed precision
+        v, next_v = v.float(), next_v.float()
+        if n_pi_probs is not None:
+            n_pi_probs = n_pi_probs.float()
+
         td_error = n_rewards + self.gamma * ~n_dones * next_v - v  # [Batch, n]
         td_error = self._gamma_ratio * td_error
 
@@ -772,21 +919,18 @@ class SAC_Base(object):
 
     @torch.no_grad()
     def _get_y(self,
-               n_obses_list: List[torch.Tensor],
-               n_states: torch.Tensor,
+               m_obses_list: List[torch.Tensor],
+               m_states: torch.Tensor,
                n_actions: torch.Tensor,
                n_rewards: torch.Tensor,
-               next_obs_list: List[torch.Tensor],
-               next_state: torch.Tensor,
                n_dones: torch.Tensor,
                n_mu_probs: torch.Tensor = None):
         """
         Args:
-            n_obses_list: list([Batch, n, *obs_shapes_i], ...)
-            n_states: [Batch, n, state_size]
+            m_obses_list: list([Batch, n + 1, *obs_shapes_i], ...)
+            m_states: [Batch, n + 1, state_size]
             n_actions: [Batch, n, action_size]
             n_rewards: [Batch, n]
-            state_: [Batch, state_size]
             n_dones: [Batch, n], dtype=torch.bool
             n_mu_probs: [Batch, n]
 
@@ -797,12 +941,12 @@ class SAC_Base(object):
         d_alpha = torch.exp(self.log_d_alpha)
         c_alpha = torch.exp(self.log_c_alpha)
 
-        next_n_obses_list = [torch.cat([n_obses[:, 1:, ...], next_obs.unsqueeze(1)], dim=1)
-                             for n_obses, next_obs in zip(n_obses_list, next_obs_list)]
-        next_n_states = torch.cat([n_states[:, 1:, ...], next_state.unsqueeze(1)], dim=1)  # [Batch, n, state_size]
+        n_states = m_states[:, :-1, ...]  # [Batch, n, state_size]
+        next_n_states = m_states[:, 1:, ...]  # [Batch, n, state_size]
 
-        d_policy, c_policy = self.model_policy(n_states, n_obses_list)
-        next_d_policy, next_c_policy = self.model_policy(next_n_states, next_n_obses_list)
+        # Policy and target Qs are evaluated once over the merged sequence,
+        # [:, :-1] are for current states and [:, 1:] are for next states
+        m_d_policy, m_c_policy = self.model_policy(m_states, m_obses_list)
 
         if self.curiosity is not None:
             if self.curiosity == CURIOSITY.FORWARD:
@@ -817,45 +961,37 @@ class SAC_Base(object):
             n_rewards += in_n_rewards  # [Batch, n]
 
         if self.c_action_size:
-            n_c_actions_sampled = c_policy.rsample()  # [Batch, n, action_size]
-            next_n_c_actions_sampled = next_c_policy.rsample()  # [Batch, n, action_size]
+            m_c_actions_sampled = m_c_policy.rsample()  # [Batch, n + 1, action_size]
         else:
-            n_c_actions_sampled = torch.empty(0, device=self.device)
-            next_n_c_actions_sampled = torch.empty(0, device=self.device)
-
-        # ([Batch, n, action_size], [Batch, n, 1])
-        q_list = [q(n_states, torch.tanh(n_c_actions_sampled)) for q in self.model_target_q_list]
-        next_q_list = [q(next_n_states, torch.tanh(next_n_c_actions_sampled)) for q in self.model_target_q_list]
+            m_c_actions_sampled = torch.empty(0, device=self.device)
 
-        d_q_list = [q[0] for q in q_list]  # [Batch, n, action_size]
-        c_q_list = [q[1] for q in q_list]  # [Batch, n, 1]
-
-        next_d_q_list = [q[0] for q in next_q_list]  # [Batch, n, action_size]
-        next_c_q_list = [q[1] for q in next_q_list]  # [Batch, n, 1]
+        m_d_q, m_c_q = self._get_stacked_q(m_states, torch.tanh(m_c_actions_sampled), target=True)
+        # [ensemble_q_num, Batch, n + 1, action_size], [ensemble_q_num, Batch, n + 1, 1]
 
         d_y, c_y = None, None
 
         if self.d_action_size:
-            stacked_next_d_q = torch.stack(next_d_q_list)[torch.randperm(self.ensemble_q_num)[:self.ensemble_q_sample]]
+            stacked_next_d_q = m_d_q[:, :, 1:, ...][torch.randperm(self.ensemble_q_num)[:self.ensemble_q_sample]]
             # [ensemble_q_num, Batch, n, d_action_size] -> [ensemble_q_sample, Batch, n, d_action_size]
 
             if self.discrete_dqn_like:
-                next_d_eval_q_list = [q(next_n_states, torch.tanh(next_n_c_actions_sampled))[0] for q in self.model_q_list]
-                stacked_next_d_eval_q = torch.stack(next_d_eval_q_list)[torch.randperm(self.ensemble_q_num)[:self.ensemble_q_sample]]
+                m_d_eval_q, _ = self._get_stacked_q(m_states, torch.tanh(m_c_actions_sampled))
+                stacked_next_d_eval_q = m_d_eval_q[:, :, 1:, ...][torch.randperm(self.ensemble_q_num)[:self.ensemble_q_sample]]
                 # [ensemble_q_num, Batch, n, d_action_size] -> [ensemble_q_sample, Batch, n, d_action_size]
 
                 d_y = self.get_dqn_like_d_y(n_rewards, n_dones,
                                             stacked_next_d_eval_q,
                                             stacked_next_d_q)
             else:
-                stacked_d_q = torch.stack(d_q_list)[torch.randperm(self.ensemble_q_num)[:self.ensemble_q_sample]]
+                stacked_d_q = m_d_q[:, :, :-1, ...][torch.randperm(self.ensemble_q_num)[:self.ensemble_q_sample]]
                 # [ensemble_q_num, Batch, n, d_action_size] -> [ensemble_q_sample, Batch, n, d_action_size]
 
                 min_q, _ = torch.min(stacked_d_q, dim=0)  # [Batch, n, d_action_size]
                 min_next_q, _ = torch.min(stacked_next_d_q, dim=0)  # [Batch, n, d_action_size]
 
-                probs = d_policy.probs  # [Batch, n, action_size]
-                next_probs = next_d_policy.probs  # [Batch, n, action_size]
+                m_probs = m_d_policy.probs  # [Batch, n + 1, action_size]
+                probs = m_probs[:, :-1, ...]  # [Batch, n, action_size]
+                next_probs = m_probs[:, 1:, ...]  # [Batch, n, action_size]
                 clipped_probs = probs.clamp(min=1e-8)
                 clipped_next_probs = next_probs.clamp(min=1e-8)
                 tmp_v = min_q - d_alpha * torch.log(clipped_probs)  # [Batch, n, action_size]
@@ -866,7 +1002,9 @@ class SAC_Base(object):
 
                 if self.use_n_step_is:
                     n_d_actions = n_actions[..., :self.d_action_size]
-                    n_pi_probs = torch.exp(d_policy.log_prob(n_d_actions))  # [Batch, n]
+                    # Padded with the last action to match the merged policy
+                    m_d_actions = torch.cat([n_d_actions, n_d_actions[:, -1:, ...]], dim=1)
+                    n_pi_probs = torch.exp(m_d_policy.log_prob(m_d_actions)[:, :-1])  # [Batch, n]
 
                 d_y = self._v_trace(n_rewards, n_dones,
                                     n_mu_probs,
@@ -874,12 +1012,14 @@ class SAC_Base(object):
                                     v, next_v)
 
         if self.c_action_size:
-            n_actions_log_prob = torch.sum(squash_correction_log_prob(c_policy, n_c_actions_sampled), dim=-1)  # [Batch, n]
-            next_n_actions_log_prob = torch.sum(squash_correction_log_prob(next_c_policy, next_n_c_actions_sampled), dim=-1)
+            m_actions_log_prob = torch.sum(squash_correction_log_prob(m_c_policy, m_c_actions_sampled), dim=-1)
+            # [Batch, n + 1]
+            n_actions_log_prob = m_actions_log_prob[:, :-1]  # [Batch, n]
+            next_n_actions_log_prob = m_actions_log_prob[:, 1:]  # [Batch, n]
 
-            stacked_c_q = torch.stack(c_q_list)[torch.randperm(self.ensemble_q_num)[:self.ensemble_q_sample]]
+            stacked_c_q = m_c_q[:, :, :-1, ...][torch.randperm(self.ensemble_q_num)[:self.ensemble_q_sample]]
             # [ensemble_q_num, Batch, n, 1] -> [ensemble_q_sample, Batch, n, 1]
-            stacked_next_c_q = torch.stack(next_c_q_list)[torch.randperm(self.ensemble_q_num)[:self.ensemble_q_sample]]
+            stacked_next_c_q = m_c_q[:, :, 1:, ...][torch.randperm(self.ensemble_q_num)[:self.ensemble_q_sample]]
             # [ensemble_q_num, Batch, n, 1] -> [ensemble_q_sample, Batch, n, 1]
 
             min_q, _ = stacked_c_q.min(dim=0)
@@ -895,7 +1035,9 @@ class SAC_Base(object):
 
             if self.use_n_step_is:
                 n_c_actions = n_actions[..., self.d_action_size:]
-                n_pi_probs = squash_correction_prob(c_policy, torch.atanh(n_c_actions))
+                # Padded with the last action to match the merged policy
+                m_c_actions = torch.cat([n_c_actions, n_c_actions[:, -1:, ...]], dim=1)
+                n_pi_probs = squash_correction_prob(m_c_policy, torch.atanh(m_c_actions))[:, :-1, ...]
                 # [Batch, n, action_size]
                 n_pi_probs = n_pi_probs.prod(axis=-1)  # [Batch, n]
 
@@ -979,59 +1121,68 @@ class SAC_Base(object):
         d_action = action[..., :self.d_action_size]
         c_action = action[..., self.d_action_size:]
 
-        q_list = [q(state, c_action) for q in self.model_q_list]
-        # ([Batch, action_size], [Batch, 1])
-        d_q_list = [q[0] for q in q_list]  # [Batch, action_size]
-        c_q_list = [q[1] for q in q_list]  # [Batch, 1]
+        d_q, c_q = self._get_stacked_q(state, c_action)
+        # [ensemble_q_num, Batch, action_size], [ensemble_q_num, Batch, 1]
 
-        d_y, c_y = self._get_y([m_obses[:, self.burn_in_step:-1, ...] for m_obses in m_obses_list],
-                               m_target_states[:, self.burn_in_step:-1, ...],
+        d_y, c_y = self._get_y([m_obses[:, self.burn_in_step:, ...] for m_obses in m_obses_list],
+                               m_target_states[:, self.burn_in_step:, ...],
                                bn_actions[:, self.burn_in_step:, ...],
                                bn_rewards[:, self.burn_in_step:],
-                               [m_obses[:, -1, ...] for m_obses in m_obses_list],
-                               m_target_states[:, -1, ...],
                                bn_dones[:, self.burn_in_step:],
                                bn_mu_probs[:, self.burn_in_step:] if self.use_n_step_is else None)
         #  [Batch, 1], [Batch, 1]
 
-        loss_q_list = [torch.zeros((batch, 1), device=self.device) for _ in range(self.ensemble_q_num)]
+        loss_q = torch.zeros((self.ensemble_q_num, batch, 1), device=self.device)
         loss_none_mse = nn.MSELoss(reduction='none')
 
         if self.d_action_size:
-            for i in range(self.ensemble_q_num):
-                q_single = torch.sum(d_action * d_q_list[i], dim=-1, keepdim=True)  # [Batch, 1]
-                loss_q_list[i] += loss_none_mse(q_single, d_y)
+            q_single = torch.sum(d_action * d_q, dim=-1, keepdim=True)  # [ensemble_q_num, Batch, 1]
+            loss_q += loss_none_mse(q_single, d_y.expand_as(q_single))
 
         if self.c_action_size:
             if self.clip_epsilon > 0:
-                target_c_q_list = [q(state, c_action)[1] for q in self.model_target_q_list]
+                _, target_c_q = self._get_stacked_q(state, c_action, target=True)
 
-                clipped_q_list = [target_c_q_list[i] + torch.clamp(
-                    c_q_list[i] - target_c_q_list[i],
+                clipped_q = target_c_q + torch.clamp(
+                    c_q - target_c_q,
                     -self.clip_epsilon,
                     self.clip_epsilon,
-                ) for i in range(self.ensemble_q_num)]
+                )  # [ensemble_q_num, Batch, 1]
 
-                loss_q_a_list = [loss_none_mse(clipped_q, c_y) for clipped_q in clipped_q_list]  # [Batch, 1]
-                loss_q_b_list = [loss_none_mse(q, c_y) for q in c_q_list]  # [Batch, 1]
+                loss_q_a = loss_none_mse(clipped_q, c_y.expand_as(clipped_q))  # [ensemble_q_num, Batch, 1]
+                loss_q_b = loss_none_mse(c_q, c_y.expand_as(c_q))  # [ensemble_q_num, Batch, 1]
 
-                for i in range(self.ensemble_q_num):
-                    loss_q_list[i] += torch.maximum(loss_q_a_list[i], loss_q_b_list[i])  # [Batch, 1]
+                loss_q += torch.maximum(loss_q_a, loss_q_b)  # [ensemble_q_num, Batch, 1]
             else:
-                for i in range(self.ensemble_q_num):
-                    loss_q_list[i] += loss_none_mse(c_q_list[i], c_y)  # [Batch, 1]
+                loss_q += loss_none_mse(c_q, c_y.expand_as(c_q))  # [ensemble_q_num, Batch, 1]
+
+        td_error = None
+        if self.use_replay_buffer and self.use_priority and self.async_write_back:
+            # The same td-error as `_get_td_error`, but before this update
+            with torch.no_grad():
+                q_td_error = torch.zeros((self.ensemble_q_num, batch, 1), device=self.device)
+                if self.d_action_size:
+                    q_td_error += torch.abs(q_single - d_y)
+                if self.c_action_size:
+                    q_td_error += torch.abs(c_q - c_y)
+                td_error = torch.mean(q_td_error, dim=0)  # [Batch, 1]
 
         if self.use_replay_buffer and self.use_priority:
-            loss_q_list = [loss_q * priority_is for loss_q in loss_q_list]
+            loss_q = loss_q * priority_is
 
-        loss_q_list = [torch.mean(loss) for loss in loss_q_list]
+        loss_q = torch.mean(loss_q, dim=(1, 2))  # [ensemble_q_num, ]
 
         if self.optimizer_rep:
             self.optimizer_rep.zero_grad()
 
-        for loss_q, opt_q in zip(loss_q_list, self.optimizer_q_list):
+        for opt_q in self.optimizer_q_list:
             opt_q.zero_grad()
-            loss_q.backward(retain_graph=True)
+        if self.fused_ensemble_q:
+            # Each Q only depends on its own loss
+            self._grad_scaler.scale(torch.sum(loss_q)).backward(retain_graph=True)
+        else:
+            for loss in loss_q:
+                self._grad_scaler.scale(loss).backward(retain_graph=True)
 
         grads_rep_main = [m.grad.detach() if m.grad is not None else None
                           for m in self.model_rep.parameters()]
@@ -1050,7 +1201,7 @@ class SAC_Base(object):
                 bn_actions)
 
         for opt_q in self.optimizer_q_list:
-            opt_q.step()
+            self._grad_scaler.step(opt_q)
 
         """ Recurrent Prediction Model """
         loss_predictions = None
@@ -1064,9 +1215,9 @@ class SAC_Base(object):
                                                bn_rewards)
 
         if self.optimizer_rep:
-            self.optimizer_rep.step()
+            self._grad_scaler.step(self.optimizer_rep)
 
-        return loss_q_list[0], loss_siamese, loss_siamese_q, loss_predictions
+        return loss_q[0], loss_siamese, loss_siamese_q, loss_predictions, td_error
 
     @torch.no_grad()
     def calculate_adaptive_weights(self,
@@ -1218,25 +1369,26 @@ class SAC_Base(object):
         if self.siamese_use_q:
             if self.siamese_use_adaptive:
                 for grads_q_main, q_loss, q in zip(grads_q_main_list, q_loss_list, self.model_q_list):
-                    self.calculate_adaptive_weights(grads_q_main, [q_loss], q)
+                    self.calculate_adaptive_weights(grads_q_main, [self._grad_scaler.scale(q_loss)], q)
             else:
                 for q_loss, q in zip(q_loss_list, self.model_q_list):
-                    q_loss.backward(inputs=list(q.parameters()), retain_graph=True)
+                    self._grad_scaler.scale(q_loss).backward(inputs=list(q.parameters()), retain_graph=True)
 
         loss = sum(loss_list)
 
         if self.siamese_use_adaptive:
-            self.calculate_adaptive_weights(grads_rep_main, loss_list, self.model_rep)
+            self.calculate_adaptive_weights(grads_rep_main, self._grad_scaler.scale(loss_list), self.model_rep)
         else:
-            loss.backward(inputs=list(self.model_rep.parameters()), retain_graph=True)
+            self._grad_scaler.scale(loss).backward(inputs=list(self.model_rep.parameters()), retain_graph=True)
 
         self.optimizer_siamese.zero_grad()
         if self.siamese == SIAMESE.ATC:
-            loss.backward(inputs=self.contrastive_weight_list, retain_graph=True)
+            self._grad_scaler.scale(loss).backward(inputs=self.contrastive_weight_list, retain_graph=True)
         elif self.siamese == SIAMESE.BYOL:
-            loss.backward(inputs=list(chain(*[pro.parameters() for pro in self.model_rep_projection_list],
-                                            *[pre.parameters() for pre in self.model_rep_prediction_list])), retain_graph=True)
-        self.optimizer_siamese.step()
+            self._grad_scaler.scale(loss).backward(inputs=list(chain(*[pro.parameters() for pro in self.model_rep_projection_list],
+                                                                     *[pre.parameters() for pre in self.model_rep_prediction_list])),
+                                                   retain_graph=True)
+        self._grad_scaler.step(self.optimizer_siamese)
 
         return sum(loss_siamese_list), sum(q_loss_list) if self.siamese_use_q else None
 
@@ -1271,14 +1423,16 @@ class SAC_Base(object):
                                                    [m_obses[:, self.burn_in_step:, ...] for m_obses in m_obses_list])
         loss_obs /= self.n_step
 
-        self.calculate_adaptive_weights(grads_rep_main, [loss_transition, loss_reward, loss_obs], self.model_rep)
+        self.calculate_adaptive_weights(grads_rep_main,
+                                        self._grad_scaler.scale([loss_transition, loss_reward, loss_obs]),
+                                        self.model_rep)
 
         loss_predictions = loss_transition + loss_reward + loss_obs
         self.optimizer_prediction.zero_grad()
-        loss_predictions.backward(inputs=list(chain(self.model_transition.parameters(),
-                                                    self.model_reward.parameters(),
-                                                    self.model_observation.parameters())))
-        self.optimizer_prediction.step()
+        self._grad_scaler.scale(loss_predictions).backward(inputs=list(chain(self.model_transition.parameters(),
+                                                                             self.model_reward.parameters(),
+                                                                             self.model_observation.parameters())))
+        self._grad_scaler.step(self.optimizer_prediction)
 
         return torch.mean(approx_next_state_dist.entropy()), loss_reward, loss_obs
 
@@ -1302,11 +1456,9 @@ class SAC_Base(object):
 
             c_action = action[..., self.d_action_size:]
 
-            q_list = [q(state, c_action) for q in self.model_q_list]
-            # ([Batch, action_size], [Batch, 1])
-            d_q_list = [q[0] for q in q_list]  # [Batch, action_size]
+            d_q, _ = self._get_stacked_q(state, c_action)  # [ensemble_q_num, Batch, action_size]
 
-            stacked_d_q = torch.stack(d_q_list)[torch.randperm(self.ensemble_q_num)[:self.ensemble_q_sample]]
+            stacked_d_q = d_q[torch.randperm(self.ensemble_q_num)[:self.ensemble_q_sample]]
             # [ensemble_q_num, Batch, d_action_size] -> [ensemble_q_sample, Batch, d_action_size]
             min_d_q, _ = torch.min(stacked_d_q, dim=0)
             # [ensemble_q_sample, Batch, d_action_size] -> [Batch, d_action_size]
@@ -1316,10 +1468,10 @@ class SAC_Base(object):
 
         if self.c_action_size:
             action_sampled = c_policy.rsample()
-            c_q_for_gradient_list = [q(state, torch.tanh(action_sampled))[1] for q in self.model_q_list]
-            # [[Batch, 1], ...]
+            _, c_q_for_gradient = self._get_stacked_q(state, torch.tanh(action_sampled))
+            # [ensemble_q_num, Batch, 1]
 
-            stacked_c_q_for_gradient = torch.stack(c_q_for_gradient_list)[torch.randperm(self.ensemble_q_num)[:self.ensemble_q_sample]]
+            stacked_c_q_for_gradient = c_q_for_gradient[torch.randperm(self.ensemble_q_num)[:self.ensemble_q_sample]]
             # [ensemble_q_num, Batch, 1] -> [ensemble_q_sample, Batch, 1]
 
             log_prob = torch.sum(squash_correction_log_prob(c_policy, action_sampled), dim=1, keepdim=True)
@@ -1335,8 +1487,8 @@ class SAC_Base(object):
 
         if (self.d_action_size and not self.discrete_dqn_like) or self.c_action_size:
             self.optimizer_policy.zero_grad()
-            loss_policy.backward(inputs=list(self.model_policy.parameters()))
-            self.optimizer_policy.step()
+            self._grad_scaler.scale(loss_policy).backward(inputs=list(self.model_policy.parameters()))
+            self._grad_scaler.step(self.optimizer_policy)
 
         return (torch.mean(d_policy.entropy()) if self.d_action_size else None,
                 torch.mean(c_policy.entropy()) if self.c_action_size else None)
@@ -1346,7 +1498,9 @@ class SAC_Base(object):
                      state: torch.Tensor):
         batch = state.shape[0]
 
-        d_policy, c_policy = self.model_policy(state, obs_list)
+        # Alphas are kept in fp32
+        with self._autocast():
+            d_policy, c_policy = self.model_policy(state, obs_list)
 
         d_alpha = torch.exp(self.log_d_alpha)
         c_alpha = torch.exp(self.log_c_alpha)
@@ -1371,8 +1525,8 @@ class SAC_Base(object):
         loss_alpha = torch.mean(loss_d_alpha + loss_c_alpha)
 
         self.optimizer_alpha.zero_grad()
-        loss_alpha.backward(inputs=[self.log_d_alpha, self.log_c_alpha])
-        self.optimizer_alpha.step()
+        self._grad_scaler.scale(loss_alpha).backward(inputs=[self.log_d_alpha, self.log_c_alpha])
+        self._grad_scaler.step(self.optimizer_alpha)
 
         return d_alpha, c_alpha
 
@@ -1434,21 +1588,30 @@ class SAC_Base(object):
             bn_mu_probs: [Batch, b + n]
             f_seq_hidden_states: [Batch, 1, *seq_hidden_state_shape]
             priority_is: [Batch, 1]
+
+        Returns:
+            Refreshed values reused from the training forward if `async_write_back`, otherwise None
+            td_error: [Batch, 1]
+            bn_pi_probs: [Batch, b + n]
+            bn_seq_hidden_states: [Batch, b + n, *seq_hidden_state_shape]
         """
 
         if self.global_step % self.update_target_per_step == 0:
             self._update_target_variables(tau=self.tau)
 
-        loss_q, loss_siamese, loss_siamese_q, loss_predictions = self._train_rep_q(bn_indexes,
-                                                                                   bn_padding_masks,
-                                                                                   bn_obses_list,
-                                                                                   bn_actions,
-                                                                                   bn_rewards,
-                                                                                   next_obs_list,
-                                                                                   bn_dones,
-                                                                                   bn_mu_probs,
-                                                                                   f_seq_hidden_states,
-                                                                                   priority_is)
+        # Siamese and prediction losses are trained inside `_train_rep_q`, also under autocast
+        with self._autocast():
+            (loss_q, loss_siamese, loss_siamese_q,
+             loss_predictions, td_error) = self._train_rep_q(bn_indexes,
+                                                             bn_padding_masks,
+                                                             bn_obses_list,
+                                                             bn_actions,
+                                                             bn_rewards,
+                                                             next_obs_list,
+                                                             bn_dones,
+                                                             bn_mu_probs,
+                                                             f_seq_hidden_states,
+                                                             priority_is)
 
         with torch.no_grad():
             m_obses_list = [torch.cat([bn_obses, next_obs.unsqueeze(1)], dim=1)
@@ -1459,14 +1622,14 @@ class SAC_Base(object):
                                              gen_pre_n_actions(bn_actions, keep_last_action=True),
                                              f_seq_hidden_states[:, 0])
             elif self.seq_encoder == SEQ_ENCODER.ATTN:
-                m_states, *_ = self.model_rep(torch.concat([bn_indexes, bn_indexes[:, -1:] + 1], dim=1),
-                                              m_obses_list,
-                                              gen_pre_n_actions(bn_actions, keep_last_action=True),
-                                              query_length=bn_indexes.shape[1] + 1,
-                                              hidden_state=f_seq_hidden_states,
-                                              is_prev_hidden_state=True,
-                                              padding_mask=torch.concat([bn_padding_masks,
-                                                                        torch.zeros_like(bn_padding_masks[:, -1:], dtype=torch.bool)], dim=1))
+                m_states, m_attn_states, _ = self.model_rep(torch.concat([bn_indexes, bn_indexes[:, -1:] + 1], dim=1),
+                                                                m_obses_list,
+                                                                gen_pre_n_actions(bn_actions, keep_last_action=True),
+                                                                query_length=bn_indexes.shape[1] + 1,
+                                                                hidden_state=f_seq_hidden_states,
+                                                                is_prev_hidden_state=True,
+                                                                padding_mask=torch.concat([bn_padding_masks,
+                                                                                          torch.zeros_like(bn_padding_masks[:, -1:], dtype=torch.bool)], dim=1))
             else:
                 m_states = self.model_rep(m_obses_list)
 
@@ -1474,7 +1637,8 @@ class SAC_Base(object):
         state = m_states[:, self.burn_in_step, ...]
         action = bn_actions[:, self.burn_in_step, ...]
 
-        d_policy_entropy, c_policy_entropy = self._train_policy(obs_list, state, action)
+        with self._autocast():
+            d_policy_entropy, c_policy_entropy = self._train_policy(obs_list, state, action)
 
         if self.use_auto_alpha and ((self.d_action_size and not self.discrete_dqn_like) or self.c_action_size):
             d_alpha, c_alpha = self._train_alpha(obs_list, state)
@@ -1486,6 +1650,29 @@ class SAC_Base(object):
             bn_states = m_states[:, :-1, ...]
             loss_rnd = self._train_rnd(bn_states, bn_actions)
 
+        self._grad_scaler.update()
+
+        refreshed = None
+        if self.use_replay_buffer and self.async_write_back:
+            # Reuse the representation states of the updated model_rep instead of another full forward
+            bn_pi_probs, bn_seq_hidden_states = None, None
+            if self.use_n_step_is:
+                bn_pi_probs = self.get_l_probs(bn_indexes,
+                                               bn_padding_masks,
+                                               bn_obses_list,
+                                               bn_actions,
+                                               l_states=m_states[:, :-1, ...])
+            if self.seq_encoder == SEQ_ENCODER.RNN:
+                # The rnn model only returns the last hidden state
+                bn_seq_hidden_states = self.get_l_seq_hidden_states(bn_indexes,
+                                                                    bn_padding_masks,
+                                                                    bn_obses_list,
+                                                                    bn_actions,
+                                                                    f_seq_hidden_states=f_seq_hidden_states)
+            elif self.seq_encoder == SEQ_ENCODER.ATTN:
+                bn_seq_hidden_states = m_attn_states[:, :-1, ...]
+            refreshed = td_error, bn_pi_probs, bn_seq_hidden_states
+
         if self.summary_writer is not None and self.global_step % self.write_summary_per_step == 0:
             self.summary_available = True
 
@@ -1534,6 +1721,8 @@ class SAC_Base(object):
 
             self.summary_writer.flush()
 
+        return refreshed
+
     @torch.no_grad()
     def rnd_sample(self, state: torch.Tensor,
                    d_policy: distributions.Categorical,
@@ -1747,6 +1936,61 @@ class SAC_Base(object):
                 prob.detach().cpu().numpy(),
                 next_attn_hidden_state.detach().cpu().numpy())
 
+    def get_initial_attn_kv_cache(self, max_length: int = 512):
+        assert self.seq_encoder == SEQ_ENCODER.ATTN
+
+        return EpisodeKVCache(max_length)
+
+    @torch.no_grad()
+    def choose_attn_action_incremental(self,
+                                       index: np.ndarray,
+                                       obs_list: List[np.ndarray],
+                                       pre_action: np.ndarray,
+                                       attn_hidden_state: np.ndarray,
+                                       attn_kv_cache: EpisodeKVCache,
+
+                                       disable_sample: bool = False,
+                                       force_rnd_if_avaiable: bool = False):
+        """
+        Only feed the newest step, keys / values of previous steps are cached in `attn_kv_cache`.
+        Cached keys / values are not refreshed after the model is updated.
+
+        Args:
+            index: [Batch, ]
+            obs_list: list([Batch, *obs_shapes_i], ...)
+            pre_action: [Batch, d_action_size + c_action_size]
+            attn_hidden_state: [Batch, *seq_hidden_state_shape]
+            attn_kv_cache: EpisodeKVCache
+
+        Returns:
+            action: [Batch, d_action_size + c_action_size] (numpy)
+            attn_hidden_state: [Batch, *seq_hidden_state_shape] (numpy)
+        """
+        index = torch.from_numpy(index).to(self.device)
+        obs_list = [torch.from_numpy(obs).to(self.device) for obs in obs_list]
+        pre_action = torch.from_numpy(pre_action).to(self.device)
+        attn_hidden_state = torch.from_numpy(attn_hidden_state).to(self.device)
+
+        with episode_kv_cache(self.model_rep, attn_kv_cache):
+            state, next_attn_hidden_state, _ = self.model_rep(index.unsqueeze(1),
+                                                              [obs.unsqueeze(1) for obs in obs_list],
+                                                              pre_action.unsqueeze(1),
+                                                              query_length=1,
+                                                              hidden_state=attn_hidden_state.unsqueeze(1),
+                                                              is_prev_hidden_state=False,
+                                                              padding_mask=torch.zeros_like(index, dtype=torch.bool).unsqueeze(1))
+        state = state.squeeze(1)
+        next_attn_hidden_state = next_attn_hidden_state.squeeze(1)
+
+        action, prob = self._choose_action(obs_list,
+                                           state,
+                                           disable_sample,
+                                           force_rnd_if_avaiable)
+
+        return (action.detach().cpu().numpy(),
+                prob.detach().cpu().numpy(),
+                next_attn_hidden_state.detach().cpu().numpy())
+
     @torch.no_grad()
     def _get_td_error(self,
                       bn_indexes: torch.Tensor,
@@ -1812,37 +2056,30 @@ class SAC_Base(object):
         d_action = action[..., :self.d_action_size]
         c_action = action[..., self.d_action_size:]
 
-        q_list = [q(state, c_action) for q in self.model_q_list]
-        # ([Batch, action_size], [Batch, 1])
-        d_q_list = [q[0] for q in q_list]  # [Batch, action_size]
-        c_q_list = [q[1] for q in q_list]  # [Batch, 1]
+        d_q, c_q = self._get_stacked_q(state, c_action)
+        # [ensemble_q_num, Batch, action_size], [ensemble_q_num, Batch, 1]
 
         if self.d_action_size:
-            d_q_list = [torch.sum(d_action * q, dim=-1, keepdim=True) for q in d_q_list]
-            # [Batch, 1]
+            d_q = torch.sum(d_action * d_q, dim=-1, keepdim=True)
+            # [ensemble_q_num, Batch, 1]
 
-        d_y, c_y = self._get_y([m_obses[:, self.burn_in_step:-1, ...] for m_obses in m_obses_list],
-                               m_target_states[:, self.burn_in_step:-1, ...],
+        d_y, c_y = self._get_y([m_obses[:, self.burn_in_step:, ...] for m_obses in m_obses_list],
+                               m_target_states[:, self.burn_in_step:, ...],
                                bn_actions[:, self.burn_in_step:, ...],
                                bn_rewards[:, self.burn_in_step:],
-                               [m_obses[:, -1, ...] for m_obses in m_obses_list],
-                               m_target_states[:, -1, ...],
                                bn_dones[:, self.burn_in_step:],
                                bn_mu_probs[:, self.burn_in_step:] if self.use_n_step_is else None)
         # [Batch, 1]
 
-        q_td_error_list = [torch.zeros((state.shape[0], 1), device=self.device) for _ in range(self.ensemble_q_num)]
-        # [Batch, 1]
+        q_td_error = torch.zeros((self.ensemble_q_num, state.shape[0], 1), device=self.device)
+        # [ensemble_q_num, Batch, 1]
         if self.d_action_size:
-            for i in range(self.ensemble_q_num):
-                q_td_error_list[i] += torch.abs(d_q_list[i] - d_y)
+            q_td_error += torch.abs(d_q - d_y)
 
         if self.c_action_size:
-            for i in range(self.ensemble_q_num):
-                q_td_error_list[i] += torch.abs(c_q_list[i] - c_y)
+            q_td_error += torch.abs(c_q - c_y)
 
-        td_error = torch.mean(torch.cat(q_td_error_list, dim=-1),
-                              dim=-1, keepdim=True)
+        td_error = torch.mean(q_td_error, dim=0)  # [Batch, 1]
         return td_error
 
     def get_episode_td_error(self,
@@ -1911,15 +2148,16 @@ class SAC_Base(object):
         for i in range(math.ceil(all_batch / batch_size)):
             b_i, b_j = i * batch_size, (i + 1) * batch_size
 
-            _bn_indexes = torch.from_numpy(bn_indexes[b_i:b_j]).to(self.device)
-            _bn_padding_masks = torch.from_numpy(bn_padding_masks[b_i:b_j]).to(self.device)
-            _bn_obses_list = [torch.from_numpy(o[b_i:b_j]).to(self.device) for o in bn_obses_list]
-            _bn_actions = torch.from_numpy(bn_actions[b_i:b_j]).to(self.device)
-            _bn_rewards = torch.from_numpy(bn_rewards[b_i:b_j]).to(self.device)
+            # Materialize the strided views of the episode batch by batch
+            _bn_indexes = torch.from_numpy(np.ascontiguousarray(bn_indexes[b_i:b_j])).to(self.device)
+            _bn_padding_masks = torch.from_numpy(np.ascontiguousarray(bn_padding_masks[b_i:b_j])).to(self.device)
+            _bn_obses_list = [torch.from_numpy(np.ascontiguousarray(o[b_i:b_j])).to(self.device) for o in bn_obses_list]
+            _bn_actions = torch.from_numpy(np.ascontiguousarray(bn_actions[b_i:b_j])).to(self.device)
+            _bn_rewards = torch.from_numpy(np.ascontiguousarray(bn_rewards[b_i:b_j])).to(self.device)
             _next_obs_list = [torch.from_numpy(o[b_i:b_j]).to(self.device) for o in next_obs_list]
-            _bn_dones = torch.from_numpy(bn_dones[b_i:b_j]).to(self.device)
-            _bn_mu_probs = torch.from_numpy(bn_mu_probs[b_i:b_j]).to(self.device) if self.use_n_step_is else None
-            _f_seq_hidden_states = torch.from_numpy(f_seq_hidden_states[b_i:b_j]).to(self.device) if self.seq_encoder is not None else None
+            _bn_dones = torch.from_numpy(np.ascontiguousarray(bn_dones[b_i:b_j])).to(self.device)
+            _bn_mu_probs = torch.from_numpy(np.ascontiguousarray(bn_mu_probs[b_i:b_j])).to(self.device) if self.use_n_step_is else None
+            _f_seq_hidden_states = torch.from_numpy(np.ascontiguousarray(f_seq_hidden_states[b_i:b_j])).to(self.device) if self.seq_encoder is not None else None
 
             td_error = self._get_td_error(bn_indexes=_bn_indexes,
                                           bn_padding_masks=_bn_padding_masks,
@@ -2066,34 +2304,12 @@ class SAC_Base(object):
                 priority_is: [Batch, 1]
             )
         """
-        sampled = self.replay_buffer.sample()
+        sampled = self.replay_buffer.sample_windows(window=self.burn_in_step + self.n_step + 1)
         if sampled is None:
             return None
 
-        """
-        trans:
-            index: [Batch, ]
-            padding_mask: [Batch, ]
-            obs_i: [Batch, *obs_shapes_i]
-            action: [Batch, action_size]
-            reward: [Batch, ]
-            done: [Batch, ]
-            mu_prob: [Batch, ]
-            seq_hidden_state: [Batch, *seq_hidden_state_shape],
-        """
         pointers, trans, priority_is = sampled
 
-        # Get n_step transitions TODO: could be faster, no need get all data
-        trans = {k: [v] for k, v in trans.items()}
-        # k: [v, v, ...]
-        for i in range(1, self.burn_in_step + self.n_step + 1):
-            t_trans = self.replay_buffer.get_storage_data(pointers + i).items()
-            for k, v in t_trans:
-                trans[k].append(v)
-
-        for k, v in trans.items():
-            trans[k] = np.concatenate([np.expand_dims(t, 1) for t in v], axis=1)
-
         """
         m_indexes: [Batch, N + 1]
         m_padding_masks: [Batch, N + 1]
@@ -2138,11 +2354,121 @@ class SAC_Base(object):
                           bn_seq_hidden_states if self.seq_encoder is not None else None,
                           priority_is if self.use_priority else None)
 
+    def _batch_to_device(self, batch, non_blocking: bool = False):
+        """
+        Convert a sampled batch to tensors on the device.
+        Only the first seq_hidden_state of each window is kept.
+
+        Args:
+            batch: The batch from replay buffer or batch buffer
+            non_blocking: If copying from pinned memory without blocking the host
+
+        Returns:
+            bn_indexes: [Batch, b + n]
+            bn_padding_masks: [Batch, b + n]
+            bn_obses_list: list([Batch, b + n, *obs_shapes_i], ...)
+            bn_actions: [Batch, b + n, action_size]
+            bn_rewards: [Batch, b + n]
+            next_obs_list: list([Batch, *obs_shapes_i], ...)
+            bn_dones: [Batch, b + n]
+            bn_mu_probs: [Batch, b + n]
+            f_seq_hidden_states: [Batch, 1, *seq_hidden_state_shape]
+            priority_is: [Batch, 1]
+        """
+        (bn_indexes,
+         bn_padding_masks,
+         bn_obses_list,
+         bn_actions,
+         bn_rewards,
+         next_obs_list,
+         bn_dones,
+         bn_mu_probs,
+         bn_seq_hidden_states,
+         priority_is) = batch
+
+        def to_device(t: np.ndarray):
+            t = torch.from_numpy(t)
+            if non_blocking:
+                t = t.pin_memory()
+            return t.to(self.device, non_blocking=non_blocking)
+
+        return (to_device(bn_indexes),
+                to_device(bn_padding_masks),
+                [to_device(t) for t in bn_obses_list],
+                to_device(bn_actions),
+                to_device(bn_rewards),
+                [to_device(t) for t in next_obs_list],
+                to_device(bn_dones),
+                to_device(bn_mu_probs) if self.use_n_step_is else None,
+                to_device(bn_seq_hidden_states[:, :1]) if self.seq_encoder is not None else None,
+                to_device(priority_is) if self.use_replay_buffer and self.use_priority else None)
+
+    def _prefetch(self):
+        """
+        Keep `prefetch_batches` batches sampled and copied to the device ahead,
+        run in the background thread started by `_get_prefetched_batch`
+        """
+        stream = torch.cuda.Stream(self.device) if self.device.type == 'cuda' else None
+
+        while not self._prefetch_stopped.is_set():
+            try:
+                train_data = self._sample_from_replay_buffer()
+                if train_data is None:
+                    self._prefetch_stopped.wait(0.01)
+                    continue
+
+                pointers, batch = train_data
+                event = None
+                if stream is not None:
+                    with torch.cuda.stream(stream):
+                        batch = self._batch_to_device(batch, non_blocking=True)
+                        event = torch.cuda.Event()
+                        event.record(stream)
+                else:
+                    batch = self._batch_to_device(batch)
+
+                self._prefetch_queue.put((pointers, batch, event))
+            except Exception as e:
+                self._prefetch_queue.put(e)
+                return
+
+    def _get_prefetched_batch(self):
+        """
+        Returns:
+            pointers: [Batch, ]
+            batch: The batch of tensors on the device, see `_batch_to_device`
+            None if the replay buffer is not ready
+        """
+        if self._prefetch_thread is None:
+            self._prefetch_thread = threading.Thread(target=self._prefetch, daemon=True)
+            self._prefetch_thread.start()
+
+        if self._prefetch_queue.empty() and self.replay_buffer.size < self.batch_size:
+            return None
+
+        prefetched = self._prefetch_queue.get()
+        if isinstance(prefetched, Exception):
+            raise prefetched
+
+        pointers, batch, event = prefetched
+        if event is not None:
+            current_stream = torch.cuda.current_stream(self.device)
+            current_stream.wait_event(event)
+            # Tensors allocated in the prefetching stream are used in the current stream
+            for t in chain(*[b if isinstance(b, list) else [b] for b in batch]):
+                if t is not None:
+                    t.record_stream(current_stream)
+
+        return pointers, batch
+
     def train(self):
         step = self.get_global_step()
 
         if self.use_replay_buffer:
-            train_data = self._sample_from_replay_buffer()
+            if self.prefetch_batches > 0:
+                train_data = self._get_prefetched_batch()
+            else:
+                train_data = self._sample_from_replay_buffer()
             if train_data is None:
                 return step
 
@@ -2153,6 +2479,9 @@ class SAC_Base(object):
             batch_list = [(*batch, None) for batch in batch_list]
 
         for batch in batch_list:
+            if not (self.use_replay_buffer and self.prefetch_batches > 0):
+                batch = self._batch_to_device(batch)
+
             (bn_indexes,
              bn_padding_masks,
              bn_obses_list,
@@ -2161,52 +2490,27 @@ class SAC_Base(object):
              next_obs_list,
              bn_dones,
              bn_mu_probs,
-             bn_seq_hidden_states,
+             f_seq_hidden_states,
              priority_is) = batch
 
-            """
-            bn_indexes: [Batch, b + n]
-            bn_padding_masks: [Batch, b + n]
-            bn_obses_list: list([Batch, b + n, *obs_shapes_i], ...)
-            bn_actions: [Batch, b + n, action_size]
-            bn_rewards: [Batch, b + n]
-            next_obs_list: list([Batch, *obs_shapes_i], ...)
-            bn_dones: [Batch, b + n]
-            bn_mu_probs: [Batch, b + n]
-            bn_seq_hidden_states: [Batch, b + n, *seq_hidden_state_shape]
-            priority_is: [Batch, 1]
-            """
-
-            bn_indexes = torch.from_numpy(bn_indexes).to(self.device)
-            bn_padding_masks = torch.from_numpy(bn_padding_masks).to(self.device)
-            bn_obses_list = [torch.from_numpy(t).to(self.device) for t in bn_obses_list]
-            bn_actions = torch.from_numpy(bn_actions).to(self.device)
-            bn_rewards = torch.from_numpy(bn_rewards).to(self.device)
-            next_obs_list = [torch.from_numpy(t).to(self.device) for t in next_obs_list]
-            bn_dones = torch.from_numpy(bn_dones).to(self.device)
-            if self.use_n_step_is:
-                bn_mu_probs = torch.from_numpy(bn_mu_probs).to(self.device)
-            if self.seq_encoder is not None:
-                f_seq_hidden_states = bn_seq_hidden_states[:, :1]
-                f_seq_hidden_states = torch.from_numpy(f_seq_hidden_states).to(self.device)
-            if self.use_replay_buffer and self.use_priority:
-                priority_is = torch.from_numpy(priority_is).to(self.device)
-
-            self._train(bn_indexes=bn_indexes,
-                        bn_padding_masks=bn_padding_masks,
-                        bn_obses_list=bn_obses_list,
-                        bn_actions=bn_actions,
-                        bn_rewards=bn_rewards,
-                        next_obs_list=next_obs_list,
-                        bn_dones=bn_dones,
-                        bn_mu_probs=bn_mu_probs if self.use_n_step_is else None,
-                        f_seq_hidden_states=f_seq_hidden_states if self.seq_encoder is not None else None,
-                        priority_is=priority_is if self.use_replay_buffer and self.use_priority else None)
+            refreshed = self._train(bn_indexes=bn_indexes,
+                                    bn_padding_masks=bn_padding_masks,
+                                    bn_obses_list=bn_obses_list,
+                                    bn_actions=bn_actions,
+                                    bn_rewards=bn_rewards,
+                                    next_obs_list=next_obs_list,
+                                    bn_dones=bn_dones,
+                                    bn_mu_probs=bn_mu_probs,
+                                    f_seq_hidden_states=f_seq_hidden_states,
+                                    priority_is=priority_is)
 
             if step % self.save_model_per_step == 0:
                 self.save_model()
 
-            if self.use_replay_buffer:
+            if self.use_replay_buffer and self.async_write_back:
+                self._write_back_async(pointers, *refreshed)
+
+            elif self.use_replay_buffer:
                 if self.use_n_step_is:
                     bn_pi_probs_tensor = self.get_l_probs(bn_indexes,
                                                           bn_padding_masks,
@@ -2224,28 +2528,108 @@ class SAC_Base(object):
                                                   next_obs_list=next_obs_list,
                                                   bn_dones=bn_dones,
                                                   bn_mu_probs=bn_pi_probs_tensor if self.use_n_step_is else None,
-                                                  f_seq_hidden_states=f_seq_hidden_states if self.seq_encoder is not None else None).detach().cpu().numpy()
-                    self.replay_buffer.update(pointers, td_error)
+                                                  f_seq_hidden_states=f_seq_hidden_states if self.seq_encoder is not None else None)
 
                 # Update seq_hidden_states
                 if self.seq_encoder is not None:
-                    pointers_list = [pointers + i for i in range(1, self.burn_in_step + self.n_step + 1)]
-                    tmp_pointers = np.stack(pointers_list, axis=1).reshape(-1)
                     bn_seq_hidden_states = self.get_l_seq_hidden_states(bn_indexes,
                                                                         bn_padding_masks,
                                                                         bn_obses_list,
                                                                         bn_actions,
-                                                                        f_seq_hidden_states=f_seq_hidden_states).detach().cpu().numpy()
-                    seq_hidden_state = bn_seq_hidden_states.reshape(-1, *bn_seq_hidden_states.shape[2:])
-                    self.replay_buffer.update_transitions(tmp_pointers, 'seq_hidden_state', seq_hidden_state)
+                                                                        f_seq_hidden_states=f_seq_hidden_states)
 
-                # Update n_mu_probs
-                if self.use_n_step_is:
-                    pointers_list = [pointers + i for i in range(0, self.burn_in_step + self.n_step)]
-                    tmp_pointers = np.stack(pointers_list, axis=1).reshape(-1)
-                    pi_probs = bn_pi_probs_tensor.detach().cpu().numpy().reshape(-1)
-                    self.replay_buffer.update_transitions(tmp_pointers, 'mu_prob', pi_probs)
+                self._write_back(pointers,
+                                 td_error if self.use_priority else None,
+                                 bn_pi_probs_tensor if self.use_n_step_is else None,
+                                 bn_seq_hidden_states if self.seq_encoder is not None else None)
 
             step = self._increase_global_step()
 
         return step
+
+    def _write_back(self,
+                    pointers: np.ndarray,
+                    td_error: Optional[torch.Tensor] = None,
+                    bn_pi_probs: Optional[torch.Tensor] = None,
+                    bn_seq_hidden_states: Optional[torch.Tensor] = None,
+                    event: Optional[torch.cuda.Event] = None):
+        """
+        Write refreshed priorities, mu_probs and seq_hidden_states back to the replay buffer
+
+        Args:
+            pointers: [Batch, ]
+            td_error: [Batch, 1]
+            bn_pi_probs: [Batch, b + n]
+            bn_seq_hidden_states: [Batch, b + n, *seq_hidden_state_shape]
+            event: The cuda event recorded after the device to host copies
+        """
+        if event is not None:
+            event.synchronize()
+
+        # Update td_error
+        if td_error is not None:
+            self.replay_buffer.update(pointers, td_error.detach().cpu().numpy())
+
+        # Update seq_hidden_states
+        if bn_seq_hidden_states is not None:
+            pointers_list = [pointers + i for i in range(1, self.burn_in_step + self.n_step + 1)]
+            tmp_pointers = np.stack(pointers_list, axis=1).reshape(-1)
+            bn_seq_hidden_states = bn_seq_hidden_states.detach().cpu().numpy()
+            seq_hidden_state = bn_seq_hidden_states.reshape(-1, *bn_seq_hidden_states.shape[2:])
+            self.replay_buffer.update_transitions(tmp_pointers, 'seq_hidden_state', seq_hidden_state)
+
+        # Update n_mu_probs
+        if bn_pi_probs is not None:
+            pointers_list = [pointers + i for i in range(0, self.burn_in_step + self.n_step)]
+            tmp_pointers = np.stack(pointers_list, axis=1).reshape(-1)
+            pi_probs = bn_pi_probs.detach().cpu().numpy().reshape(-1)
+            self.replay_buffer.update_transitions(tmp_pointers, 'mu_prob', pi_probs)
+
+    def _write_back_async(self,
+                          pointers: np.ndarray,
+                          td_error: Optional[torch.Tensor] = None,
+                          bn_pi_probs: Optional[torch.Tensor] = None,
+                          bn_seq_hidden_states: Optional[torch.Tensor] = None):
+        """
+        Queue `_write_back` to the background worker,
+        so the next batch's sampling and host to device copies overlap with it.
+        At most one write-back is pending, whose exception is raised here.
+        """
+        tensors = [t if t is None else t.detach().to('cpu', non_blocking=True)
+                   for t in (td_error, bn_pi_probs, bn_seq_hidden_states)]
+
+        event = None
+        if self.device.type == 'cuda':
+            event = torch.cuda.Event()
+            event.record()
+
+        self.wait_write_back()
+        self._write_back_future = self._write_back_executor.submit(self._write_back,
+                                                                   pointers, *tensors,
+                                                                   event=event)
+
+    def wait_write_back(self):
+        if self._write_back_future is not None:
+            self._write_back_future.result()
+            self._write_back_future = None
+
+    def close(self):
+        """
+        Stop the prefetching thread, and wait for the pending write-back and snapshot
+        """
+        if self._prefetch_thread is not None:
+            self._prefetch_stopped.set()
+            while self._prefetch_thread.is_alive():
+                # Unblock the prefetching thread waiting for a free slot
+                try:
+                    self._prefetch_queue.get_nowait()
+                except queue.Empty:
+                    pass
+                self._prefetch_thread.join(0.01)
+            self._prefetch_thread = None
+
+        if self.train_mode and self.use_replay_buffer:
+            self.wait_write_back()
+            if self.async_write_back:
+                self._write_back_executor.shutdown()
+            self.replay_buffer.wait_snapshot()
@@ -10,7 +10,7 @@ import numpy as np
 
 import algorithm.config_helper as config_helper
 
-from .agent import Agent
+from .agent import AgentBatch
 from .sac_base import SAC_Base
 from .utils import format_global_step, gen_pre_n_actions
 from .utils.enums import *
@@ -18,7 +18,7 @@ from .utils.enums import *
 
 class Main(object):
     train_mode = True
-    _agent_class = Agent  # For different environments
+    _agent_class = AgentBatch  # For different environments
 
     def __init__(self, root_dir, config_dir, args):
         """
@@ -176,9 +176,12 @@ class Main(object):
             initial_seq_hidden_state = self.sac.get_initial_seq_hidden_state(num_agents)  # [n_agents, *seq_hidden_state_shape]
             seq_hidden_state = initial_seq_hidden_state
 
-        agents = [self._agent_class(i, self.obs_shapes, self.action_size,
-                                    seq_hidden_state_shape=self.sac.seq_hidden_state_shape if seq_encoder is not None else None)
-                  for i in range(num_agents)]
+        agents = self._agent_class(num_agents, self.obs_shapes, self.action_size,
+                                   seq_hidden_state_shape=self.sac.seq_hidden_state_shape if seq_encoder is not None else None)
+
+        use_attn_kv_cache = seq_encoder == SEQ_ENCODER.ATTN and self.base_config['attn_kv_cache']
+        if use_attn_kv_cache:
+            attn_kv_cache = self.sac.get_initial_attn_kv_cache()
 
         force_reset = False
         iteration = 0
@@ -189,34 +192,24 @@ class Main(object):
                 if self.base_config['max_step'] != -1 and trained_steps >= self.base_config['max_step']:
                     break
 
-                if self.base_config['reset_on_iteration'] or any([a.max_reached for a in agents]) or force_reset:
+                if self.base_config['reset_on_iteration'] or agents.max_reached.any() or force_reset:
                     obs_list = self.env.reset(reset_config=self.reset_config)
-                    for agent in agents:
-                        agent.clear()
+                    agents.clear()
+                    if use_attn_kv_cache:
+                        attn_kv_cache = self.sac.get_initial_attn_kv_cache()
 
                     force_reset = False
                 else:
-                    for agent in agents:
-                        agent.reset()
+                    agents.reset()
 
                 step = 0
                 iter_time = time.time()
 
-                while not all([a.done for a in agents]):
+                while not agents.done.all():
                     # burn-in padding
-                    for agent in [a for a in agents if a.is_empty()]:
-                        for _ in range(self.sac.burn_in_step):
-                            agent.add_transition(
-                                obs_list=[np.zeros(t, dtype=np.float32) for t in self.obs_shapes],
-                                action=initial_pre_action[0],
-                                reward=0.,
-                                local_done=False,
-                                max_reached=False,
-                                next_obs_list=[np.zeros(t, dtype=np.float32) for t in self.obs_shapes],
-                                prob=0.,
-                                is_padding=True,
-                                seq_hidden_state=initial_seq_hidden_state[0]
-                            )
+                    agents.add_padding(self.sac.burn_in_step,
+                                       action=initial_pre_action[0],
+                                       seq_hidden_state=initial_seq_hidden_state[0] if seq_encoder is not None else None)
 
                     if seq_encoder == SEQ_ENCODER.RNN:
                         action, prob, next_seq_hidden_state = self.sac.choose_rnn_action(obs_list,
@@ -224,25 +217,27 @@ class Main(object):
                                                                                          seq_hidden_state,
                                                                                          disable_sample=self.disable_sample)
 
+                    elif use_attn_kv_cache:
+                        index = agents.get_episode_trans(1)[0][:, -1] + 1
+                        action, prob, next_seq_hidden_state = self.sac.choose_attn_action_incremental(index,
+                                                                                                      obs_list,
+                                                                                                      pre_action,
+                                                                                                      seq_hidden_state,
+                                                                                                      attn_kv_cache,
+                                                                                                      disable_sample=self.disable_sample)
+
                     elif seq_encoder == SEQ_ENCODER.ATTN:
-                        ep_length = min(512, max([a.episode_length for a in agents]))
-
-                        all_episode_trans = [a.get_episode_trans(ep_length) for a in agents]
-                        (all_ep_indexes,
-                            all_ep_padding_masks,
-                            all_ep_obses_list,
-                            all_ep_actions,
-                            all_all_ep_rewards,
-                            all_next_obs_list,
-                            all_ep_dones,
-                            all_ep_probs,
-                            all_ep_attn_states) = zip(*all_episode_trans)
-
-                        ep_indexes = np.concatenate(all_ep_indexes)
-                        ep_padding_masks = np.concatenate(all_ep_padding_masks)
-                        ep_obses_list = [np.concatenate(o) for o in zip(*all_ep_obses_list)]
-                        ep_actions = np.concatenate(all_ep_actions)
-                        ep_attn_states = np.concatenate(all_ep_attn_states)
+                        ep_length = min(512, agents.episode_length.max())
+
+                        (ep_indexes,
+                            ep_padding_masks,
+                            ep_obses_list,
+                            ep_actions,
+                            ep_rewards,
+                            _,
+                            ep_dones,
+                            ep_probs,
+                            ep_attn_states) = agents.get_episode_trans(ep_length)
 
                         ep_indexes = np.concatenate([ep_indexes, ep_indexes[:, -1:] + 1], axis=1)
                         ep_padding_masks = np.concatenate([ep_padding_masks,
@@ -274,23 +269,18 @@ class Main(object):
                         local_done = [True] * len(agents)
                         max_reached = [True] * len(agents)
 
-                    episode_trans_list = [
-                        agents[i].add_transition(
-                            obs_list=[o[i] for o in obs_list],
-                            action=action[i],
-                            reward=reward[i],
-                            local_done=local_done[i],
-                            max_reached=max_reached[i],
-                            next_obs_list=[o[i] for o in next_obs_list],
-                            prob=prob[i],
-                            is_padding=False,
-                            seq_hidden_state=seq_hidden_state[i] if seq_encoder is not None else None,
-                        )
-                        for i in range(len(agents))
-                    ]
+                    episode_trans_list = agents.add_transitions(
+                        obs_list=obs_list,
+                        action=action,
+                        reward=reward,
+                        local_done=local_done,
+                        max_reached=max_reached,
+                        next_obs_list=next_obs_list,
+                        prob=prob,
+                        seq_hidden_state=seq_hidden_state if seq_encoder is not None else None,
+                    )
 
                     if self.train_mode:
-                        episode_trans_list = [t for t in episode_trans_list if t is not None]
                         if len(episode_trans_list) != 0:
                             # ep_indexes, ep_padding_masks,
                             # ep_obses_list, ep_actions, ep_rewards, next_obs_list, ep_dones, ep_probs,
@@ -305,6 +295,8 @@ class Main(object):
                     if seq_encoder is not None:
                         seq_hidden_state = next_seq_hidden_state
                         seq_hidden_state[local_done] = initial_seq_hidden_state[local_done]
+                    if use_attn_kv_cache:
+                        attn_kv_cache.reset(local_done)
 
                     step += 1
 
@@ -323,12 +315,13 @@ class Main(object):
         finally:
             if self.train_mode:
                 self.sac.save_model()
+            self.sac.close()
             self.env.close()
 
             self._logger.info('Training terminated')
 
     def _log_episode_summaries(self, agents):
-        rewards = np.array([a.reward for a in agents])
+        rewards = agents.reward
         self.sac.write_constant_summaries([
             {'tag': 'reward/mean', 'simple_value': rewards.mean()},
             {'tag': 'reward/max', 'simple_value': rewards.max()},
@@ -337,7 +330,6 @@ class Main(object):
 
     def _log_episode_info(self, iteration, iter_time, agents):
         global_step = format_global_step(self.sac.get_global_step())
-        rewards = [a.reward for a in agents]
-        rewards = ", ".join([f"{i:6.1f}" for i in rewards])
-        max_step = max([a.steps for a in agents])
+        rewards = ", ".join([f"{i:6.1f}" for i in agents.reward])
+        max_step = agents.steps.max()
         self._logger.info(f'{iteration}({global_step}), T {iter_time:.2f}s, S {max_step}, R {rewards}')
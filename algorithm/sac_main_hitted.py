@@ -4,7 +4,7 @@ import numpy as np
 
 from algorithm.utils import format_global_step
 
-from .agent import Agent
+from .agent import Agent, AgentBatch
 from .sac_main import Main
 
 
@@ -32,8 +32,33 @@ class AgentHitted(Agent):
         self.hitted = 0
 
 
+class AgentBatchHitted(AgentBatch):
+    def __init__(self, n_agents, *args, **kwargs):
+        super().__init__(n_agents, *args, **kwargs)
+        self.hitted = np.zeros(n_agents, dtype=int)
+
+    def _extra_log(self,
+                   obs_list,
+                   action,
+                   reward,
+                   local_done,
+                   max_reached,
+                   next_obs_list,
+                   prob):
+
+        self.hitted[np.logical_and(~self.done, reward >= 1)] += 1
+
+    def clear(self):
+        super().clear()
+        self.hitted[:] = 0
+
+    def reset(self):
+        super().reset()
+        self.hitted[:] = 0
+
+
 class MainHitted(Main):
-    _agent_class = AgentHitted
+    _agent_class = AgentBatchHitted
     evaluation_data = {
         'episodes': 0,
         'hitted': 0,
@@ -54,8 +79,8 @@ class MainHitted(Main):
             self._logger.info(log)
 
     def _log_episode_summaries(self, agents):
-        rewards = np.array([a.reward for a in agents])
-        hitted = sum([a.hitted for a in agents])
+        rewards = agents.reward
+        hitted = agents.hitted.sum()
 
         self.sac.write_constant_summaries([
             {'tag': 'reward/mean', 'simple_value': rewards.mean()},
@@ -66,19 +91,18 @@ class MainHitted(Main):
 
     def _log_episode_info(self, iteration, iter_time, agents):
         global_step = format_global_step(self.sac.get_global_step())
-        rewards = [a.reward for a in agents]
-        rewards = ", ".join([f"{i:6.1f}" for i in rewards])
-        hitted = sum([a.hitted for a in agents])
-        max_step = max([a.steps for a in agents])
+        rewards = ", ".join([f"{i:6.1f}" for i in agents.reward])
+        hitted = agents.hitted.sum()
+        max_step = agents.steps.max()
 
         if not self.train_mode:
-            for agent in agents:
-                if agent.steps > 10:
+            for steps, agent_hitted in zip(agents.steps, agents.hitted):
+                if steps > 10:
                     self.evaluation_data['episodes'] += 1
-                    if agent.hitted:
+                    if agent_hitted:
                         self.evaluation_data['hitted'] += 1
-                        self.evaluation_data['hitted_steps'] += agent.steps
+                        self.evaluation_data['hitted_steps'] += steps
                     else:
-                        self.evaluation_data['failed_steps'] += agent.steps
+                        self.evaluation_data['failed_steps'] += steps
 
         self._logger.info(f'{iteration}({global_step}), T {iter_time:.2f}s, S {max_step}, R {rewards}, hitted {hitted}')
@@ -209,3 +209,19 @@ class ReadWriteLock:
                     self._rcond.notify_all()
                 elif self._write_waiter:
                     self._wcond.notify()
+
+
+class MutexLock:
+    """
+    A plain re-entrant mutex exposing the same read() / write() interface as ReadWriteLock,
+    without condition variables, timeout loops and stack-inspecting logs
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+
+    def write(self, custom_log=None):
+        return self._lock
+
+    def read(self, custom_log=None):
+        return self._lock
@@ -2,6 +2,7 @@ from typing import Any, List, Optional, Tuple, Union
 
 import numpy as np
 import torch
+from numpy.lib.stride_tricks import sliding_window_view
 
 
 def squash_correction_log_prob(dist, x):
@@ -99,35 +100,30 @@ def episode_to_batch(bn: int,
         bn_dones: [episode_len - bn + 1, bn]
         bn_probs: [episode_len - bn + 1, bn]
         f_seq_hidden_states: [episode_len - bn + 1, 1, *seq_hidden_state_shape]
+
+        All returned arrays except next_obs_list are strided views sharing memory with the episode,
+        materialize them (e.g. by fancy indexing) only when slicing the final batches
     """
-    bn_indexes = np.concatenate([l_indexes[:, i:i + bn]
-                                for i in range(episode_length - bn + 1)], axis=0)
-    bn_padding_masks = np.concatenate([l_padding_masks[:, i:i + bn]
-                                       for i in range(episode_length - bn + 1)], axis=0)
-    tmp_bn_obses_list = [None] * len(l_obses_list)
-    for j, l_obses in enumerate(l_obses_list):
-        tmp_bn_obses_list[j] = np.concatenate([l_obses[:, i:i + bn]
-                                              for i in range(episode_length - bn + 1)], axis=0)
-    bn_actions = np.concatenate([l_actions[:, i:i + bn]
-                                for i in range(episode_length - bn + 1)], axis=0)
-    bn_rewards = np.concatenate([l_rewards[:, i:i + bn]
-                                for i in range(episode_length - bn + 1)], axis=0)
-    tmp_next_obs_list = [None] * len(next_obs_list)
-    for j, l_obses in enumerate(l_obses_list):
-        tmp_next_obs_list[j] = np.concatenate([l_obses[:, i + bn]
-                                               for i in range(episode_length - bn)]
-                                              + [next_obs_list[j]],
-                                              axis=0)
-    bn_dones = np.concatenate([l_dones[:, i:i + bn]
-                              for i in range(episode_length - bn + 1)], axis=0)
+    n_windows = episode_length - bn + 1
+
+    def _sliding_windows(l_x):
+        # [1, episode_len, *shape] -> [n_windows, bn, *shape], a strided view without copying
+        return np.moveaxis(sliding_window_view(l_x[0, :episode_length], bn, axis=0), -1, 1)
+
+    bn_indexes = _sliding_windows(l_indexes)
+    bn_padding_masks = _sliding_windows(l_padding_masks)
+    tmp_bn_obses_list = [_sliding_windows(l_obses) for l_obses in l_obses_list]
+    bn_actions = _sliding_windows(l_actions)
+    bn_rewards = _sliding_windows(l_rewards)
+    tmp_next_obs_list = [np.concatenate([l_obses[0, bn:episode_length], next_obs], axis=0)
+                         for l_obses, next_obs in zip(l_obses_list, next_obs_list)]
+    bn_dones = _sliding_windows(l_dones)
 
     if l_probs is not None:
-        bn_probs = np.concatenate([l_probs[:, i:i + bn]
-                                   for i in range(episode_length - bn + 1)], axis=0)
+        bn_probs = _sliding_windows(l_probs)
 
     if l_seq_hidden_states is not None:
-        f_seq_hidden_states = np.concatenate([l_seq_hidden_states[:, i:i + 1]
-                                             for i in range(episode_length - bn + 1)], axis=0)
+        f_seq_hidden_states = l_seq_hidden_states[0, :n_windows, np.newaxis]
 
     return [bn_indexes,
             bn_padding_masks,
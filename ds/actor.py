@@ -4,6 +4,7 @@ import logging
 import logging.handlers
 import multiprocessing as mp
 import os
+import queue
 import sys
 import threading
 import time
@@ -15,18 +16,18 @@ import grpc
 import numpy as np
 
 import algorithm.config_helper as config_helper
-from algorithm.agent import Agent
+from algorithm.agent import AgentBatch
 from algorithm.utils import ReadWriteLock, elapsed_timer, gen_pre_n_actions
 from algorithm.utils.enums import *
 
 from .constants import *
 from .proto import evolver_pb2, evolver_pb2_grpc, learner_pb2, learner_pb2_grpc
 from .proto.ndarray_pb2 import Empty
-from .proto.numproto import ndarray_to_proto, proto_to_ndarray
+from .proto.numproto import get_codec, ndarray_to_proto, proto_to_ndarray
 from .proto.pingpong_pb2 import Ping, Pong
 from .sac_ds_base import SAC_DS_Base
-from .utils import (SharedMemoryManager, get_episode_shapes_dtypes,
-                    rpc_error_inspector, traverse_lists)
+from .utils import (SharedMemoryRingBuffer, get_episode_shapes_dtypes,
+                    rpc_error_inspector)
 
 
 class EpisodeSender:
@@ -35,15 +36,19 @@ class EpisodeSender:
                  model_abs_dir: str,
                  learner_host: str,
                  learner_port: int,
-                 episode_buffer: SharedMemoryManager,
-                 episode_length_array: mp.Array):
+                 episode_buffer: SharedMemoryRingBuffer,
+                 episode_codec: str = None,
+                 episode_codec_level: int = None,
+                 episode_quantize_images: bool = False):
         self._episode_buffer = episode_buffer
-        self._episode_length_array = episode_length_array
 
         config_helper.set_logger(Path(model_abs_dir).joinpath(f'actor_episode_sender_{os.getpid()}.log') if logger_in_file else None)
         self._logger = logging.getLogger(f'ds.actor.episode_sender_{os.getpid()}')
 
-        self._stub = StubEpisodeSenderController(learner_host, learner_port)
+        self._stub = StubEpisodeSenderController(learner_host, learner_port,
+                                                 episode_codec,
+                                                 episode_codec_level,
+                                                 episode_quantize_images)
 
         self._logger.info(f'EpisodeSender {os.getpid()} initialized')
 
@@ -59,16 +64,28 @@ class EpisodeSender:
             if episode is None:
                 continue
 
-            episode_length = self._episode_length_array[episode_idx]
+            with timer_add_trans:
+                # Pack the episodes already in the buffer into one message
+                episodes = []
+                num_transitions = 0
+                while episode is not None:
+                    # Encode the views of the shared memory right away and give them back
+                    try:
+                        episodes.append(self._stub.episode_to_proto(*episode))
+                        num_transitions += episode[0].shape[1]
+                    finally:
+                        self._episode_buffer.release(episode_idx)
 
-            episode = traverse_lists(episode, lambda e: e[:, :episode_length])
+                    if len(episodes) == ADD_STREAM_MAX_EPISODES or num_transitions >= ADD_STREAM_MAX_TRANSITIONS:
+                        break
 
-            with timer_add_trans:
-                self._stub.add_transitions(*episode)
+                    episode, episode_idx = self._episode_buffer.get(timeout=0)
+
+                self._stub.add_episodes(episodes)
 
 
 class Actor(object):
-    _agent_class = Agent
+    _agent_class = AgentBatch
 
     def __init__(self, root_dir, config_dir, args):
         self._logger = logging.getLogger('ds.actor')
@@ -210,6 +227,14 @@ class Actor(object):
 
                                      **self.sac_config)
 
+        self._remote_inference = self.base_config['remote_inference']
+        if self._remote_inference:
+            if self.sac_actor.seq_encoder == SEQ_ENCODER.ATTN:
+                self._logger.warning('Remote inference does not support ATTN, choosing actions locally')
+                self._remote_inference = False
+            elif any(self.sac_config['action_noise'] or []):
+                self._logger.warning('The action noise of actor is not applied in remote inference')
+
         self._logger.info(f'SAC_ACTOR started')
 
     def _init_episode_sender(self, learner_host, learner_port):
@@ -221,15 +246,14 @@ class Actor(object):
             self.action_size,
             self.sac_actor.seq_hidden_state_shape if self.sac_actor.seq_encoder is not None else None)
 
-        self._episode_buffer = SharedMemoryManager(self.base_config['episode_queue_size'],
-                                                   logger=self._logger,
-                                                   counter_get_shm_index_empty_log='Episode shm index is empty',
-                                                   timer_get_shm_index_log='Get an episode shm index',
-                                                   timer_get_data_log='Get an episode',
-                                                   log_repeat=ELAPSED_REPEAT)
+        self._episode_buffer = SharedMemoryRingBuffer(self.base_config['episode_queue_size'],
+                                                      logger=self._logger,
+                                                      counter_get_empty_log='Episode buffer is empty',
+                                                      timer_get_log='Get an episode',
+                                                      counter_drop_log='Episode dropped',
+                                                      log_repeat=ELAPSED_REPEAT)
 
         self._episode_buffer.init_from_shapes(episode_shapes, episode_dtypes)
-        self._episode_length_array = mp.Array('i', range(self.base_config['episode_queue_size']))
 
         for _ in range(self.base_config['episode_sender_process_num']):
             mp.Process(target=EpisodeSender, kwargs={
@@ -238,7 +262,9 @@ class Actor(object):
                 'learner_host': learner_host,
                 'learner_port': learner_port,
                 'episode_buffer': self._episode_buffer,
-                'episode_length_array': self._episode_length_array
+                'episode_codec': self.base_config['episode_codec'],
+                'episode_codec_level': self.base_config['episode_codec_level'],
+                'episode_quantize_images': self.base_config['episode_quantize_images']
             }).start()
 
     def _update_policy_variables(self):
@@ -277,7 +303,7 @@ class Actor(object):
             l_probs: [1, episode_len]
             l_seq_hidden_states: [1, episode_len, *seq_hidden_state_shape]
         """
-        episode_idx = self._episode_buffer.put([
+        self._episode_buffer.put([
             l_indexes,
             l_padding_masks,
             l_obses_list,
@@ -288,7 +314,6 @@ class Actor(object):
             l_probs,
             l_seq_hidden_states
         ])
-        self._episode_length_array[episode_idx] = l_indexes.shape[1]
 
     def _run(self):
         num_agents = self.base_config['n_agents']
@@ -301,70 +326,60 @@ class Actor(object):
             initial_seq_hidden_state = self.sac_actor.get_initial_seq_hidden_state(num_agents)  # [n_agents, *seq_hidden_state_shape]
             seq_hidden_state = initial_seq_hidden_state
 
-        agents = [self._agent_class(i, self.obs_shapes, self.action_size,
-                                    seq_hidden_state_shape=self.sac_actor.seq_hidden_state_shape if seq_encoder is not None else None,
-                                    max_return_episode_trans=self.base_config['max_episode_length'])
-                  for i in range(num_agents)]
+        agents = self._agent_class(num_agents, self.obs_shapes, self.action_size,
+                                   seq_hidden_state_shape=self.sac_actor.seq_hidden_state_shape if seq_encoder is not None else None,
+                                   max_return_episode_trans=self.base_config['max_episode_length'])
 
         force_reset = False
         iteration = 0
 
         while self._stub.connected and self._evolver_stub.connected:
-            if self.base_config['reset_on_iteration'] or any([a.max_reached for a in agents]) or force_reset:
+            if self.base_config['reset_on_iteration'] or agents.max_reached.any() or force_reset:
                 obs_list = self.env.reset(reset_config=self.reset_config)
-                for agent in agents:
-                    agent.clear()
+                agents.clear()
             else:
-                for agent in agents:
-                    agent.reset()
+                agents.reset()
 
             step = 0
 
-            self._update_policy_variables()
+            # Remote inference always uses the latest variables of learner
+            if not self._remote_inference:
+                self._update_policy_variables()
 
             try:
-                while not all([a.done for a in agents]) and self._stub.connected:
+                while not agents.done.all() and self._stub.connected:
                     # burn in padding
-                    for agent in [a for a in agents if a.is_empty()]:
-                        for _ in range(self.sac_actor.burn_in_step):
-                            agent.add_transition(
-                                obs_list=[np.zeros(t, dtype=np.float32) for t in self.obs_shapes],
-                                action=np.zeros(self.action_size),
-                                reward=0.,
-                                local_done=False,
-                                max_reached=False,
-                                next_obs_list=[np.zeros(t, dtype=np.float32) for t in self.obs_shapes],
-                                prob=0.,
-                                is_padding=True,
-                                seq_hidden_state=initial_seq_hidden_state[0]
-                            )
+                    agents.add_padding(self.sac_actor.burn_in_step,
+                                       action=np.zeros(self.action_size),
+                                       seq_hidden_state=initial_seq_hidden_state[0] if seq_encoder is not None else None)
 
                     with self._sac_actor_lock.read():
-                        if seq_encoder == SEQ_ENCODER.RNN:
+                        if self._remote_inference and seq_encoder == SEQ_ENCODER.RNN:
+                            remote_action = self._stub.get_action(obs_list,
+                                                                  pre_action,
+                                                                  seq_hidden_state)
+
+                        elif self._remote_inference:
+                            remote_action = self._stub.get_action(obs_list)
+
+                        elif seq_encoder == SEQ_ENCODER.RNN:
                             action, prob, next_seq_hidden_state = self.sac_actor.choose_rnn_action(obs_list,
                                                                                                    pre_action,
                                                                                                    seq_hidden_state,
                                                                                                    force_rnd_if_avaiable=True)
 
                         elif seq_encoder == SEQ_ENCODER.ATTN:
-                            ep_length = max(1, max([a.episode_length for a in agents]))
-
-                            all_episode_trans = [a.get_episode_trans(ep_length) for a in agents]
-                            (all_ep_indexes,
-                                all_ep_padding_masks,
-                                all_ep_obses_list,
-                                all_ep_actions,
-                                all_all_ep_rewards,
-                                all_next_obs_list,
-                                all_ep_dones,
-                                all_ep_probs,
-                                all_ep_attn_states) = zip(*all_episode_trans)
-
-                            ep_indexes = np.concatenate(all_ep_indexes)
-                            ep_padding_masks = np.concatenate(all_ep_padding_masks)
-                            ep_obses_list = [np.concatenate(o) for o in zip(*all_ep_obses_list)]
-                            ep_actions = np.concatenate(all_ep_actions)
-                            ep_attn_states = np.concatenate(all_ep_attn_states)
+                            ep_length = max(1, agents.episode_length.max())
+
+                            (ep_indexes,
+                                ep_padding_masks,
+                                ep_obses_list,
+                                ep_actions,
+                                ep_rewards,
+                                _,
+                                ep_dones,
+                                ep_probs,
+                                ep_attn_states) = agents.get_episode_trans(ep_length)
 
                             ep_indexes = np.concatenate([ep_indexes, ep_indexes[:, -1:] + 1], axis=1)
                             ep_padding_masks = np.concatenate([ep_padding_masks,
@@ -383,6 +398,19 @@ class Actor(object):
                             action, prob = self.sac_actor.choose_action(obs_list,
                                                                         force_rnd_if_avaiable=True)
 
+                    if self._remote_inference:
+                        # None if learner is not available after retries
+                        if remote_action is None:
+                            force_reset = True
+
+                            self._logger.warning('Remote inference failed, episode ignored')
+                            break
+
+                        if seq_encoder == SEQ_ENCODER.RNN:
+                            action, prob, next_seq_hidden_state = remote_action
+                        else:
+                            action, prob = remote_action
+
                     next_obs_list, reward, local_done, max_reached = self.env.step(action[..., :self.d_action_size],
                                                                                    action[..., self.d_action_size:])
 
@@ -396,22 +424,17 @@ class Actor(object):
                         local_done = [True] * len(agents)
                         max_reached = [True] * len(agents)
 
-                    episode_trans_list = [
-                        agents[i].add_transition(
-                            obs_list=[o[i] for o in obs_list],
-                            action=action[i],
-                            reward=reward[i],
-                            local_done=local_done[i],
-                            max_reached=max_reached[i],
-                            next_obs_list=[o[i] for o in next_obs_list],
-                            prob=prob[i],
-                            is_padding=False,
-                            seq_hidden_state=seq_hidden_state[i] if seq_encoder is not None else None,
-                        )
-                        for i in range(len(agents))
-                    ]
-
-                    episode_trans_list = [t for t in episode_trans_list if t is not None]
+                    episode_trans_list = agents.add_transitions(
+                        obs_list=obs_list,
+                        action=action,
+                        reward=reward,
+                        local_done=local_done,
+                        max_reached=max_reached,
+                        next_obs_list=next_obs_list,
+                        prob=prob,
+                        seq_hidden_state=seq_hidden_state if seq_encoder is not None else None,
+                    )
+
                     if len(episode_trans_list) != 0:
                         # ep_indexes, ep_padding_masks,
                         # ep_obses_list, ep_actions, ep_rewards, next_obs_list, ep_dones, ep_probs,
@@ -439,9 +462,8 @@ class Actor(object):
         self.close()
 
     def _log_episode_info(self, iteration, agents):
-        rewards = [a.reward for a in agents]
-        rewards = ", ".join([f"{i:6.1f}" for i in rewards])
-        max_step = max([a.steps for a in agents])
+        rewards = ", ".join([f"{i:6.1f}" for i in agents.reward])
+        max_step = agents.steps.max()
         self._logger.info(f'{iteration}, S {max_step}, R {rewards}')
 
     def close(self):
@@ -538,6 +560,16 @@ class StubController:
         t_learner = threading.Thread(target=self._start_learner_persistence)
         t_learner.start()
 
+        self._policy_variables_lock = threading.Lock()
+        self._policy_variables = None  # The latest variables not fetched yet
+        self._policy_variables_version = 0
+        self._keyframe_policy_variables = None
+        self._keyframe_policy_variables_version = 0
+        self._policy_variables_stream = None
+        self._policy_variables_stream_unimplemented = False
+        # Started when the variables are first requested, never if using remote inference
+        self._policy_variables_thread = None
+
     @property
     def connected(self):
         return self._learner_connected
@@ -565,25 +597,89 @@ class StubController:
                 time.sleep(RECONNECTION_TIME)
 
     @rpc_error_inspector
-    def get_action(self, obs_list, rnn_state=None):
+    def get_action(self, obs_list, pre_action=None, seq_hidden_state=None):
+        """
+        Choose actions by the batched inference of learner,
+        `pre_action` and `seq_hidden_state` are only for RNN
+        """
         request = learner_pb2.GetActionRequest(obs_list=[ndarray_to_proto(obs)
                                                          for obs in obs_list],
-                                               rnn_state=ndarray_to_proto(rnn_state))
+                                               pre_action=ndarray_to_proto(pre_action),
+                                               seq_hidden_state=ndarray_to_proto(seq_hidden_state))
 
         response = self._learner_stub.GetAction(request)
-        action = proto_to_ndarray(response.action)
-        rnn_state = proto_to_ndarray(response.rnn_state)
+        # Copied since actions and hidden states are modified in place by actor
+        action = np.array(proto_to_ndarray(response.action))
+        prob = proto_to_ndarray(response.prob)
+        next_seq_hidden_state = proto_to_ndarray(response.next_seq_hidden_state)
 
-        if rnn_state is None:
-            return action
+        if next_seq_hidden_state is None:
+            return action, prob
         else:
-            return action, rnn_state
+            return action, prob, np.array(next_seq_hidden_state)
 
     @rpc_error_inspector
     def get_policy_variables(self):
-        response = self._learner_stub.GetPolicyVariables(Empty())
-        if response.succeeded:
-            return [proto_to_ndarray(v) for v in response.variables]
+        """
+        Returns the latest policy variables pushed by learner, None if not updated
+        """
+        if self._policy_variables_thread is None:
+            self._policy_variables_thread = threading.Thread(target=self._start_policy_variables_stream, daemon=True)
+            self._policy_variables_thread.start()
+
+        if self._policy_variables_stream_unimplemented:
+            # Polling learners without StreamPolicyVariables
+            response = self._learner_stub.GetPolicyVariables(Empty())
+            if response.succeeded:
+                return [proto_to_ndarray(v) for v in response.variables]
+            return
+
+        with self._policy_variables_lock:
+            variables, self._policy_variables = self._policy_variables, None
+
+        return variables
+
+    def _decode_policy_variables(self, response: learner_pb2.PolicyVariables):
+        variables = [proto_to_ndarray(v) for v in response.variables]
+
+        if response.keyframe_version == response.version:
+            self._keyframe_policy_variables = variables
+            self._keyframe_policy_variables_version = response.version
+            return variables
+
+        if response.keyframe_version != self._keyframe_policy_variables_version:
+            return
+
+        # Unchanged variables are None
+        return [k_v if d_v is None else k_v + d_v.astype(k_v.dtype)
+                for k_v, d_v in zip(self._keyframe_policy_variables, variables)]
+
+    def _start_policy_variables_stream(self):
+        while not self._closed:
+            try:
+                self._policy_variables_stream = self._learner_stub.StreamPolicyVariables(
+                    learner_pb2.PolicyVariablesRequest(version=self._policy_variables_version,
+                                                       keyframe_version=self._keyframe_policy_variables_version))
+                for response in self._policy_variables_stream:
+                    variables = self._decode_policy_variables(response)
+                    if variables is None:
+                        # Reconnect with the keyframe version held, so that learner sends its keyframe again
+                        self._logger.warning(f'Keyframe {response.keyframe_version} of policy variables is missing')
+                        self._policy_variables_stream.cancel()
+                        break
+
+                    with self._policy_variables_lock:
+                        self._policy_variables = variables
+                    self._policy_variables_version = response.version
+            except grpc.RpcError as e:
+                if e.code() == grpc.StatusCode.UNIMPLEMENTED:
+                    self._logger.warning('StreamPolicyVariables is not implemented by learner, polling instead')
+                    self._policy_variables_stream_unimplemented = True
+                    break
+                elif e.code() != grpc.StatusCode.CANCELLED:
+                    self._logger.error('Connection lost in StreamPolicyVariables')
+
+            time.sleep(RECONNECTION_TIME)
 
     def _start_learner_persistence(self):
         def request_messages():
@@ -609,34 +705,87 @@ class StubController:
 
     def close(self):
         self._closed = True
+        if self._policy_variables_stream is not None:
+            self._policy_variables_stream.cancel()
 
 
 class StubEpisodeSenderController:
-    def __init__(self, learner_host, learner_port):
+    _closed = False
+
+    def __init__(self, learner_host, learner_port,
+                 codec=None, codec_level=None, quantize_images=False):
+        self._logger = logging.getLogger('ds.actor.episode_sender_stub')
+
+        if codec is not None:
+            get_codec(codec)  # Fail early if the codec is unknown or not installed
+        self._codec = codec
+        self._codec_level = codec_level
+        self._quantize_images = quantize_images
+
         self._learner_channel = grpc.insecure_channel(f'{learner_host}:{learner_port}', [
             ('grpc.max_reconnect_backoff_ms', MAX_RECONNECT_BACKOFF_MS)
         ])
         self._learner_stub = learner_pb2_grpc.LearnerServiceStub(self._learner_channel)
 
-    @rpc_error_inspector
-    def add_transitions(self,
-                        l_indexes,
-                        l_padding_masks,
-                        l_obses_list,
-                        l_actions,
-                        l_rewards,
-                        next_obs_list,
-                        l_dones,
-                        l_mu_probs,
-                        l_seq_hidden_states=None):
-        self._learner_stub.Add(learner_pb2.AddRequest(l_indexes=ndarray_to_proto(l_indexes),
-                                                      l_padding_masks=ndarray_to_proto(l_padding_masks),
-                                                      l_obses_list=[ndarray_to_proto(l_obses)
-                                                                    for l_obses in l_obses_list],
-                                                      l_actions=ndarray_to_proto(l_actions),
-                                                      l_rewards=ndarray_to_proto(l_rewards),
-                                                      next_obs_list=[ndarray_to_proto(next_obs)
-                                                                     for next_obs in next_obs_list],
-                                                      l_dones=ndarray_to_proto(l_dones),
-                                                      l_mu_probs=ndarray_to_proto(l_mu_probs),
-                                                      l_seq_hidden_states=ndarray_to_proto(l_seq_hidden_states)))
+        self._add_stream_queue = queue.Queue(ADD_STREAM_QUEUE_SIZE)
+        self._add_stream_request = None  # The message taken from the queue but not sent yet
+        t_add_stream = threading.Thread(target=self._start_add_stream, daemon=True)
+        t_add_stream.start()
+
+    def _ndarray_to_proto(self, nda, is_image=False):
+        return ndarray_to_proto(nda, self._codec, self._codec_level,
+                                quantize=is_image and self._quantize_images)
+
+    def episode_to_proto(self,
+                         l_indexes,
+                         l_padding_masks,
+                         l_obses_list,
+                         l_actions,
+                         l_rewards,
+                         next_obs_list,
+                         l_dones,
+                         l_mu_probs,
+                         l_seq_hidden_states=None):
+        # Image observations are [1, episode_len, H, W, C] and next images are [1, H, W, C]
+        return learner_pb2.AddRequest(l_indexes=self._ndarray_to_proto(l_indexes),
+                                      l_padding_masks=self._ndarray_to_proto(l_padding_masks),
+                                      l_obses_list=[self._ndarray_to_proto(l_obses, l_obses.ndim == 5)
+                                                    for l_obses in l_obses_list],
+                                      l_actions=self._ndarray_to_proto(l_actions),
+                                      l_rewards=self._ndarray_to_proto(l_rewards),
+                                      next_obs_list=[self._ndarray_to_proto(next_obs, next_obs.ndim == 4)
+                                                     for next_obs in next_obs_list],
+                                      l_dones=self._ndarray_to_proto(l_dones),
+                                      l_mu_probs=self._ndarray_to_proto(l_mu_probs),
+                                      l_seq_hidden_states=self._ndarray_to_proto(l_seq_hidden_states))
+
+    def add_episodes(self, episodes: List[learner_pb2.AddRequest]):
+        """
+        Queue episodes as one message of the AddStream stream,
+        blocked if the stream cannot keep up
+        """
+        self._add_stream_queue.put(learner_pb2.AddStreamRequest(episodes=episodes))
+
+    def _start_add_stream(self):
+        def request_messages():
+            while not self._closed:
+                if self._add_stream_request is None:
+                    try:
+                        self._add_stream_request = self._add_stream_queue.get(timeout=EPISODE_QUEUE_TIMEOUT)
+                    except queue.Empty:
+                        continue
+
+                yield self._add_stream_request
+                # grpc asks for the next message only after this one is sent
+                self._add_stream_request = None
+
+        # The message being sent when the connection is lost is sent again in the next stream
+        while not self._closed:
+            try:
+                self._learner_stub.AddStream(request_messages())
+            except grpc.RpcError:
+                self._logger.error('Connection lost in AddStream')
+                time.sleep(RECONNECTION_TIME)
+
+    def close(self):
+        self._closed = True
@@ -9,3 +9,8 @@ ELAPSED_REPEAT = 50
 
 EPISODE_QUEUE_TIMEOUT = 0.5
 BATCH_QUEUE_TIMEOUT = 0.5
+
+ADD_STREAM_MAX_EPISODES = 32  # Max episodes packed in one AddStream message
+ADD_STREAM_MAX_TRANSITIONS = 4096  # Max transitions packed in one AddStream message
+ADD_STREAM_QUEUE_SIZE = 2  # Max AddStream messages waiting to be sent
+ADD_EPISODE_QUEUE_SIZE = 64  # Max received episodes waiting to be added by learner
@@ -1,8 +1,10 @@
+import asyncio
 import copy
 import importlib
 import json
 import logging
 import multiprocessing as mp
+import queue
 import shutil
 import socket
 import sys
@@ -28,17 +30,20 @@ from .proto.ndarray_pb2 import Empty
 from .proto.numproto import ndarray_to_proto, proto_to_ndarray
 from .proto.pingpong_pb2 import Ping, Pong
 from .sac_ds_base import SAC_DS_Base
-from .utils import (PeerSet, SharedMemoryManager, get_episode_shapes_dtypes,
+from .utils import (InferenceBatcher, PeerSet, SharedMemoryManager,
+                    SharedMemoryRingBuffer, get_episode_shapes_dtypes,
                     rpc_error_inspector)
 
 
 class Learner:
     _agent_class = Agent
     _policy_variables_cache = None
+    _policy_variables_version = 0
 
     def __init__(self, root_dir, config_dir, args):
         self._closed = False
         self._registered = False
+        self._policy_variables_cond = threading.Condition()
 
         self._logger = logging.getLogger('ds.learner')
 
@@ -225,21 +230,19 @@ class Learner:
             self.action_size,
             self.sac_bak.seq_hidden_state_shape if self.sac_bak.seq_encoder is not None else None)
 
-        self._episode_buffer = SharedMemoryManager(self.base_config['episode_queue_size'],
-                                                   logger=self._logger,
-                                                   counter_get_shm_index_empty_log='Episode shm index is empty',
-                                                   timer_get_shm_index_log='Get an episode shm index',
-                                                   timer_get_data_log='Get an episode',
-                                                   log_repeat=ELAPSED_REPEAT)
+        self._episode_buffer = SharedMemoryRingBuffer(self.base_config['episode_queue_size'],
+                                                      logger=self._logger,
+                                                      counter_get_empty_log='Episode buffer is empty',
+                                                      timer_get_log='Get an episode',
+                                                      counter_drop_log='Episode dropped',
+                                                      log_repeat=ELAPSED_REPEAT)
         self._episode_buffer.init_from_shapes(episode_shapes, episode_dtypes)
-        self._episode_length_array = mp.Array('i', range(self.base_config['episode_queue_size']))
 
         self.cmd_pipe_client, cmd_pipe_server = mp.Pipe()
 
         self.learner_trainer_process = mp.Process(target=Trainer, kwargs={
             'all_variables_buffer': self._all_variables_buffer,
             'episode_buffer': self._episode_buffer,
-            'episode_length_array': self._episode_length_array,
             'cmd_pipe_server': cmd_pipe_server,
 
             'logger_in_file': self.logger_in_file,
@@ -275,7 +278,13 @@ class Learner:
             self._force_close()
             return
 
-        self._policy_variables_cache = self.sac_bak.get_policy_variables()
+        # On CPU, numpy variables share memory with the parameters updated in place,
+        # so each version is copied before being handed out
+        policy_variables = [v.copy() for v in self.sac_bak.get_policy_variables()]
+        with self._policy_variables_cond:
+            self._policy_variables_cache = policy_variables
+            self._policy_variables_version += 1
+            self._policy_variables_cond.notify_all()
 
         self._logger.info('Updated sac_bak')
 
@@ -300,6 +309,32 @@ class Learner:
     def _get_policy_variables(self):
         return self._policy_variables_cache
 
+    def _wait_policy_variables(self, version, timeout=None):
+        """
+        Wait until the policy variables are newer than `version`.
+        Returns the latest version and variables, unchanged if timed out
+        """
+        with self._policy_variables_cond:
+            self._policy_variables_cond.wait_for(lambda: self._policy_variables_version > version, timeout)
+            return self._policy_variables_version, self._policy_variables_cache
+
+    def _choose_action(self, obs_list, pre_action=None, seq_hidden_state=None):
+        """
+        Batched inference for actors by sac_bak
+        Returns:
+            action, prob, next_seq_hidden_state (None if not RNN)
+        """
+        with self._sac_bak_lock.read('remote_inference'):
+            if self.sac_bak.seq_encoder == SEQ_ENCODER.RNN:
+                return self.sac_bak.choose_rnn_action(obs_list,
+                                                      pre_action,
+                                                      seq_hidden_state,
+                                                      force_rnd_if_avaiable=True)
+            else:
+                action, prob = self.sac_bak.choose_action(obs_list,
+                                                          force_rnd_if_avaiable=True)
+                return action, prob, None
+
     def _get_nn_variables(self):
         self.cmd_pipe_client.send(('GET', None))
         nn_variables = self.cmd_pipe_client.recv()
@@ -334,7 +369,7 @@ class Learner:
             l_probs: [1, episode_len]
             l_seq_hidden_states: [1, episode_len, *seq_hidden_state_shape]
         """
-        episode_idx = self._episode_buffer.put([
+        self._episode_buffer.put([
             l_indexes,
             l_padding_masks,
             l_obses_list,
@@ -345,7 +380,6 @@ class Learner:
             l_probs,
             l_seq_hidden_states
         ])
-        self._episode_length_array[episode_idx] = l_indexes.shape[1]
 
     def _policy_evaluation(self):
         num_agents = self.base_config['n_agents']
@@ -519,18 +553,25 @@ class Learner:
         self._logger.info(f'{iteration}, {time_elapse:.2f}m, S {max_step}, R {rewards}')
 
     def _run_learner_server(self, learner_port):
+        asyncio.run(self._serve_learner(learner_port))
+
+    async def _serve_learner(self, learner_port):
+        self._server_loop = asyncio.get_running_loop()
+
         servicer = LearnerService(self)
-        self.server = grpc.server(futures.ThreadPoolExecutor(max_workers=MAX_THREAD_WORKERS),
-                                  options=[
+        # Streaming RPCs are coroutines on the event loop, so that streams kept by actors hold no worker threads.
+        # Unary RPCs are still run in the thread pool
+        self.server = grpc.aio.server(futures.ThreadPoolExecutor(max_workers=MAX_THREAD_WORKERS),
+                                      options=[
             ('grpc.max_send_message_length', MAX_MESSAGE_LENGTH),
             ('grpc.max_receive_message_length', MAX_MESSAGE_LENGTH)
         ])
         learner_pb2_grpc.add_LearnerServiceServicer_to_server(servicer, self.server)
         self.server.add_insecure_port(f'[::]:{learner_port}')
-        self.server.start()
+        await self.server.start()
         self._logger.info(f'Learner server is running on [{learner_port}]...')
 
-        self.server.wait_for_termination()
+        await self.server.wait_for_termination()
 
     def _force_close(self):
         self._logger.warning('Force closing')
@@ -543,8 +584,8 @@ class Learner:
 
         if hasattr(self, 'env'):
             self.env.close()
-        if hasattr(self, 'server'):
-            self.server.stop(None)
+        if hasattr(self, 'server') and not self._server_loop.is_closed():
+            asyncio.run_coroutine_threadsafe(self.server.stop(None), self._server_loop)
 
         self._evolver_stub.close()
         self.learner_trainer_process.close()
@@ -556,11 +597,21 @@ class LearnerService(learner_pb2_grpc.LearnerServiceServicer):
     _policy_variables_id_cache = None
     _proto_policy_variables_cache = None
 
+    _policy_variables_version = 0
+    _keyframe_policy_variables = None
+    _proto_keyframe_policy_variables = None
+    _proto_delta_policy_variables = None
+
     def __init__(self, learner: Learner):
         self._get_actor_register_result = learner._get_actor_register_result
 
         self._add_episode = learner._add_episode
         self._get_policy_variables = learner._get_policy_variables
+        self._wait_policy_variables = learner._wait_policy_variables
+        self._policy_variables_keyframe_interval = learner.base_config['policy_variables_keyframe_interval']
+        self._inference_batcher = InferenceBatcher(learner._choose_action,
+                                                   learner.base_config['inference_max_batch_size'],
+                                                   learner.base_config['inference_max_latency'])
         self._get_nn_variables = learner._get_nn_variables
         self._udpate_nn_variables = learner._udpate_nn_variables
 
@@ -572,20 +623,33 @@ class LearnerService(learner_pb2_grpc.LearnerServiceServicer):
         self._lock = RLock(timeout=1, logger=self._logger)
         self._actor_id = 0
 
+        self._policy_variables_lock = threading.Lock()
+
+        # The latest protos of policy variables (keyframe, delta),
+        # encoded in one thread and shared by all StreamPolicyVariables coroutines
+        self._loop = asyncio.get_running_loop()
+        self._proto_policy_variables = None
+        self._policy_variables_updated = asyncio.Event()
+        threading.Thread(target=self._forever_encode_policy_variables, daemon=True).start()
+
+        # Episodes from AddStream are decoded and added in one thread instead of the event loop
+        self._add_episode_queue = queue.Queue(ADD_EPISODE_QUEUE_SIZE)
+        threading.Thread(target=self._forever_add_episode, daemon=True).start()
+
     def _record_peer(self, context):
         peer = context.peer()
 
-        def _unregister_peer():
+        def _unregister_peer(context):
             with self._lock:
                 self._logger.warning(f'Actor {peer} disconnected')
                 self._peer_set.disconnect(context.peer())
 
-        context.add_callback(_unregister_peer)
+        context.add_done_callback(_unregister_peer)
         self._peer_set.connect(peer)
 
-    def Persistence(self, request_iterator, context):
+    async def Persistence(self, request_iterator, context):
         self._record_peer(context)
-        for request in request_iterator:
+        async for request in request_iterator:
             yield Pong(time=int(time.time() * 1000))
 
     def RegisterActor(self, request, context):
@@ -638,17 +702,117 @@ class LearnerService(learner_pb2_grpc.LearnerServiceServicer):
         return learner_pb2.NNVariables(succeeded=True,
                                        variables=self._proto_policy_variables_cache)
 
+    def _get_proto_policy_variables(self, version, variables):
+        """
+        Encode each version of policy variables once for all actors.
+        Returns the protos of the latest keyframe and of the delta from it,
+        the delta is None if the latest version is the keyframe
+        """
+        with self._policy_variables_lock:
+            if version > self._policy_variables_version:
+                if (self._keyframe_policy_variables is None
+                        or version - self._proto_keyframe_policy_variables.version >= self._policy_variables_keyframe_interval):
+                    # Variables may be updated in place after being encoded
+                    self._keyframe_policy_variables = [v.copy() for v in variables]
+                    self._proto_keyframe_policy_variables = learner_pb2.PolicyVariables(
+                        version=version,
+                        keyframe_version=version,
+                        variables=[ndarray_to_proto(v) for v in variables])
+                    self._proto_delta_policy_variables = None
+                else:
+                    # Differences are always from the keyframe, so float16 errors are not accumulated
+                    self._proto_delta_policy_variables = learner_pb2.PolicyVariables(
+                        version=version,
+                        keyframe_version=self._proto_keyframe_policy_variables.version,
+                        variables=[ndarray_to_proto(None if np.array_equal(v, k_v) else (v - k_v).astype(np.float16))
+                                   for v, k_v in zip(variables, self._keyframe_policy_variables)])
+                self._policy_variables_version = version
+
+            return self._proto_keyframe_policy_variables, self._proto_delta_policy_variables
+
+    def _forever_encode_policy_variables(self):
+        version = 0
+        while True:
+            version, variables = self._wait_policy_variables(version)
+            proto_policy_variables = self._get_proto_policy_variables(version, variables)
+            self._loop.call_soon_threadsafe(self._publish_proto_policy_variables, proto_policy_variables)
+
+    def _publish_proto_policy_variables(self, proto_policy_variables):
+        self._proto_policy_variables = proto_policy_variables
+        # Wake up all streams waiting for new policy variables
+        self._policy_variables_updated.set()
+        self._policy_variables_updated = asyncio.Event()
+
+    # From actor
+    async def StreamPolicyVariables(self, request, context):
+        version = request.version
+        keyframe_version = request.keyframe_version
+
+        while True:
+            # Taken before yielding, so that versions published meanwhile are not missed
+            policy_variables_updated = self._policy_variables_updated
+
+            if self._proto_policy_variables is not None:
+                proto_keyframe, proto_delta = self._proto_policy_variables
+                latest_version = proto_keyframe.version if proto_delta is None else proto_delta.version
+
+                if latest_version != version:
+                    if proto_keyframe.version != keyframe_version:
+                        keyframe_version = proto_keyframe.version
+                        yield proto_keyframe
+                    if proto_delta is not None:
+                        yield proto_delta
+
+                    version = latest_version
+
+            await policy_variables_updated.wait()
+
+    # From actor
+    def GetAction(self, request, context):
+        action, prob, next_seq_hidden_state = self._inference_batcher(
+            [proto_to_ndarray(obs) for obs in request.obs_list],
+            proto_to_ndarray(request.pre_action),
+            proto_to_ndarray(request.seq_hidden_state))
+
+        return learner_pb2.Action(action=ndarray_to_proto(action),
+                                  prob=ndarray_to_proto(prob),
+                                  next_seq_hidden_state=ndarray_to_proto(next_seq_hidden_state))
+
+    def _proto_to_episode(self, request: learner_pb2.AddRequest):
+        return (proto_to_ndarray(request.l_indexes),
+                proto_to_ndarray(request.l_padding_masks),
+                [proto_to_ndarray(l_obses) for l_obses in request.l_obses_list],
+                proto_to_ndarray(request.l_actions),
+                proto_to_ndarray(request.l_rewards),
+                [proto_to_ndarray(obs) for obs in request.next_obs_list],
+                proto_to_ndarray(request.l_dones),
+                proto_to_ndarray(request.l_mu_probs),
+                proto_to_ndarray(request.l_seq_hidden_states))
+
+    def _forever_add_episode(self):
+        while True:
+            episode = self._add_episode_queue.get()
+            try:
+                self._add_episode(*self._proto_to_episode(episode))
+            except Exception as e:
+                self._logger.error(f'Error in adding episode: {e}')
+
     # From actor
     def Add(self, request, context):
-        self._add_episode(proto_to_ndarray(request.l_indexes),
-                          proto_to_ndarray(request.l_padding_masks),
-                          [proto_to_ndarray(l_obses) for l_obses in request.l_obses_list],
-                          proto_to_ndarray(request.l_actions),
-                          proto_to_ndarray(request.l_rewards),
-                          [proto_to_ndarray(obs) for obs in request.next_obs_list],
-                          proto_to_ndarray(request.l_dones),
-                          proto_to_ndarray(request.l_mu_probs),
-                          proto_to_ndarray(request.l_seq_hidden_states))
+        self._add_episode(*self._proto_to_episode(request))
+
+        return Empty()
+
+    # From actor
+    async def AddStream(self, request_iterator, context):
+        async for request in request_iterator:
+            for episode in request.episodes:
+                try:
+                    self._add_episode_queue.put_nowait(episode)
+                except queue.Full:
+                    # Wait out of the event loop if learner cannot keep up.
+                    # The stream is not read meanwhile, so that the actor is throttled by grpc flow control
+                    await asyncio.get_running_loop().run_in_executor(None, self._add_episode_queue.put, episode)
 
         return Empty()
 
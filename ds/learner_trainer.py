@@ -17,7 +17,8 @@ from algorithm.utils import (RLock, elapsed_counter, elapsed_timer,
 
 from .constants import *
 from .sac_ds_base import SAC_DS_Base
-from .utils import SharedMemoryManager, get_batch_shapes_dtype, traverse_lists
+from .utils import (SharedMemoryManager, SharedMemoryRingBuffer,
+                    get_batch_shapes_dtype, traverse_lists)
 
 
 class BatchGenerator:
@@ -27,14 +28,12 @@ class BatchGenerator:
                  burn_in_step: int,
                  n_step: int,
                  batch_size: int,
-                 episode_buffer: SharedMemoryManager,
-                 episode_length_array: mp.Array,
+                 episode_buffer: SharedMemoryRingBuffer,
                  batch_buffer: SharedMemoryManager):
         self.burn_in_step = burn_in_step
         self.n_step = n_step
         self.batch_size = batch_size
         self._episode_buffer = episode_buffer
-        self._episode_length_array = episode_length_array
         self._batch_buffer = batch_buffer
 
         # Since no set_logger() in main.py
@@ -56,64 +55,74 @@ class BatchGenerator:
             if episode is None:
                 continue
 
-            (l_indexes,
-             l_padding_masks,
-             l_obses_list,
-             l_actions,
-             l_rewards,
-             next_obs_list,
-             l_dones,
-             l_mu_probs,
-             l_seq_hidden_states) = episode
-            episode_length = self._episode_length_array[episode_idx]
-
-            """
-            bn_indexes: [episode_len - bn + 1, bn]
-            bn_padding_masks: [episode_len - bn + 1, bn]
-            bn_obses_list: list([episode_len - bn + 1, bn, *obs_shapes_i], ...)
-            bn_actions: [episode_len - bn + 1, bn, action_size]
-            bn_rewards: [episode_len - bn + 1, bn]
-            next_obs_list: list([episode_len - bn + 1, *obs_shapes_i], ...)
-            bn_dones: [episode_len - bn + 1, bn]
-            bn_mu_probs: [episode_len - bn + 1, bn]
-            f_seq_hidden_states: [episode_len - bn + 1, 1, *seq_hidden_state_shape]
-            """
-            ori_batch = episode_to_batch(self.burn_in_step + self.n_step,
-                                         episode_length,
-                                         l_indexes,
-                                         l_padding_masks,
-                                         l_obses_list,
-                                         l_actions,
-                                         l_rewards,
-                                         next_obs_list,
-                                         l_dones,
-                                         l_probs=l_mu_probs,
-                                         l_seq_hidden_states=l_seq_hidden_states)
-
-            if rest_batch is not None:
-                ori_batch = traverse_lists((rest_batch, ori_batch), lambda rb, b: np.concatenate([rb, b]))
+            try:
+                (l_indexes,
+                 l_padding_masks,
+                 l_obses_list,
+                 l_actions,
+                 l_rewards,
+                 next_obs_list,
+                 l_dones,
+                 l_mu_probs,
+                 l_seq_hidden_states) = episode
+                episode_length = l_indexes.shape[1]
+
+                """
+                bn_indexes: [episode_len - bn + 1, bn]
+                bn_padding_masks: [episode_len - bn + 1, bn]
+                bn_obses_list: list([episode_len - bn + 1, bn, *obs_shapes_i], ...)
+                bn_actions: [episode_len - bn + 1, bn, action_size]
+                bn_rewards: [episode_len - bn + 1, bn]
+                next_obs_list: list([episode_len - bn + 1, *obs_shapes_i], ...)
+                bn_dones: [episode_len - bn + 1, bn]
+                bn_mu_probs: [episode_len - bn + 1, bn]
+                f_seq_hidden_states: [episode_len - bn + 1, 1, *seq_hidden_state_shape]
+                """
+                ori_batch = episode_to_batch(self.burn_in_step + self.n_step,
+                                             episode_length,
+                                             l_indexes,
+                                             l_padding_masks,
+                                             l_obses_list,
+                                             l_actions,
+                                             l_rewards,
+                                             next_obs_list,
+                                             l_dones,
+                                             l_probs=l_mu_probs,
+                                             l_seq_hidden_states=l_seq_hidden_states)
+
+                # ori_batch holds strided views of the episode,
+                # only the shuffled batches are materialized by fancy indexing
+                last_rest_batch = rest_batch
+                rest_batch_size = last_rest_batch[0].shape[0] if last_rest_batch is not None else 0
                 rest_batch = None
 
-            ori_batch_size = ori_batch[0].shape[0]
-            idx = np.random.permutation(ori_batch_size)
-            ori_batch = traverse_lists(ori_batch, lambda b: b[idx])
+                ori_batch_size = rest_batch_size + ori_batch[0].shape[0]
+                idx = np.random.permutation(ori_batch_size)
 
-            for i in range(math.ceil(ori_batch_size / self.batch_size)):
-                b_i, b_j = i * self.batch_size, (i + 1) * self.batch_size
+                for i in range(math.ceil(ori_batch_size / self.batch_size)):
+                    b_i, b_j = i * self.batch_size, (i + 1) * self.batch_size
 
-                batch = traverse_lists(ori_batch, lambda b: b[b_i:b_j, :])
+                    b_idx = idx[b_i:b_j]
+                    if last_rest_batch is not None:
+                        rb_idx, b_idx = b_idx[b_idx < rest_batch_size], b_idx[b_idx >= rest_batch_size] - rest_batch_size
+                        batch = traverse_lists((last_rest_batch, ori_batch),
+                                               lambda rb, b: np.concatenate([rb[rb_idx], b[b_idx]]))
+                    else:
+                        batch = traverse_lists(ori_batch, lambda b: b[b_idx])
 
-                if b_j > ori_batch_size:
-                    rest_batch = batch
-                else:
-                    self._batch_buffer.put(batch)
+                    if b_j > ori_batch_size:
+                        rest_batch = batch
+                    else:
+                        self._batch_buffer.put(batch)
+            finally:
+                # All batches are copied out of the episode by fancy indexing
+                self._episode_buffer.release(episode_idx)
 
 
 class Trainer:
     def __init__(self,
                  all_variables_buffer: SharedMemoryManager,
-                 episode_buffer: SharedMemoryManager,
-                 episode_length_array: mp.Array,
+                 episode_buffer: SharedMemoryRingBuffer,
                  cmd_pipe_server: Connection,
 
                  logger_in_file,
@@ -178,7 +187,6 @@ class Trainer:
                 'n_step': self.sac.n_step,
                 'batch_size': batch_size,
                 'episode_buffer': episode_buffer,
-                'episode_length_array': episode_length_array,
                 'batch_buffer': self._batch_buffer
             }).start()
 
@@ -2,7 +2,7 @@ import time
 
 import numpy as np
 
-from algorithm.sac_main_hitted import AgentHitted
+from algorithm.sac_main_hitted import AgentBatchHitted, AgentHitted
 
 from .actor import Actor
 from .learner import Learner
@@ -32,11 +32,10 @@ class LearnerHitted(Learner):
 
 
 class ActorHitted(Actor):
-    _agent_class = AgentHitted
+    _agent_class = AgentBatchHitted
 
     def _log_episode_info(self, iteration, agents):
-        rewards = [a.reward for a in agents]
-        rewards = ", ".join([f"{i:6.1f}" for i in rewards])
-        hitted = sum([a.hitted for a in agents])
-        max_step = max([a.steps for a in agents])
+        rewards = ", ".join([f"{i:6.1f}" for i in agents.reward])
+        hitted = agents.hitted.sum()
+        max_step = agents.steps.max()
         self._logger.info(f'{iteration}, S {max_step}, R {rewards}, hitted {hitted}')
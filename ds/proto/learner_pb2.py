@@ -21,7 +21,7 @@ DESCRIPTOR = _descriptor.FileDescriptor(
   syntax='proto3',
   serialized_options=None,
   create_key=_descriptor._internal_create_key,
-  serialized_pb=b'\n\rlearner.proto\x12\x07learner\x1a\rndarray.proto\x1a\x0epingpong.proto\"\x90\x01\n\x15RegisterActorResponse\x12\x15\n\rmodel_abs_dir\x18\x01 \x01(\t\x12\x11\n\tunique_id\x18\x02 \x01(\x05\x12\x19\n\x11reset_config_json\x18\x03 \x01(\t\x12\x19\n\x11model_config_json\x18\x04 \x01(\t\x12\x17\n\x0fsac_config_json\x18\x05 \x01(\t\"\xa7\x02\n\nAddRequest\x12\x1b\n\tl_indexes\x18\x01 \x01(\x0b\x32\x08.NDarray\x12!\n\x0fl_padding_masks\x18\x02 \x01(\x0b\x32\x08.NDarray\x12\x1e\n\x0cl_obses_list\x18\x03 \x03(\x0b\x32\x08.NDarray\x12\x1b\n\tl_actions\x18\x04 \x01(\x0b\x32\x08.NDarray\x12\x1b\n\tl_rewards\x18\x05 \x01(\x0b\x32\x08.NDarray\x12\x1f\n\rnext_obs_list\x18\x06 \x03(\x0b\x32\x08.NDarray\x12\x19\n\x07l_dones\x18\x07 \x01(\x0b\x32\x08.NDarray\x12\x1c\n\nl_mu_probs\x18\x08 \x01(\x0b\x32\x08.NDarray\x12%\n\x13l_seq_hidden_states\x18\t \x01(\x0b\x32\x08.NDarray\"=\n\x0bNNVariables\x12\x11\n\tsucceeded\x18\x01 \x01(\x08\x12\x1b\n\tvariables\x18\x02 \x03(\x0b\x32\x08.NDarray2\xc3\x02\n\x0eLearnerService\x12\x1f\n\x0bPersistence\x12\x05.Ping\x1a\x05.Pong(\x01\x30\x01\x12\x37\n\rRegisterActor\x12\x06.Empty\x1a\x1e.learner.RegisterActorResponse\x12\x32\n\x12GetPolicyVariables\x12\x06.Empty\x1a\x14.learner.NNVariables\x12\"\n\x03\x41\x64\x64\x12\x13.learner.AddRequest\x1a\x06.Empty\x12.\n\x0eGetNNVariables\x12\x06.Empty\x1a\x14.learner.NNVariables\x12\x31\n\x11UpdateNNVariables\x12\x14.learner.NNVariables\x1a\x06.Empty\x12\x1c\n\nForceClose\x12\x06.Empty\x1a\x06.Emptyb\x06proto3'
+  serialized_pb=b'\n\rlearner.proto\x12\x07learner\x1a\rndarray.proto\x1a\x0epingpong.proto\"\x90\x01\n\x15RegisterActorResponse\x12\x15\n\rmodel_abs_dir\x18\x01 \x01(\t\x12\x11\n\tunique_id\x18\x02 \x01(\x05\x12\x19\n\x11reset_config_json\x18\x03 \x01(\t\x12\x19\n\x11model_config_json\x18\x04 \x01(\t\x12\x17\n\x0fsac_config_json\x18\x05 \x01(\t\"\xa7\x02\n\nAddRequest\x12\x1b\n\tl_indexes\x18\x01 \x01(\x0b\x32\x08.NDarray\x12!\n\x0fl_padding_masks\x18\x02 \x01(\x0b\x32\x08.NDarray\x12\x1e\n\x0cl_obses_list\x18\x03 \x03(\x0b\x32\x08.NDarray\x12\x1b\n\tl_actions\x18\x04 \x01(\x0b\x32\x08.NDarray\x12\x1b\n\tl_rewards\x18\x05 \x01(\x0b\x32\x08.NDarray\x12\x1f\n\rnext_obs_list\x18\x06 \x03(\x0b\x32\x08.NDarray\x12\x19\n\x07l_dones\x18\x07 \x01(\x0b\x32\x08.NDarray\x12\x1c\n\nl_mu_probs\x18\x08 \x01(\x0b\x32\x08.NDarray\x12%\n\x13l_seq_hidden_states\x18\t \x01(\x0b\x32\x08.NDarray\"9\n\x10\x41\x64\x64StreamRequest\x12%\n\x08\x65pisodes\x18\x01 \x03(\x0b\x32\x13.learner.AddRequest\"=\n\x0bNNVariables\x12\x11\n\tsucceeded\x18\x01 \x01(\x08\x12\x1b\n\tvariables\x18\x02 \x03(\x0b\x32\x08.NDarray\"C\n\x16PolicyVariablesRequest\x12\x0f\n\x07version\x18\x01 \x01(\x03\x12\x18\n\x10keyframe_version\x18\x02 \x01(\x03\"Y\n\x0fPolicyVariables\x12\x0f\n\x07version\x18\x01 \x01(\x03\x12\x18\n\x10keyframe_version\x18\x02 \x01(\x03\x12\x1b\n\tvariables\x18\x03 \x03(\x0b\x32\x08.NDarray\"p\n\x10GetActionRequest\x12\x1a\n\x08obs_list\x18\x01 \x03(\x0b\x32\x08.NDarray\x12\x1c\n\npre_action\x18\x02 \x01(\x0b\x32\x08.NDarray\x12\"\n\x10seq_hidden_state\x18\x03 \x01(\x0b\x32\x08.NDarray\"c\n\x06\x41\x63tion\x12\x18\n\x06\x61\x63tion\x18\x01 \x01(\x0b\x32\x08.NDarray\x12\x16\n\x04prob\x18\x02 \x01(\x0b\x32\x08.NDarray\x12\'\n\x15next_seq_hidden_state\x18\x03 \x01(\x0b\x32\x08.NDarray2\x84\x04\n\x0eLearnerService\x12\x1f\n\x0bPersistence\x12\x05.Ping\x1a\x05.Pong(\x01\x30\x01\x12\x37\n\rRegisterActor\x12\x06.Empty\x1a\x1e.learner.RegisterActorResponse\x12\x32\n\x12GetPolicyVariables\x12\x06.Empty\x1a\x14.learner.NNVariables\x12T\n\x15StreamPolicyVariables\x12\x1f.learner.PolicyVariablesRequest\x1a\x18.learner.PolicyVariables0\x01\x12\x37\n\tGetAction\x12\x19.learner.GetActionRequest\x1a\x0f.learner.Action\x12\"\n\x03\x41\x64\x64\x12\x13.learner.AddRequest\x1a\x06.Empty\x12\x30\n\tAddStream\x12\x19.learner.AddStreamRequest\x1a\x06.Empty(\x01\x12.\n\x0eGetNNVariables\x12\x06.Empty\x1a\x14.learner.NNVariables\x12\x31\n\x11UpdateNNVariables\x12\x14.learner.NNVariables\x1a\x06.Empty\x12\x1c\n\nForceClose\x12\x06.Empty\x1a\x06.Emptyb\x06proto3'
   ,
   dependencies=[ndarray__pb2.DESCRIPTOR,pingpong__pb2.DESCRIPTOR,])
 
@@ -176,6 +176,38 @@ _ADDREQUEST = _descriptor.Descriptor(
 )
 
 
+_ADDSTREAMREQUEST = _descriptor.Descriptor(
+  name='AddStreamRequest',
+  full_name='learner.AddStreamRequest',
+  filename=None,
+  file=DESCRIPTOR,
+  containing_type=None,
+  create_key=_descriptor._internal_create_key,
+  fields=[
+    _descriptor.FieldDescriptor(
+      name='episodes', full_name='learner.AddStreamRequest.episodes', index=0,
+      number=1, type=11, cpp_type=10, label=3,
+      has_default_value=False, default_value=[],
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      serialized_options=None, file=DESCRIPTOR,  create_key=_descriptor._internal_create_key),
+  ],
+  extensions=[
+  ],
+  nested_types=[],
+  enum_types=[
+  ],
+  serialized_options=None,
+  is_extendable=False,
+  syntax='proto3',
+  extension_ranges=[],
+  oneofs=[
+  ],
+  serialized_start=502,
+  serialized_end=559,
+)
+
+
 _NNVARIABLES = _descriptor.Descriptor(
   name='NNVariables',
   full_name='learner.NNVariables',
@@ -210,8 +242,185 @@ _NNVARIABLES = _descriptor.Descriptor(
   extension_ranges=[],
   oneofs=[
   ],
-  serialized_start=502,
-  serialized_end=563,
+  serialized_start=561,
+  serialized_end=622,
+)
+
+
+_POLICYVARIABLESREQUEST = _descriptor.Descriptor(
+  name='PolicyVariablesRequest',
+  full_name='learner.PolicyVariablesRequest',
+  filename=None,
+  file=DESCRIPTOR,
+  containing_type=None,
+  create_key=_descriptor._internal_create_key,
+  fields=[
+    _descriptor.FieldDescriptor(
+      name='version', full_name='learner.PolicyVariablesRequest.version', index=0,
+      number=1, type=3, cpp_type=2, label=1,
+      has_default_value=False, default_value=0,
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      serialized_options=None, file=DESCRIPTOR,  create_key=_descriptor._internal_create_key),
+    _descriptor.FieldDescriptor(
+      name='keyframe_version', full_name='learner.PolicyVariablesRequest.keyframe_version', index=1,
+      number=2, type=3, cpp_type=2, label=1,
+      has_default_value=False, default_value=0,
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      serialized_options=None, file=DESCRIPTOR,  create_key=_descriptor._internal_create_key),
+  ],
+  extensions=[
+  ],
+  nested_types=[],
+  enum_types=[
+  ],
+  serialized_options=None,
+  is_extendable=False,
+  syntax='proto3',
+  extension_ranges=[],
+  oneofs=[
+  ],
+  serialized_start=624,
+  serialized_end=691,
+)
+
+
+_POLICYVARIABLES = _descriptor.Descriptor(
+  name='PolicyVariables',
+  full_name='learner.PolicyVariables',
+  filename=None,
+  file=DESCRIPTOR,
+  containing_type=None,
+  create_key=_descriptor._internal_create_key,
+  fields=[
+    _descriptor.FieldDescriptor(
+      name='version', full_name='learner.PolicyVariables.version', index=0,
+      number=1, type=3, cpp_type=2, label=1,
+      has_default_value=False, default_value=0,
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      serialized_options=None, file=DESCRIPTOR,  create_key=_descriptor._internal_create_key),
+    _descriptor.FieldDescriptor(
+      name='keyframe_version', full_name='learner.PolicyVariables.keyframe_version', index=1,
+      number=2, type=3, cpp_type=2, label=1,
+      has_default_value=False, default_value=0,
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      serialized_options=None, file=DESCRIPTOR,  create_key=_descriptor._internal_create_key),
+    _descriptor.FieldDescriptor(
+      name='variables', full_name='learner.PolicyVariables.variables', index=2,
+      number=3, type=11, cpp_type=10, label=3,
+      has_default_value=False, default_value=[],
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      serialized_options=None, file=DESCRIPTOR,  create_key=_descriptor._internal_create_key),
+  ],
+  extensions=[
+  ],
+  nested_types=[],
+  enum_types=[
+  ],
+  serialized_options=None,
+  is_extendable=False,
+  syntax='proto3',
+  extension_ranges=[],
+  oneofs=[
+  ],
+  serialized_start=693,
+  serialized_end=782,
+)
+
+
+_GETACTIONREQUEST = _descriptor.Descriptor(
+  name='GetActionRequest',
+  full_name='learner.GetActionRequest',
+  filename=None,
+  file=DESCRIPTOR,
+  containing_type=None,
+  create_key=_descriptor._internal_create_key,
+  fields=[
+    _descriptor.FieldDescriptor(
+      name='obs_list', full_name='learner.GetActionRequest.obs_list', index=0,
+      number=1, type=11, cpp_type=10, label=3,
+      has_default_value=False, default_value=[],
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      serialized_options=None, file=DESCRIPTOR,  create_key=_descriptor._internal_create_key),
+    _descriptor.FieldDescriptor(
+      name='pre_action', full_name='learner.GetActionRequest.pre_action', index=1,
+      number=2, type=11, cpp_type=10, label=1,
+      has_default_value=False, default_value=None,
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      serialized_options=None, file=DESCRIPTOR,  create_key=_descriptor._internal_create_key),
+    _descriptor.FieldDescriptor(
+      name='seq_hidden_state', full_name='learner.GetActionRequest.seq_hidden_state', index=2,
+      number=3, type=11, cpp_type=10, label=1,
+      has_default_value=False, default_value=None,
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      serialized_options=None, file=DESCRIPTOR,  create_key=_descriptor._internal_create_key),
+  ],
+  extensions=[
+  ],
+  nested_types=[],
+  enum_types=[
+  ],
+  serialized_options=None,
+  is_extendable=False,
+  syntax='proto3',
+  extension_ranges=[],
+  oneofs=[
+  ],
+  serialized_start=784,
+  serialized_end=896,
+)
+
+
+_ACTION = _descriptor.Descriptor(
+  name='Action',
+  full_name='learner.Action',
+  filename=None,
+  file=DESCRIPTOR,
+  containing_type=None,
+  create_key=_descriptor._internal_create_key,
+  fields=[
+    _descriptor.FieldDescriptor(
+      name='action', full_name='learner.Action.action', index=0,
+      number=1, type=11, cpp_type=10, label=1,
+      has_default_value=False, default_value=None,
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      serialized_options=None, file=DESCRIPTOR,  create_key=_descriptor._internal_create_key),
+    _descriptor.FieldDescriptor(
+      name='prob', full_name='learner.Action.prob', index=1,
+      number=2, type=11, cpp_type=10, label=1,
+      has_default_value=False, default_value=None,
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      serialized_options=None, file=DESCRIPTOR,  create_key=_descriptor._internal_create_key),
+    _descriptor.FieldDescriptor(
+      name='next_seq_hidden_state', full_name='learner.Action.next_seq_hidden_state', index=2,
+      number=3, type=11, cpp_type=10, label=1,
+      has_default_value=False, default_value=None,
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      serialized_options=None, file=DESCRIPTOR,  create_key=_descriptor._internal_create_key),
+  ],
+  extensions=[
+  ],
+  nested_types=[],
+  enum_types=[
+  ],
+  serialized_options=None,
+  is_extendable=False,
+  syntax='proto3',
+  extension_ranges=[],
+  oneofs=[
+  ],
+  serialized_start=898,
+  serialized_end=997,
 )
 
 _ADDREQUEST.fields_by_name['l_indexes'].message_type = ndarray__pb2._NDARRAY
@@ -223,10 +432,23 @@ _ADDREQUEST.fields_by_name['next_obs_list'].message_type = ndarray__pb2._NDARRAY
 _ADDREQUEST.fields_by_name['l_dones'].message_type = ndarray__pb2._NDARRAY
 _ADDREQUEST.fields_by_name['l_mu_probs'].message_type = ndarray__pb2._NDARRAY
 _ADDREQUEST.fields_by_name['l_seq_hidden_states'].message_type = ndarray__pb2._NDARRAY
+_ADDSTREAMREQUEST.fields_by_name['episodes'].message_type = _ADDREQUEST
 _NNVARIABLES.fields_by_name['variables'].message_type = ndarray__pb2._NDARRAY
+_POLICYVARIABLES.fields_by_name['variables'].message_type = ndarray__pb2._NDARRAY
+_GETACTIONREQUEST.fields_by_name['obs_list'].message_type = ndarray__pb2._NDARRAY
+_GETACTIONREQUEST.fields_by_name['pre_action'].message_type = ndarray__pb2._NDARRAY
+_GETACTIONREQUEST.fields_by_name['seq_hidden_state'].message_type = ndarray__pb2._NDARRAY
+_ACTION.fields_by_name['action'].message_type = ndarray__pb2._NDARRAY
+_ACTION.fields_by_name['prob'].message_type = ndarray__pb2._NDARRAY
+_ACTION.fields_by_name['next_seq_hidden_state'].message_type = ndarray__pb2._NDARRAY
 DESCRIPTOR.message_types_by_name['RegisterActorResponse'] = _REGISTERACTORRESPONSE
 DESCRIPTOR.message_types_by_name['AddRequest'] = _ADDREQUEST
+DESCRIPTOR.message_types_by_name['AddStreamRequest'] = _ADDSTREAMREQUEST
 DESCRIPTOR.message_types_by_name['NNVariables'] = _NNVARIABLES
+DESCRIPTOR.message_types_by_name['PolicyVariablesRequest'] = _POLICYVARIABLESREQUEST
+DESCRIPTOR.message_types_by_name['PolicyVariables'] = _POLICYVARIABLES
+DESCRIPTOR.message_types_by_name['GetActionRequest'] = _GETACTIONREQUEST
+DESCRIPTOR.message_types_by_name['Action'] = _ACTION
 _sym_db.RegisterFileDescriptor(DESCRIPTOR)
 
 RegisterActorResponse = _reflection.GeneratedProtocolMessageType('RegisterActorResponse', (_message.Message,), {
@@ -243,6 +465,13 @@ AddRequest = _reflection.GeneratedProtocolMessageType('AddRequest', (_message.Me
   })
 _sym_db.RegisterMessage(AddRequest)
 
+AddStreamRequest = _reflection.GeneratedProtocolMessageType('AddStreamRequest', (_message.Message,), {
+  'DESCRIPTOR' : _ADDSTREAMREQUEST,
+  '__module__' : 'learner_pb2'
+  # @@protoc_insertion_point(class_scope:learner.AddStreamRequest)
+  })
+_sym_db.RegisterMessage(AddStreamRequest)
+
 NNVariables = _reflection.GeneratedProtocolMessageType('NNVariables', (_message.Message,), {
   'DESCRIPTOR' : _NNVARIABLES,
   '__module__' : 'learner_pb2'
@@ -250,6 +479,34 @@ NNVariables = _reflection.GeneratedProtocolMessageType('NNVariables', (_message.
   })
 _sym_db.RegisterMessage(NNVariables)
 
+PolicyVariablesRequest = _reflection.GeneratedProtocolMessageType('PolicyVariablesRequest', (_message.Message,), {
+  'DESCRIPTOR' : _POLICYVARIABLESREQUEST,
+  '__module__' : 'learner_pb2'
+  # @@protoc_insertion_point(class_scope:learner.PolicyVariablesRequest)
+  })
+_sym_db.RegisterMessage(PolicyVariablesRequest)
+
+PolicyVariables = _reflection.GeneratedProtocolMessageType('PolicyVariables', (_message.Message,), {
+  'DESCRIPTOR' : _POLICYVARIABLES,
+  '__module__' : 'learner_pb2'
+  # @@protoc_insertion_point(class_scope:learner.PolicyVariables)
+  })
+_sym_db.RegisterMessage(PolicyVariables)
+
+GetActionRequest = _reflection.GeneratedProtocolMessageType('GetActionRequest', (_message.Message,), {
+  'DESCRIPTOR' : _GETACTIONREQUEST,
+  '__module__' : 'learner_pb2'
+  # @@protoc_insertion_point(class_scope:learner.GetActionRequest)
+  })
+_sym_db.RegisterMessage(GetActionRequest)
+
+Action = _reflection.GeneratedProtocolMessageType('Action', (_message.Message,), {
+  'DESCRIPTOR' : _ACTION,
+  '__module__' : 'learner_pb2'
+  # @@protoc_insertion_point(class_scope:learner.Action)
+  })
+_sym_db.RegisterMessage(Action)
+
 
 
 _LEARNERSERVICE = _descriptor.ServiceDescriptor(
@@ -259,8 +516,8 @@ _LEARNERSERVICE = _descriptor.ServiceDescriptor(
   index=0,
   serialized_options=None,
   create_key=_descriptor._internal_create_key,
-  serialized_start=566,
-  serialized_end=889,
+  serialized_start=1000,
+  serialized_end=1516,
   methods=[
   _descriptor.MethodDescriptor(
     name='Persistence',
@@ -292,20 +549,50 @@ _LEARNERSERVICE = _descriptor.ServiceDescriptor(
     serialized_options=None,
     create_key=_descriptor._internal_create_key,
   ),
+  _descriptor.MethodDescriptor(
+    name='StreamPolicyVariables',
+    full_name='learner.LearnerService.StreamPolicyVariables',
+    index=3,
+    containing_service=None,
+    input_type=_POLICYVARIABLESREQUEST,
+    output_type=_POLICYVARIABLES,
+    serialized_options=None,
+    create_key=_descriptor._internal_create_key,
+  ),
+  _descriptor.MethodDescriptor(
+    name='GetAction',
+    full_name='learner.LearnerService.GetAction',
+    index=4,
+    containing_service=None,
+    input_type=_GETACTIONREQUEST,
+    output_type=_ACTION,
+    serialized_options=None,
+    create_key=_descriptor._internal_create_key,
+  ),
   _descriptor.MethodDescriptor(
     name='Add',
     full_name='learner.LearnerService.Add',
-    index=3,
+    index=5,
     containing_service=None,
     input_type=_ADDREQUEST,
     output_type=ndarray__pb2._EMPTY,
     serialized_options=None,
     create_key=_descriptor._internal_create_key,
   ),
+  _descriptor.MethodDescriptor(
+    name='AddStream',
+    full_name='learner.LearnerService.AddStream',
+    index=6,
+    containing_service=None,
+    input_type=_ADDSTREAMREQUEST,
+    output_type=ndarray__pb2._EMPTY,
+    serialized_options=None,
+    create_key=_descriptor._internal_create_key,
+  ),
   _descriptor.MethodDescriptor(
     name='GetNNVariables',
     full_name='learner.LearnerService.GetNNVariables',
-    index=4,
+    index=7,
     containing_service=None,
     input_type=ndarray__pb2._EMPTY,
     output_type=_NNVARIABLES,
@@ -315,7 +602,7 @@ _LEARNERSERVICE = _descriptor.ServiceDescriptor(
   _descriptor.MethodDescriptor(
     name='UpdateNNVariables',
     full_name='learner.LearnerService.UpdateNNVariables',
-    index=5,
+    index=8,
     containing_service=None,
     input_type=_NNVARIABLES,
     output_type=ndarray__pb2._EMPTY,
@@ -325,7 +612,7 @@ _LEARNERSERVICE = _descriptor.ServiceDescriptor(
   _descriptor.MethodDescriptor(
     name='ForceClose',
     full_name='learner.LearnerService.ForceClose',
-    index=6,
+    index=9,
     containing_service=None,
     input_type=ndarray__pb2._EMPTY,
     output_type=ndarray__pb2._EMPTY,
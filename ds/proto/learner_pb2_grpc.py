@@ -31,11 +31,26 @@ class LearnerServiceStub(object):
                 request_serializer=ndarray__pb2.Empty.SerializeToString,
                 response_deserializer=learner__pb2.NNVariables.FromString,
                 )
+        self.StreamPolicyVariables = channel.unary_stream(
+                '/learner.LearnerService/StreamPolicyVariables',
+                request_serializer=learner__pb2.PolicyVariablesRequest.SerializeToString,
+                response_deserializer=learner__pb2.PolicyVariables.FromString,
+                )
+        self.GetAction = channel.unary_unary(
+                '/learner.LearnerService/GetAction',
+                request_serializer=learner__pb2.GetActionRequest.SerializeToString,
+                response_deserializer=learner__pb2.Action.FromString,
+                )
         self.Add = channel.unary_unary(
                 '/learner.LearnerService/Add',
                 request_serializer=learner__pb2.AddRequest.SerializeToString,
                 response_deserializer=ndarray__pb2.Empty.FromString,
                 )
+        self.AddStream = channel.stream_unary(
+                '/learner.LearnerService/AddStream',
+                request_serializer=learner__pb2.AddStreamRequest.SerializeToString,
+                response_deserializer=ndarray__pb2.Empty.FromString,
+                )
         self.GetNNVariables = channel.unary_unary(
                 '/learner.LearnerService/GetNNVariables',
                 request_serializer=ndarray__pb2.Empty.SerializeToString,
@@ -74,12 +89,33 @@ class LearnerServiceServicer(object):
         context.set_details('Method not implemented!')
         raise NotImplementedError('Method not implemented!')
 
+    def StreamPolicyVariables(self, request, context):
+        """Push policy variables whenever they are updated
+        """
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def GetAction(self, request, context):
+        """Choose actions by the batched inference of learner
+        """
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
     def Add(self, request, context):
         """Missing associated documentation comment in .proto file."""
         context.set_code(grpc.StatusCode.UNIMPLEMENTED)
         context.set_details('Method not implemented!')
         raise NotImplementedError('Method not implemented!')
 
+    def AddStream(self, request_iterator, context):
+        """Several episodes in each message through a long-lived stream
+        """
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
     def GetNNVariables(self, request, context):
         """Update variables from evolver
         """
@@ -117,11 +153,26 @@ def add_LearnerServiceServicer_to_server(servicer, server):
                     request_deserializer=ndarray__pb2.Empty.FromString,
                     response_serializer=learner__pb2.NNVariables.SerializeToString,
             ),
+            'StreamPolicyVariables': grpc.unary_stream_rpc_method_handler(
+                    servicer.StreamPolicyVariables,
+                    request_deserializer=learner__pb2.PolicyVariablesRequest.FromString,
+                    response_serializer=learner__pb2.PolicyVariables.SerializeToString,
+            ),
+            'GetAction': grpc.unary_unary_rpc_method_handler(
+                    servicer.GetAction,
+                    request_deserializer=learner__pb2.GetActionRequest.FromString,
+                    response_serializer=learner__pb2.Action.SerializeToString,
+            ),
             'Add': grpc.unary_unary_rpc_method_handler(
                     servicer.Add,
                     request_deserializer=learner__pb2.AddRequest.FromString,
                     response_serializer=ndarray__pb2.Empty.SerializeToString,
             ),
+            'AddStream': grpc.stream_unary_rpc_method_handler(
+                    servicer.AddStream,
+                    request_deserializer=learner__pb2.AddStreamRequest.FromString,
+                    response_serializer=ndarray__pb2.Empty.SerializeToString,
+            ),
             'GetNNVariables': grpc.unary_unary_rpc_method_handler(
                     servicer.GetNNVariables,
                     request_deserializer=ndarray__pb2.Empty.FromString,
@@ -198,6 +249,40 @@ class LearnerService(object):
             options, channel_credentials,
             insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
 
+    @staticmethod
+    def StreamPolicyVariables(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_stream(request, target, '/learner.LearnerService/StreamPolicyVariables',
+            learner__pb2.PolicyVariablesRequest.SerializeToString,
+            learner__pb2.PolicyVariables.FromString,
+            options, channel_credentials,
+            insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
+
+    @staticmethod
+    def GetAction(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(request, target, '/learner.LearnerService/GetAction',
+            learner__pb2.GetActionRequest.SerializeToString,
+            learner__pb2.Action.FromString,
+            options, channel_credentials,
+            insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
+
     @staticmethod
     def Add(request,
             target,
@@ -215,6 +300,23 @@ class LearnerService(object):
             options, channel_credentials,
             insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
 
+    @staticmethod
+    def AddStream(request_iterator,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.stream_unary(request_iterator, target, '/learner.LearnerService/AddStream',
+            learner__pb2.AddStreamRequest.SerializeToString,
+            ndarray__pb2.Empty.FromString,
+            options, channel_credentials,
+            insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
+
     @staticmethod
     def GetNNVariables(request,
             target,
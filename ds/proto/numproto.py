@@ -1,24 +1,110 @@
+import zlib
 from io import BytesIO
+from typing import Callable, Dict, Optional, Tuple
 
 import numpy as np
 
 import ndarray_pb2
 
 
-def ndarray_to_proto(nda: np.ndarray) -> ndarray_pb2.NDarray:
+def _load_lz4():
+    import lz4.frame
+
+    return (lambda data, level: lz4.frame.compress(data, compression_level=0 if level is None else level),
+            lz4.frame.decompress)
+
+
+def _load_zstd():
+    import zstandard
+
+    return (lambda data, level: zstandard.ZstdCompressor(level=3 if level is None else level).compress(data),
+            lambda data: zstandard.ZstdDecompressor().decompress(data))
+
+
+# Codec name: a function returning (compress(data, level), decompress(data)),
+# codecs with optional dependencies are only imported when used
+_CODEC_LOADERS: Dict[str, Callable[[], Tuple[Callable, Callable]]] = {
+    'zlib': lambda: (lambda data, level: zlib.compress(data, -1 if level is None else level),
+                     zlib.decompress),
+    'lz4': _load_lz4,
+    'zstd': _load_zstd
+}
+_codecs: Dict[str, Tuple[Callable, Callable]] = {}
+
+
+def register_codec(name: str,
+                   compress: Callable[[bytes, Optional[int]], bytes],
+                   decompress: Callable[[bytes], bytes]):
+    _CODEC_LOADERS[name] = lambda: (compress, decompress)
+    _codecs.pop(name, None)
+
+
+def get_codec(name: str) -> Tuple[Callable, Callable]:
+    if name not in _codecs:
+        if name not in _CODEC_LOADERS:
+            raise ValueError(f'Unknown codec {name}, available codecs: {list(_CODEC_LOADERS)}')
+        _codecs[name] = _CODEC_LOADERS[name]()
+
+    return _codecs[name]
+
+
+def ndarray_to_proto(nda: np.ndarray,
+                     codec: Optional[str] = None,
+                     level: Optional[int] = None,
+                     quantize: bool = False) -> ndarray_pb2.NDarray:
+    """
+    Args:
+        codec: The codec compressing the raw bytes, not compressed if None
+        level: The compression level of the codec, the codec's default if None
+        quantize: Whether quantizing a floating array in [0, 1] to uint8
+    """
     if nda is None:
         nda = np.empty(0)
 
-    nda_bytes = BytesIO()
-    np.save(nda_bytes, nda, allow_pickle=False)
+    nda = np.asarray(nda)
+    if nda.dtype.hasobject:
+        raise ValueError('Object arrays cannot be serialized')
+
+    dtype = nda.dtype
+    quantize = quantize and np.issubdtype(dtype, np.floating)
+    if quantize:
+        nda = np.rint(np.clip(nda, 0., 1.) * 255.).astype(np.uint8)
 
-    return ndarray_pb2.NDarray(data=nda_bytes.getvalue())
+    data = nda.tobytes()
+    if codec is not None:
+        compressed_data = get_codec(codec)[0](data, level)
+        # Keep the raw bytes if not compressible
+        if len(compressed_data) < len(data):
+            data = compressed_data
+        else:
+            codec = None
+
+    return ndarray_pb2.NDarray(data=data,
+                               dtype=dtype.str,
+                               shape=nda.shape,
+                               codec=codec or '',
+                               quantized=quantize)
 
 
 def proto_to_ndarray(nda_proto: ndarray_pb2.NDarray) -> np.ndarray:
-    nda_bytes = BytesIO(nda_proto.data)
+    """
+    The returned array is a read-only view of the received bytes without copying,
+    unless it is quantized
+    """
+    if nda_proto.dtype:
+        data = nda_proto.data
+        if nda_proto.codec:
+            data = get_codec(nda_proto.codec)[1](data)
+
+        if nda_proto.quantized:
+            nda = np.frombuffer(data, dtype=np.uint8).reshape(nda_proto.shape)
+            nda = nda.astype(nda_proto.dtype) / np.array(255., dtype=nda_proto.dtype)
+        else:
+            nda = np.frombuffer(data, dtype=nda_proto.dtype).reshape(nda_proto.shape)
+    else:
+        # Legacy .npy format
+        nda = np.load(BytesIO(nda_proto.data), allow_pickle=False)
 
-    nda = np.load(nda_bytes, allow_pickle=False)
     if len(nda.shape) > 0 and nda.shape[0] == 0:
         nda = None
 
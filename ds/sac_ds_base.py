@@ -34,6 +34,7 @@ class SAC_DS_Base(SAC_Base):
 
                  ensemble_q_num=2,
                  ensemble_q_sample=2,
+                 fused_ensemble_q=False,
 
                  burn_in_step=0,
                  n_step=1,
@@ -63,7 +64,9 @@ class SAC_DS_Base(SAC_Base):
                  use_rnd=False,
                  rnd_n_sample=10,
                  use_normalization=False,
-                 action_noise: Optional[List[float]] = None):
+                 action_noise: Optional[List[float]] = None,
+                 mixed_precision: Optional[str] = None,
+                 use_compile=False):
 
         self.obs_shapes = obs_shapes
         self.d_action_size = d_action_size
@@ -73,6 +76,7 @@ class SAC_DS_Base(SAC_Base):
 
         self.ensemble_q_num = ensemble_q_num
         self.ensemble_q_sample = ensemble_q_sample
+        self.fused_ensemble_q = fused_ensemble_q
 
         self.burn_in_step = burn_in_step
         self.n_step = n_step
@@ -103,6 +107,8 @@ class SAC_DS_Base(SAC_Base):
         self.rnd_n_sample = rnd_n_sample
         self.use_normalization = use_normalization
         self.action_noise = action_noise
+        self.mixed_precision = mixed_precision
+        self.use_compile = use_compile
 
         self.use_replay_buffer = False
         self.use_priority = False
@@ -113,6 +119,8 @@ class SAC_DS_Base(SAC_Base):
         else:
             self.device = torch.device(device)
 
+        self._init_mixed_precision()
+
         if seed is not None:
             torch.manual_seed(seed)
             torch.cuda.manual_seed_all(seed)
@@ -149,8 +157,9 @@ class SAC_DS_Base(SAC_Base):
         """
         variables = self.get_policy_variables(get_numpy=False)
 
+        # Variables decoded from protos are read-only views, which `torch.from_numpy` cannot share
         for v, t_v in zip(variables, t_variables):
-            v.data.copy_(torch.from_numpy(t_v).to(self.device))
+            v.data.copy_(torch.tensor(t_v, device=self.device))
 
     def get_nn_variables(self, get_numpy=True):
         """
@@ -196,7 +205,7 @@ class SAC_DS_Base(SAC_Base):
         variables = self.get_nn_variables(get_numpy=False)
 
         for v, t_v in zip(variables, t_variables):
-            v.data.copy_(torch.from_numpy(t_v).to(self.device))
+            v.data.copy_(torch.tensor(t_v, device=self.device))
 
         self._update_target_variables()
 
@@ -229,7 +238,7 @@ class SAC_DS_Base(SAC_Base):
         variables = self.get_all_variables(get_numpy=False)
 
         for v, t_v in zip(variables, t_variables):
-            v.data.copy_(torch.from_numpy(t_v).to(self.device))
+            v.data.copy_(torch.tensor(t_v, device=self.device))
 
         return True
 
@@ -1,2 +1,4 @@
+from .inference_batcher import *
 from .shared_memory_manager import *
+from .shared_memory_ring_buffer import *
 from .utils import *
@@ -0,0 +1,119 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, List
+
+import numpy as np
+
+
+def _get_batch_size(inputs) -> int:
+    for i in inputs:
+        if isinstance(i, list):
+            i = i[0]
+        if i is not None:
+            return i.shape[0]
+
+
+def _concat(inputs: List[Any]):
+    """
+    Concatenate one argument of several requests
+    """
+    if inputs[0] is None:
+        return None
+    if isinstance(inputs[0], list):
+        return [np.concatenate(i) for i in zip(*inputs)]
+    return np.concatenate(inputs)
+
+
+def _split(output, indices: np.ndarray) -> List[Any]:
+    """
+    Split one output of a batch back to requests
+    """
+    if output is None:
+        return [None] * (len(indices) + 1)
+    if isinstance(output, list):
+        return [list(o) for o in zip(*[np.split(o, indices) for o in output])]
+    return np.split(output, indices)
+
+
+class InferenceBatcher:
+    """
+    Gather inference requests from many threads and run them in one batch.
+    A batch is run once it reaches `max_batch_size`,
+    or when its first request has waited for `max_latency` seconds
+    """
+
+    def __init__(self,
+                 infer: Callable[..., tuple],
+                 max_batch_size: int,
+                 max_latency: float):
+        """
+        Args:
+            infer: Batched inference, whose arguments and returned outputs are
+                ndarrays, lists of ndarrays or None, the first dimension of ndarrays is batch
+            max_batch_size: Max rows in one batch, a larger request is run alone
+            max_latency: Max seconds the first request of a batch waits for other requests
+        """
+        self._infer = infer
+        self._max_batch_size = max_batch_size
+        self._max_latency = max_latency
+
+        self._request_queue = queue.Queue()
+        self._pending_request = None  # The request left from the last batch
+
+        threading.Thread(target=self._forever_run_batch, daemon=True).start()
+
+    def __call__(self, *inputs):
+        """
+        Block until the batch containing this request is run,
+        returns the outputs of `infer` for this request
+        """
+        future = Future()
+        self._request_queue.put((inputs, future))
+        return future.result()
+
+    def _get_batch(self):
+        if self._pending_request is None:
+            requests = [self._request_queue.get()]
+        else:
+            requests = [self._pending_request]
+            self._pending_request = None
+
+        batch_size = _get_batch_size(requests[0][0])
+        deadline = time.time() + self._max_latency
+
+        while batch_size < self._max_batch_size:
+            try:
+                request = self._request_queue.get(timeout=max(deadline - time.time(), 0))
+            except queue.Empty:
+                break
+
+            request_batch_size = _get_batch_size(request[0])
+            if batch_size + request_batch_size > self._max_batch_size:
+                self._pending_request = request
+                break
+
+            requests.append(request)
+            batch_size += request_batch_size
+
+        return requests
+
+    def _forever_run_batch(self):
+        while True:
+            requests = self._get_batch()
+            futures: List[Future] = [f for _, f in requests]
+
+            try:
+                all_inputs = [inputs for inputs, _ in requests]
+                outputs = self._infer(*[_concat(list(i)) for i in zip(*all_inputs)])
+
+                indices = np.cumsum([_get_batch_size(inputs) for inputs in all_inputs])[:-1]
+                outputs = [_split(o, indices) for o in outputs]
+            except Exception as e:
+                for future in futures:
+                    future.set_exception(e)
+                continue
+
+            for i, future in enumerate(futures):
+                future.set_result(tuple(o[i] for o in outputs))
@@ -0,0 +1,230 @@
+import logging
+import multiprocessing as mp
+import time
+from multiprocessing.shared_memory import SharedMemory
+from typing import Any, List, Optional, Tuple
+
+import numpy as np
+
+from algorithm.utils import elapsed_counter, elapsed_timer, traverse_lists
+
+_ALIGNMENT = 64  # Every array starts at a multiple of cache lines
+
+# States of entries
+_FREE = 0
+_WRITING = 1
+_READY = 2
+_READING = 3
+
+# Header: [head entry index, number of entries]
+# Entry: [state, offset, nbytes, *shapes of all arrays]
+_HEADER_SIZE = 2
+_HEAD, _COUNT = range(_HEADER_SIZE)
+_STATE, _OFFSET, _NBYTES = range(3)
+
+
+def _align(nbytes: int) -> int:
+    return (nbytes + _ALIGNMENT - 1) // _ALIGNMENT * _ALIGNMENT
+
+
+class SharedMemoryRingBuffer:
+    """
+    Pass data of variable shapes, such as episodes, between processes through one shared memory ring.
+    `put` only copies the real data. `get` returns zero-copy views of the data,
+    which are valid until they are given back by `release`.
+    If the ring is full, `put` drops the oldest data,
+    or skips the new data if the oldest one is being written or read, so that it never blocks
+    """
+
+    def __init__(self,
+                 queue_size: int = 1,
+                 logger: Optional[logging.Logger] = None,
+                 counter_get_empty_log: Optional[str] = None,
+                 timer_get_log: Optional[str] = None,
+                 counter_drop_log: Optional[str] = None,
+                 timer_put_data_log: Optional[str] = None,
+                 log_repeat: int = 1):
+        """
+        Args:
+            queue_size: The max number of data in the ring,
+                the ring is sized to hold `queue_size` data of the max shapes
+        """
+        self.queue_size = queue_size
+        self.counter_get_empty_log = counter_get_empty_log
+        self.timer_get_log = timer_get_log
+        self.counter_drop_log = counter_drop_log
+        self.timer_put_data_log = timer_put_data_log
+        self.log_repeat = log_repeat
+
+        self._cond = mp.Condition()
+
+        self.init_logger(logger)
+
+    def init_logger(self, logger: Optional[logging.Logger] = None):
+        self._counter_get_empty = elapsed_counter(logger, self.counter_get_empty_log, self.log_repeat)
+        self._timer_get = elapsed_timer(logger, self.timer_get_log, self.log_repeat)
+
+        self._counter_drop = elapsed_counter(logger, self.counter_drop_log, self.log_repeat)
+        self._timer_put_data = elapsed_timer(logger, self.timer_put_data_log, self.log_repeat)
+
+    def init_from_shapes(self, data_shapes, data_dtypes):
+        """
+        Args:
+            data_shapes: The max shapes of data, only the numbers of dimensions are fixed
+        """
+        self._structure = data_shapes
+
+        shapes, dtypes = [], []
+        traverse_lists((data_shapes, data_dtypes),
+                       lambda shape, dtype: (shapes.append(shape), dtypes.append(np.dtype(dtype))))
+        self._dtypes = dtypes
+        self._ndims = [len(s) for s in shapes]
+
+        max_nbytes = sum(_align(int(np.prod(s)) * d.itemsize) for s, d in zip(shapes, dtypes))
+        self.capacity = max_nbytes * self.queue_size
+        self.shm = SharedMemory(create=True, size=self.capacity)
+
+        self._entry_size = 3 + sum(self._ndims)
+        self._meta = mp.RawArray('q', _HEADER_SIZE + self.queue_size * self._entry_size)
+
+    def _get_meta(self) -> Tuple[np.ndarray, np.ndarray]:
+        meta = np.frombuffer(self._meta, dtype=np.int64)
+        return meta[:_HEADER_SIZE], meta[_HEADER_SIZE:].reshape(self.queue_size, self._entry_size)
+
+    def _get_views(self, entry: np.ndarray) -> List[np.ndarray]:
+        views = []
+        offset = entry[_OFFSET]
+        i = 3
+        for ndim, dtype in zip(self._ndims, self._dtypes):
+            shape = tuple(entry[i:i + ndim])
+            views.append(np.ndarray(shape, dtype=dtype, buffer=self.shm.buf, offset=offset))
+            offset += _align(int(np.prod(shape)) * dtype.itemsize)
+            i += ndim
+
+        return views
+
+    def _allocate(self, header: np.ndarray, entries: np.ndarray, nbytes: int) -> Optional[int]:
+        """
+        Returns the offset of free space for `nbytes`, None if no free entry or space
+        """
+        head, count = header
+        if count == 0:
+            return 0
+        if count == self.queue_size:
+            return None
+
+        start = entries[head, _OFFSET]
+        newest = entries[(head + count - 1) % self.queue_size]
+        end = newest[_OFFSET] + newest[_NBYTES]
+
+        if end > start:  # Data in [start, end)
+            if end + nbytes <= self.capacity:
+                return end
+            if nbytes <= start:
+                return 0
+        elif end + nbytes <= start:  # Wrapped, data in [start, capacity) and [0, end)
+            return end
+
+        return None
+
+    def _pop_free_head(self, header: np.ndarray, entries: np.ndarray):
+        while header[_COUNT] > 0 and entries[header[_HEAD], _STATE] == _FREE:
+            header[_HEAD] = (header[_HEAD] + 1) % self.queue_size
+            header[_COUNT] -= 1
+
+    def put(self, data) -> bool:
+        """
+        Never block, the data is dropped if no space can be freed
+
+        Returns:
+            Whether the data is put into the ring
+        """
+        arrays = []
+        traverse_lists(data, arrays.append)
+
+        assert [a.ndim for a in arrays] == self._ndims
+
+        nbytes = max(sum(_align(a.nbytes) for a in arrays), _ALIGNMENT)
+        if nbytes > self.capacity:
+            raise ValueError(f'{nbytes} bytes exceed the capacity {self.capacity} of the ring')
+
+        with self._cond:
+            header, entries = self._get_meta()
+
+            while True:
+                offset = self._allocate(header, entries, nbytes)
+                if offset is not None:
+                    break
+
+                with self._counter_drop:
+                    self._counter_drop.add()
+
+                if entries[header[_HEAD], _STATE] == _READY:
+                    # Drop the oldest data
+                    entries[header[_HEAD], _STATE] = _FREE
+                    self._pop_free_head(header, entries)
+                else:
+                    # The oldest data is being written or read, drop the new data
+                    return False
+
+            entry_idx = (header[_HEAD] + header[_COUNT]) % self.queue_size
+            entry = entries[entry_idx]
+            entry[_STATE] = _WRITING
+            entry[_OFFSET] = offset
+            entry[_NBYTES] = nbytes
+            entry[3:] = [d for a in arrays for d in a.shape]
+            header[_COUNT] += 1
+
+        # Copy data to shm out of the lock, the entry is not touched by others while writing
+        with self._timer_put_data:
+            for view, a in zip(self._get_views(entry), arrays):
+                np.copyto(view, a)
+
+        with self._cond:
+            entry[_STATE] = _READY
+            self._cond.notify_all()
+
+        return True
+
+    def get(self, timeout=None) -> Tuple[Any, Optional[int]]:
+        """
+        Returns:
+            data: Views of the oldest data in the shared memory, None if timed out
+            entry_idx: Passed to `release` once data are not used
+        """
+        with self._timer_get, self._counter_get_empty:
+            deadline = None if timeout is None else time.time() + timeout
+
+            with self._cond:
+                header, entries = self._get_meta()
+
+                while True:
+                    for i in range(header[_COUNT]):
+                        entry_idx = (header[_HEAD] + i) % self.queue_size
+                        if entries[entry_idx, _STATE] == _READY:
+                            break
+                    else:
+                        entry_idx = None
+
+                    if entry_idx is not None:
+                        break
+
+                    remaining = None if deadline is None else deadline - time.time()
+                    if remaining is not None and remaining <= 0:
+                        self._counter_get_empty.add()
+                        self._timer_get.ignore()
+                        return None, None
+                    self._cond.wait(remaining)
+
+                entry = entries[entry_idx]
+                entry[_STATE] = _READING
+
+        views = iter(self._get_views(entry))
+        return traverse_lists(self._structure, lambda _: next(views)), entry_idx
+
+    def release(self, entry_idx: int):
+        with self._cond:
+            header, entries = self._get_meta()
+            entries[entry_idx, _STATE] = _FREE
+            self._pop_free_head(header, entries)
+            self._cond.notify_all()
@@ -0,0 +1,66 @@
+"""
+Micro-benchmark of evaluating Q ensembles separately or fused by vmap
+
+python -m tests.benchmark_ensemble_q
+"""
+
+import time
+
+import torch
+
+from algorithm.nn_models import EnsembleQ, ModelQ
+
+BATCH_SIZE = 256
+N_STEP = 3
+STATE_SIZE = 64
+D_ACTION_SIZE = 4
+C_ACTION_SIZE = 4
+N_ITER = 50
+
+
+def benchmark(ensemble_q_num, fused, device):
+    model_q_list = [ModelQ(STATE_SIZE, D_ACTION_SIZE, C_ACTION_SIZE, False, True).to(device)
+                    for _ in range(ensemble_q_num)]
+    if fused:
+        ensemble = EnsembleQ(model_q_list)
+        optimizer_list = [torch.optim.Adam(ensemble.parameters())]
+    else:
+        optimizer_list = [torch.optim.Adam(q.parameters()) for q in model_q_list]
+
+    state = torch.randn(BATCH_SIZE, N_STEP, STATE_SIZE, device=device)
+    c_action = torch.randn(BATCH_SIZE, N_STEP, C_ACTION_SIZE, device=device)
+
+    def step():
+        if fused:
+            d_q, c_q = ensemble(state, c_action)
+        else:
+            q_list = [q(state, c_action) for q in model_q_list]
+            d_q = torch.stack([q[0] for q in q_list])
+            c_q = torch.stack([q[1] for q in q_list])
+
+        for opt in optimizer_list:
+            opt.zero_grad()
+        (torch.mean(d_q) + torch.mean(c_q)).backward()
+        for opt in optimizer_list:
+            opt.step()
+
+    step()
+    if device == 'cuda':
+        torch.cuda.synchronize()
+
+    t = time.time()
+    for _ in range(N_ITER):
+        step()
+    if device == 'cuda':
+        torch.cuda.synchronize()
+
+    return N_ITER / (time.time() - t)
+
+
+if __name__ == '__main__':
+    device = 'cuda' if torch.cuda.is_available() else 'cpu'
+    print(f'{"ensemble":>9} {"separate/s":>11} {"fused/s":>10}')
+    for ensemble_q_num in [2, 5, 10, 20]:
+        separate = benchmark(ensemble_q_num, False, device)
+        fused = benchmark(ensemble_q_num, True, device)
+        print(f'{ensemble_q_num:>9} {separate:11.1f} {fused:10.1f}')
@@ -0,0 +1,77 @@
+"""
+Micro-benchmark of ndarray round-trips through NDarray protos,
+the legacy .npy format vs the raw bytes format, compressed or quantized
+
+python -m tests.benchmark_numproto
+"""
+
+import sys
+import time
+from functools import partial
+from io import BytesIO
+from pathlib import Path
+
+import numpy as np
+
+sys.path.append(str(Path(__file__).resolve().parent.parent.joinpath('ds/proto')))
+import ndarray_pb2
+from ds.proto.numproto import ndarray_to_proto, proto_to_ndarray
+
+N_ITER = 20
+
+ARRAYS = {
+    # An episode sent by AddRequest
+    'episode_vec_obs': [np.random.randn(1, 500, 64).astype(np.float32)],
+    # Rendered images are quantized from 8-bit pixels, with flat regions
+    'episode_vis_obs': [np.repeat(np.random.randint(0, 256, size=(1, 200, 84, 42, 3)), 2, axis=3)
+                        .astype(np.float32) / 255.],
+    'episode_others': [np.arange(500)[np.newaxis],
+                       np.random.randn(1, 500, 4).astype(np.float32),
+                       np.random.randn(1, 500).astype(np.float32),
+                       np.random.rand(1, 500) < 0.1],
+    # Policy variables
+    'variables': [np.random.randn(*s).astype(np.float32)
+                  for s in [(32, 3, 8, 8), (32,), (64, 32, 4, 4), (64,),
+                            (256, 1024), (256,), (256, 256), (256,), (8, 256), (8,)] * 2]
+}
+
+
+def legacy_ndarray_to_proto(nda):
+    nda_bytes = BytesIO()
+    np.save(nda_bytes, nda, allow_pickle=False)
+    return ndarray_pb2.NDarray(data=nda_bytes.getvalue())
+
+
+def legacy_proto_to_ndarray(nda_proto):
+    return np.load(BytesIO(nda_proto.data), allow_pickle=False)
+
+
+def benchmark(arrays, to_proto, from_proto, tolerance):
+    t = time.time()
+    for _ in range(N_ITER):
+        serialized = [to_proto(a).SerializeToString() for a in arrays]
+    encode_time = (time.time() - t) / N_ITER
+
+    t = time.time()
+    for _ in range(N_ITER):
+        decoded = [from_proto(ndarray_pb2.NDarray.FromString(s)) for s in serialized]
+    decode_time = (time.time() - t) / N_ITER
+
+    for a, d in zip(arrays, decoded):
+        np.testing.assert_allclose(d, a, rtol=0, atol=tolerance)
+
+    return encode_time * 1000, decode_time * 1000, sum(len(s) for s in serialized)
+
+
+if __name__ == '__main__':
+    print(f'{"arrays":>16} {"format":>7} {"encode/ms":>10} {"decode/ms":>10} {"bytes":>10}')
+    for name, arrays in ARRAYS.items():
+        for format_name, to_proto, from_proto, tolerance in [
+            ('npy', legacy_ndarray_to_proto, legacy_proto_to_ndarray, 0),
+            ('raw', ndarray_to_proto, proto_to_ndarray, 0),
+            ('zlib', partial(ndarray_to_proto, codec='zlib', level=1), proto_to_ndarray, 0),
+            # Only images are quantized as in EpisodeSender
+            ('zlib+q', lambda a: ndarray_to_proto(a, 'zlib', 1, quantize=a.ndim == 5), proto_to_ndarray, 1e-6)
+        ]:
+            encode_time, decode_time, size = benchmark(arrays, to_proto, from_proto, tolerance)
+            print(f'{name:>16} {format_name:>7} {encode_time:10.3f} {decode_time:10.3f} {size:10d}')
@@ -0,0 +1,70 @@
+"""
+Contention benchmark of PrioritizedReplayBuffer concurrency modes,
+N sampler threads and one writer thread
+
+python -m tests.benchmark_replay_buffer_contention
+"""
+
+import threading
+import time
+
+import numpy as np
+
+from algorithm.replay_buffer import PrioritizedReplayBuffer
+
+BATCH_SIZE = 256
+CAPACITY = 2**17
+EPISODE_LEN = 500
+WINDOW = 8
+DURATION = 3
+
+
+def gen_episode():
+    return {
+        'index': np.arange(EPISODE_LEN),
+        'obs_0': np.random.randn(EPISODE_LEN, 32).astype(np.float32),
+        'action': np.random.randn(EPISODE_LEN, 4).astype(np.float32),
+        'reward': np.random.randn(EPISODE_LEN).astype(np.float32),
+    }
+
+
+def benchmark(concurrency, n_samplers):
+    replay_buffer = PrioritizedReplayBuffer(BATCH_SIZE, CAPACITY, concurrency=concurrency)
+    episode = gen_episode()
+    for _ in range(CAPACITY // EPISODE_LEN // 2):
+        replay_buffer.add(episode, ignore_size=WINDOW)
+
+    stop = threading.Event()
+    n_samples = [0] * n_samplers
+    n_adds = [0]
+
+    def sampler(i):
+        while not stop.is_set():
+            replay_buffer.is_lg_batch_size
+            data_ids, _, _ = replay_buffer.sample_windows(window=WINDOW)
+            replay_buffer.update(data_ids, np.random.rand(BATCH_SIZE))
+            n_samples[i] += 1
+
+    def writer():
+        while not stop.is_set():
+            replay_buffer.add(episode, ignore_size=WINDOW)
+            n_adds[0] += 1
+
+    threads = [threading.Thread(target=sampler, args=(i, )) for i in range(n_samplers)]
+    threads.append(threading.Thread(target=writer))
+    for t in threads:
+        t.start()
+    time.sleep(DURATION)
+    stop.set()
+    for t in threads:
+        t.join()
+
+    return sum(n_samples) / DURATION, n_adds[0] / DURATION
+
+
+if __name__ == '__main__':
+    print(f'{"concurrency":>12} {"samplers":>9} {"sample/s":>10} {"add/s":>10}')
+    for n_samplers in [1, 2, 4, 8]:
+        for concurrency in ['rwlock', 'mutex']:
+            sample, add = benchmark(concurrency, n_samplers)
+            print(f'{concurrency:>12} {n_samplers:>9} {sample:10.1f} {add:10.1f}')
@@ -0,0 +1,49 @@
+"""
+Micro-benchmark of SumTree engines
+
+python -m tests.benchmark_sum_tree
+"""
+
+import time
+
+import numpy as np
+
+from algorithm.replay_buffer import SUM_TREE_ENGINES
+
+BATCH_SIZE = 256
+EPISODE_LEN = 1000
+N_ITER = 50
+
+
+def benchmark(engine, capacity):
+    sum_tree = SUM_TREE_ENGINES[engine](capacity)
+    sum_tree.update(np.arange(capacity), np.random.rand(capacity).astype(np.float32))
+
+    add_idx = [(np.arange(EPISODE_LEN) + np.random.randint(capacity)) % capacity for _ in range(N_ITER)]
+    update_idx = [np.random.randint(capacity, size=BATCH_SIZE) for _ in range(N_ITER)]
+    p = np.random.rand(max(EPISODE_LEN, BATCH_SIZE)).astype(np.float32)
+
+    t = time.time()
+    for idx in add_idx:
+        sum_tree.add(idx, p[:EPISODE_LEN])
+    add_time = time.time() - t
+
+    t = time.time()
+    for idx in update_idx:
+        sum_tree.update(idx, p[:BATCH_SIZE])
+    update_time = time.time() - t
+
+    t = time.time()
+    for _ in range(N_ITER):
+        sum_tree.sample(BATCH_SIZE)
+    sample_time = time.time() - t
+
+    return N_ITER / add_time, N_ITER / update_time, N_ITER / sample_time
+
+
+if __name__ == '__main__':
+    print(f'{"engine":>12} {"capacity":>9} {"add/s":>10} {"update/s":>10} {"sample/s":>10}')
+    for log2_capacity in range(16, 23):
+        for engine in SUM_TREE_ENGINES:
+            add, update, sample = benchmark(engine, 2**log2_capacity)
+            print(f'{engine:>12} {"2^" + str(log2_capacity):>9} {add:10.1f} {update:10.1f} {sample:10.1f}')
@@ -0,0 +1,126 @@
+import logging
+import sys
+import unittest
+from pathlib import Path
+
+import numpy as np
+
+sys.path.append(str(Path(__file__).resolve().parent.parent.joinpath('ds/proto')))
+from algorithm.utils import ReadWriteLock
+from algorithm.utils.enums import SEQ_ENCODER
+from ds.actor import Actor
+
+N_AGENTS = 2
+OBS_SHAPES = [(3,)]
+D_ACTION_SIZE = 2
+C_ACTION_SIZE = 1
+ACTION_SIZE = D_ACTION_SIZE + C_ACTION_SIZE
+SEQ_HIDDEN_STATE_SHAPE = (4,)
+
+
+class FakeEnv:
+    def __init__(self):
+        self.reset_count = 0
+
+    def reset(self, reset_config=None):
+        self.reset_count += 1
+        return [np.random.randn(N_AGENTS, *s).astype(np.float32) for s in OBS_SHAPES]
+
+    def step(self, d_action, c_action):
+        return ([np.random.randn(N_AGENTS, *s).astype(np.float32) for s in OBS_SHAPES],
+                np.zeros(N_AGENTS, dtype=np.float32),
+                np.zeros(N_AGENTS, dtype=bool),
+                np.zeros(N_AGENTS, dtype=bool))
+
+    def close(self):
+        pass
+
+
+class FakeSACActor:
+    burn_in_step = 0
+    seq_hidden_state_shape = SEQ_HIDDEN_STATE_SHAPE
+
+    def __init__(self, seq_encoder):
+        self.seq_encoder = seq_encoder
+
+    def get_initial_action(self, batch_size):
+        return np.zeros((batch_size, ACTION_SIZE), dtype=np.float32)
+
+    def get_initial_seq_hidden_state(self, batch_size):
+        return np.zeros((batch_size, *SEQ_HIDDEN_STATE_SHAPE), dtype=np.float32)
+
+
+class FakeStub:
+    """
+    Learner is not available for the first `get_action`,
+    and disconnected after `max_get_action` calls
+    """
+
+    def __init__(self, max_get_action):
+        self.max_get_action = max_get_action
+        self.get_action_count = 0
+
+    @property
+    def connected(self):
+        return self.get_action_count < self.max_get_action
+
+    def get_action(self, obs_list, pre_action=None, seq_hidden_state=None):
+        self.get_action_count += 1
+        if self.get_action_count == 1:
+            return None
+
+        action = np.zeros((N_AGENTS, ACTION_SIZE), dtype=np.float32)
+        prob = np.ones(N_AGENTS, dtype=np.float32)
+        if seq_hidden_state is None:
+            return action, prob
+        return action, prob, np.array(seq_hidden_state)
+
+    def close(self):
+        pass
+
+
+class FakeEvolverStub:
+    connected = True
+
+    def close(self):
+        pass
+
+
+class TestActor(unittest.TestCase):
+    def _test_remote_inference_failed(self, seq_encoder):
+        actor = Actor.__new__(Actor)
+        actor._logger = logging.getLogger('ds.actor')
+        actor.base_config = {
+            'n_agents': N_AGENTS,
+            'reset_on_iteration': False,
+            'max_episode_length': 100,
+            'max_step_each_iter': -1
+        }
+        actor.reset_config = None
+        actor.obs_shapes = OBS_SHAPES
+        actor.d_action_size = D_ACTION_SIZE
+        actor.action_size = ACTION_SIZE
+        actor.env = FakeEnv()
+        actor.sac_actor = FakeSACActor(seq_encoder)
+        actor._stub = FakeStub(max_get_action=5)
+        actor._evolver_stub = FakeEvolverStub()
+        actor._sac_actor_lock = ReadWriteLock(5, 1, 1)
+        actor._remote_inference = True
+        actor._add_trans = lambda *episode_trans: None
+
+        with self.assertNoLogs('ds.actor', level='ERROR'):
+            actor._run()
+
+        # The episode is reset, and actor keeps running until learner is disconnected
+        self.assertEqual(actor.env.reset_count, 2)
+        self.assertEqual(actor._stub.get_action_count, 5)
+
+    def test_remote_inference_failed(self):
+        self._test_remote_inference_failed(None)
+
+    def test_remote_inference_failed_rnn(self):
+        self._test_remote_inference_failed(SEQ_ENCODER.RNN)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,165 @@
+import unittest
+
+import numpy as np
+
+from algorithm.agent import Agent, AgentBatch
+
+OBS_SHAPES = [(4, ), (6, 6, 3)]
+ACTION_SIZE = 2
+SEQ_HIDDEN_STATE_SHAPE = (8, )
+
+
+def gen_transition(local_done=False, is_padding=False):
+    return {
+        'obs_list': [np.random.randn(*s) for s in OBS_SHAPES],
+        'action': np.random.randn(ACTION_SIZE),
+        'reward': np.random.randn(),
+        'local_done': local_done,
+        'max_reached': False,
+        'next_obs_list': [np.random.randn(*s) for s in OBS_SHAPES],
+        'prob': np.random.rand(),
+        'is_padding': is_padding,
+        'seq_hidden_state': np.random.randn(*SEQ_HIDDEN_STATE_SHAPE)
+    }
+
+
+class TestAgent(unittest.TestCase):
+    def test_add_transition(self):
+        agent = Agent(0, OBS_SHAPES, ACTION_SIZE, SEQ_HIDDEN_STATE_SHAPE)
+
+        # Longer than the initial capacity of the episode arena
+        episode_len = Agent._init_episode_capacity * 3 + 5
+        transitions = [gen_transition(is_padding=i < 3) for i in range(episode_len - 1)]
+        transitions.append(gen_transition(local_done=True))
+
+        for t in transitions[:-1]:
+            self.assertIsNone(agent.add_transition(**t))
+        self.assertEqual(agent.episode_length, episode_len - 1)
+
+        (ep_indexes,
+         ep_padding_masks,
+         ep_obses_list,
+         ep_actions,
+         ep_rewards,
+         next_obs_list,
+         ep_dones,
+         ep_probs,
+         ep_seq_hidden_states) = agent.add_transition(**transitions[-1])
+        self.assertTrue(agent.is_empty())
+
+        np.testing.assert_array_equal(ep_indexes[0], [-1] * 3 + list(range(episode_len - 3)))
+        np.testing.assert_array_equal(ep_padding_masks[0], [t['is_padding'] for t in transitions])
+        for i, o in enumerate(ep_obses_list):
+            self.assertEqual(o.dtype, np.float32)
+            np.testing.assert_allclose(o[0], np.stack([t['obs_list'][i] for t in transitions]), rtol=1e-6)
+        np.testing.assert_allclose(ep_actions[0], np.stack([t['action'] for t in transitions]), rtol=1e-6)
+        np.testing.assert_allclose(ep_rewards[0], [t['reward'] for t in transitions], rtol=1e-6)
+        for i, o in enumerate(next_obs_list):
+            np.testing.assert_allclose(o[0], transitions[-1]['next_obs_list'][i], rtol=1e-6)
+        np.testing.assert_array_equal(ep_dones[0], [t['local_done'] for t in transitions])
+        np.testing.assert_allclose(ep_probs[0], [t['prob'] for t in transitions], rtol=1e-6)
+        np.testing.assert_allclose(ep_seq_hidden_states[0],
+                                   np.stack([t['seq_hidden_state'] for t in transitions]), rtol=1e-6)
+
+        # The handed over episode is not overwritten by the next episode
+        ep_actions_copy = ep_actions.copy()
+        for _ in range(episode_len):
+            agent.add_transition(**gen_transition())
+        np.testing.assert_array_equal(ep_actions, ep_actions_copy)
+
+    def test_get_episode_trans_force_length(self):
+        agent = Agent(0, OBS_SHAPES, ACTION_SIZE, SEQ_HIDDEN_STATE_SHAPE)
+        for _ in range(10):
+            agent.add_transition(**gen_transition())
+
+        ep_indexes, ep_padding_masks, ep_obses_list, *_ = agent.get_episode_trans(15)
+        self.assertEqual(ep_obses_list[1].shape, (1, 15, *OBS_SHAPES[1]))
+        np.testing.assert_array_equal(ep_indexes[0], [-1] * 5 + list(range(10)))
+        np.testing.assert_array_equal(ep_padding_masks[0], [True] * 5 + [False] * 10)
+
+        ep_indexes, _, ep_obses_list, *_ = agent.get_episode_trans(4)
+        self.assertEqual(ep_obses_list[0].shape, (1, 4, *OBS_SHAPES[0]))
+        np.testing.assert_array_equal(ep_indexes[0], range(6, 10))
+
+
+class TestAgentBatch(unittest.TestCase):
+    def test_equivalence(self):
+        n_agents = 5
+        burn_in_step = 3
+        agents = [Agent(i, OBS_SHAPES, ACTION_SIZE, SEQ_HIDDEN_STATE_SHAPE, max_return_episode_trans=50)
+                  for i in range(n_agents)]
+        agent_batch = AgentBatch(n_agents, OBS_SHAPES, ACTION_SIZE, SEQ_HIDDEN_STATE_SHAPE, max_return_episode_trans=50)
+        padding_action = np.random.randn(ACTION_SIZE)
+        padding_seq_hidden_state = np.random.randn(*SEQ_HIDDEN_STATE_SHAPE)
+
+        for iteration in range(2):
+            if iteration == 0:
+                for agent in agents:
+                    agent.clear()
+                agent_batch.clear()
+            else:
+                for agent in agents:
+                    agent.reset()
+                agent_batch.reset()
+
+            for _ in range(120):
+                for agent in [a for a in agents if a.is_empty()]:
+                    for _ in range(burn_in_step):
+                        agent.add_transition(obs_list=[np.zeros(s) for s in OBS_SHAPES],
+                                             action=padding_action,
+                                             reward=0.,
+                                             local_done=False,
+                                             max_reached=False,
+                                             next_obs_list=[np.zeros(s) for s in OBS_SHAPES],
+                                             prob=0.,
+                                             is_padding=True,
+                                             seq_hidden_state=padding_seq_hidden_state)
+                agent_batch.add_padding(burn_in_step, padding_action, padding_seq_hidden_state)
+
+                ep_length = max([a.episode_length for a in agents]) + 2
+                expected = [a.get_episode_trans(ep_length) for a in agents]
+                for i, e in enumerate(agent_batch.get_episode_trans(ep_length)):
+                    if i == 5:  # next_obs_list
+                        continue
+                    if isinstance(e, list):
+                        for j, o in enumerate(e):
+                            np.testing.assert_array_equal(o, np.concatenate([t[i][j] for t in expected]))
+                    else:
+                        np.testing.assert_array_equal(e, np.concatenate([t[i] for t in expected]))
+
+                obs_list = [np.random.randn(n_agents, *s) for s in OBS_SHAPES]
+                action = np.random.randn(n_agents, ACTION_SIZE)
+                reward = np.random.randn(n_agents)
+                local_done = np.random.rand(n_agents) < 0.05
+                max_reached = np.random.rand(n_agents) < 0.5
+                next_obs_list = [np.random.randn(n_agents, *s) for s in OBS_SHAPES]
+                prob = np.random.rand(n_agents)
+                seq_hidden_state = np.random.randn(n_agents, *SEQ_HIDDEN_STATE_SHAPE)
+
+                expected = [agents[i].add_transition(obs_list=[o[i] for o in obs_list],
+                                                     action=action[i],
+                                                     reward=reward[i],
+                                                     local_done=local_done[i],
+                                                     max_reached=max_reached[i],
+                                                     next_obs_list=[o[i] for o in next_obs_list],
+                                                     prob=prob[i],
+                                                     seq_hidden_state=seq_hidden_state[i])
+                            for i in range(n_agents)]
+                expected = [e for e in expected if e is not None]
+                episode_trans_list = agent_batch.add_transitions(obs_list, action, reward, local_done, max_reached,
+                                                                 next_obs_list, prob, seq_hidden_state)
+
+                self.assertEqual(len(episode_trans_list), len(expected))
+                for episode_trans, e_episode_trans in zip(episode_trans_list, expected):
+                    for e, e_e in zip(episode_trans, e_episode_trans):
+                        if isinstance(e, list):
+                            for o, e_o in zip(e, e_e):
+                                np.testing.assert_array_equal(o, e_o)
+                        elif e is not None:
+                            np.testing.assert_array_equal(e, e_e)
+
+                np.testing.assert_array_equal(agent_batch.episode_length, [a.episode_length for a in agents])
+                np.testing.assert_allclose(agent_batch.reward, [a.reward for a in agents], rtol=1e-5)
+                np.testing.assert_array_equal(agent_batch.steps, [a.steps for a in agents])
+                np.testing.assert_array_equal(agent_batch.done, [a.done for a in agents])
+                np.testing.assert_array_equal(agent_batch.max_reached, [a.max_reached for a in agents])
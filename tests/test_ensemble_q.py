@@ -0,0 +1,160 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+import numpy as np
+import torch
+
+import tests.nn_vanilla as nn_vanilla
+from algorithm.nn_models import EnsembleQ, ModelQ
+from algorithm.sac_base import SAC_Base
+from tests.get_synthesis_data import *
+
+OBS_SHAPES = [(10,)]
+STATE_SIZE = 8
+D_ACTION_SIZE = 3
+C_ACTION_SIZE = 2
+ENSEMBLE_Q_NUM = 5
+
+
+class TestEnsembleQ(unittest.TestCase):
+    def test_forward(self):
+        model_q_list = [ModelQ(STATE_SIZE, D_ACTION_SIZE, C_ACTION_SIZE, False, True)
+                        for _ in range(ENSEMBLE_Q_NUM)]
+        ensemble = EnsembleQ(model_q_list)
+
+        state = torch.randn(16, 4, STATE_SIZE)
+        c_action = torch.randn(16, 4, C_ACTION_SIZE)
+        d_q, c_q = ensemble(state, c_action)
+        self.assertEqual(d_q.shape, (ENSEMBLE_Q_NUM, 16, 4, D_ACTION_SIZE))
+        self.assertEqual(c_q.shape, (ENSEMBLE_Q_NUM, 16, 4, 1))
+
+        for i, q in enumerate(model_q_list):
+            e_d_q, e_c_q = q(state, c_action)
+            torch.testing.assert_close(d_q[i], e_d_q)
+            torch.testing.assert_close(c_q[i], e_c_q)
+
+            m_d_q, m_c_q = ensemble.members[i](state, c_action)
+            torch.testing.assert_close(m_d_q, e_d_q)
+            torch.testing.assert_close(m_c_q, e_c_q)
+
+        # Gradients of each member are slices of the stacked gradients
+        (torch.sum(d_q[2]) + torch.sum(c_q[2])).backward()
+        e_d_q, e_c_q = model_q_list[2](state, c_action)
+        (torch.sum(e_d_q) + torch.sum(e_c_q)).backward()
+        for p, e_p in zip(ensemble.stacked_params, model_q_list[2].parameters()):
+            torch.testing.assert_close(p.grad[2], e_p.grad)
+            self.assertEqual(p.grad[[0, 1, 3, 4]].abs().sum().item(), 0)
+
+    def test_state_dict(self):
+        model_q_list = [ModelQ(STATE_SIZE, 0, C_ACTION_SIZE, False, True)
+                        for _ in range(ENSEMBLE_Q_NUM)]
+        ensemble = EnsembleQ(model_q_list)
+        self.assertIsNone(ensemble(torch.randn(16, STATE_SIZE), torch.randn(16, C_ACTION_SIZE))[0])
+
+        model_q = ModelQ(STATE_SIZE, 0, C_ACTION_SIZE, False, True)
+        model_q.load_state_dict(ensemble.members[1].state_dict())
+        for p, e_p in zip(model_q.parameters(), model_q_list[1].parameters()):
+            torch.testing.assert_close(p, e_p)
+
+        ensemble.members[3].load_state_dict(model_q.state_dict())
+        state = torch.randn(16, STATE_SIZE)
+        c_action = torch.randn(16, C_ACTION_SIZE)
+        torch.testing.assert_close(ensemble(state, c_action)[1][3], model_q(state, c_action)[1])
+
+
+    def test_module(self):
+        class ModelQWithBuffer(ModelQ):
+            def _build_model(self):
+                super()._build_model()
+                self.register_buffer('scale', torch.rand(1))
+                self.dropout = torch.nn.Dropout(0.5)
+
+            def forward(self, state, c_action):
+                d_q, c_q = super().forward(self.dropout(state), c_action)
+                return d_q * self.scale, c_q * self.scale
+
+        model_q_list = [ModelQWithBuffer(STATE_SIZE, D_ACTION_SIZE, C_ACTION_SIZE, False, True)
+                        for _ in range(ENSEMBLE_Q_NUM)]
+        ensemble = EnsembleQ(model_q_list)
+        self.assertIn('stacked_buffer_0', ensemble.state_dict())
+        self.assertEqual(ensemble.members[1].state_dict()['scale'], model_q_list[1].scale)
+
+        # Members switch the whole ensemble to eval, disabling dropout
+        ensemble.members[0].eval()
+        self.assertFalse(ensemble.training)
+        state = torch.randn(16, STATE_SIZE)
+        c_action = torch.randn(16, C_ACTION_SIZE)
+        for q in model_q_list:
+            q.eval()
+        torch.testing.assert_close(ensemble(state, c_action)[1][2], model_q_list[2](state, c_action)[1])
+
+        # Members move the whole ensemble, including buffers
+        ensemble.members[0].to(torch.float64)
+        self.assertEqual(ensemble.stacked_params[0].dtype, torch.float64)
+        self.assertEqual(ensemble.stacked_buffers[0].dtype, torch.float64)
+
+
+class TestFusedEnsembleQ(unittest.TestCase):
+    def _gen_sac(self, fused_ensemble_q, model_abs_dir=None):
+        return SAC_Base(
+            obs_shapes=OBS_SHAPES,
+            d_action_size=D_ACTION_SIZE,
+            c_action_size=C_ACTION_SIZE,
+            model_abs_dir=model_abs_dir,
+            model=nn_vanilla,
+            batch_size=16,
+            ensemble_q_num=ENSEMBLE_Q_NUM,
+            ensemble_q_sample=2,
+            n_step=3,
+            fused_ensemble_q=fused_ensemble_q
+        )
+
+    def _train(self, fused_ensemble_q, model_abs_dir=None):
+        torch.manual_seed(0)
+        np.random.seed(0)
+
+        sac = self._gen_sac(fused_ensemble_q, model_abs_dir)
+        episode_trans = gen_episode_trans(OBS_SHAPES,
+                                          d_action_size=D_ACTION_SIZE,
+                                          c_action_size=C_ACTION_SIZE,
+                                          episode_len=40)
+
+        step = 0
+        while step < 5:
+            sac.put_episode(*episode_trans)
+            step = sac.train()
+
+        return sac
+
+    def test_equivalence(self):
+        sac = self._train(False)
+        fused_sac = self._train(True)
+
+        for q, fused_q in zip(sac.model_q_list, fused_sac.model_q_list):
+            for k, v in q.state_dict().items():
+                torch.testing.assert_close(fused_q.state_dict()[k], v, rtol=1e-4, atol=1e-5)
+        for q, fused_q in zip(sac.model_target_q_list, fused_sac.model_target_q_list):
+            for k, v in q.state_dict().items():
+                torch.testing.assert_close(fused_q.state_dict()[k], v, rtol=1e-4, atol=1e-5)
+
+    def test_checkpoint(self):
+        for fused_ensemble_q in [False, True]:
+            with tempfile.TemporaryDirectory() as model_abs_dir:
+                model_abs_dir = Path(model_abs_dir)
+                sac = self._train(fused_ensemble_q, model_abs_dir)
+                sac.save_model()
+
+                # Restored by the other mode, including optimizer moments
+                restored_sac = self._gen_sac(not fused_ensemble_q, model_abs_dir)
+                for i in range(ENSEMBLE_Q_NUM):
+                    for k in ['model_q', 'model_target_q', 'optimizer_q']:
+                        state_dict = sac.ckpt_dict[f'{k}_{i}'].state_dict()
+                        restored_state_dict = restored_sac.ckpt_dict[f'{k}_{i}'].state_dict()
+                        if k == 'optimizer_q':
+                            state_dict, restored_state_dict = state_dict['state'], restored_state_dict['state']
+                            self.assertEqual(len(state_dict), len(list(sac.model_q_list[i].parameters())))
+                        torch.testing.assert_close(restored_state_dict, state_dict)
+
+                sac.close()
+                restored_sac.close()
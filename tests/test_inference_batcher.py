@@ -0,0 +1,56 @@
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from ds.utils.inference_batcher import InferenceBatcher
+
+
+class TestInferenceBatcher(unittest.TestCase):
+    def test_batch(self):
+        batch_sizes = []
+
+        def infer(obs_list, seq_hidden_state):
+            batch_sizes.append(obs_list[0].shape[0])
+            time.sleep(0.01)
+            return obs_list[0] * 2, [obs * 3 for obs in obs_list], None
+
+        batcher = InferenceBatcher(infer, max_batch_size=8, max_latency=0.05)
+
+        def request(i):
+            obs_list = [np.full((2, 3), i, dtype=np.float32), np.full((2, 4, 4), i, dtype=np.float32)]
+            return i, batcher(obs_list, None)
+
+        with ThreadPoolExecutor(16) as executor:
+            results = list(executor.map(request, range(16)))
+
+        for i, (action, obs_list, seq_hidden_state) in results:
+            np.testing.assert_array_equal(action, np.full((2, 3), i * 2))
+            np.testing.assert_array_equal(obs_list[0], np.full((2, 3), i * 3))
+            np.testing.assert_array_equal(obs_list[1], np.full((2, 4, 4), i * 3))
+            self.assertIsNone(seq_hidden_state)
+
+        self.assertEqual(sum(batch_sizes), 32)
+        self.assertLessEqual(max(batch_sizes), 8)
+        self.assertLess(len(batch_sizes), 16)  # Requests are batched
+
+    def test_max_latency(self):
+        batcher = InferenceBatcher(lambda x: (x,), max_batch_size=8, max_latency=0.05)
+
+        t = time.time()
+        x, = batcher(np.ones((1, 2)))
+        self.assertGreaterEqual(time.time() - t, 0.05)
+        np.testing.assert_array_equal(x, np.ones((1, 2)))
+
+        # A request larger than `max_batch_size` is run alone
+        x, = batcher(np.ones((10, 2)))
+        self.assertEqual(x.shape, (10, 2))
+
+    def test_exception(self):
+        def infer(x):
+            raise RuntimeError('infer')
+
+        batcher = InferenceBatcher(infer, max_batch_size=8, max_latency=0.)
+        with self.assertRaisesRegex(RuntimeError, 'infer'):
+            batcher(np.ones((1, 2)))
@@ -0,0 +1,142 @@
+import logging
+import queue
+import socket
+import sys
+import threading
+import time
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import grpc
+
+sys.path.append(str(Path(__file__).resolve().parent.parent.joinpath('ds/proto')))
+from ds.constants import ADD_EPISODE_QUEUE_SIZE
+from ds.learner import Learner, LearnerService
+from ds.proto import learner_pb2, learner_pb2_grpc
+from ds.proto.pingpong_pb2 import Ping
+
+TIMEOUT = 10
+
+
+def get_free_port():
+    with socket.socket() as s:
+        s.bind(('localhost', 0))
+        return s.getsockname()[1]
+
+
+def wait_until(predicate):
+    t = time.time()
+    while not predicate():
+        if time.time() - t > TIMEOUT:
+            raise TimeoutError
+        time.sleep(0.01)
+
+
+class TestLearnerService(unittest.TestCase):
+    def setUp(self):
+        self.add_episode_event = threading.Event()
+        self.added_episodes = []
+
+        def add_episode(episode):
+            self.add_episode_event.wait()
+            self.added_episodes.append(episode)
+
+        learner = Learner.__new__(Learner)
+        learner._logger = logging.getLogger('ds.learner')
+        learner.base_config = {
+            'policy_variables_keyframe_interval': 1,
+            'inference_max_batch_size': 1,
+            'inference_max_latency': 0
+        }
+        learner._get_actor_register_result = None
+        learner._add_episode = add_episode
+        learner._get_policy_variables = None
+        learner._wait_policy_variables = lambda version: threading.Event().wait()
+        learner._choose_action = None
+        learner._get_nn_variables = None
+        learner._udpate_nn_variables = None
+        learner._evolver_stub = mock.Mock()
+        learner.learner_trainer_process = mock.Mock()
+        self.learner = learner
+
+        self.services = []
+
+        def create_service(learner):
+            service = LearnerService(learner)
+            self.services.append(service)
+            return service
+
+        # Episodes are added without decoding
+        patcher = mock.patch.object(LearnerService, '_proto_to_episode', lambda self, episode: (episode, ))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        port = get_free_port()
+        with mock.patch('ds.learner.LearnerService', side_effect=create_service):
+            self.t_server = threading.Thread(target=learner._run_learner_server, args=(port, ))
+            self.t_server.start()
+            wait_until(lambda: hasattr(learner, 'server'))
+
+        self.channel = grpc.insecure_channel(f'localhost:{port}')
+        self.stub = learner_pb2_grpc.LearnerServiceStub(self.channel)
+
+    def tearDown(self):
+        self.add_episode_event.set()
+        self.channel.close()
+        if self.t_server.is_alive():
+            self.learner.close()
+            self.t_server.join()
+
+    def test_peer(self):
+        ping_queue = queue.Queue()
+
+        def ping_messages():
+            while True:
+                ping = ping_queue.get()
+                if ping is None:
+                    return
+                yield ping
+
+        ping_queue.put(Ping(time=0))
+        response_iterator = self.stub.Persistence(ping_messages())
+        next(response_iterator)
+        peer_set = self.services[0]._peer_set
+        self.assertEqual(len(peer_set), 1)
+
+        # The peer is unregistered by the done callback once the stream is closed
+        response_iterator.cancel()
+        wait_until(lambda: len(peer_set) == 0)
+        ping_queue.put(None)
+
+    def test_add_stream_backpressure(self):
+        n_episodes = ADD_EPISODE_QUEUE_SIZE + 10
+        requests = []
+        for i in range(n_episodes):
+            episode = learner_pb2.AddRequest()
+            episode.l_indexes.dtype = str(i)  # Tagged
+            requests.append(learner_pb2.AddStreamRequest(episodes=[episode]))
+
+        # Learner is blocked on adding episodes, so that the stream waits instead of dropping episodes
+        future = self.stub.AddStream.future(iter(requests))
+        time.sleep(1)
+        self.assertFalse(future.done())
+
+        self.add_episode_event.set()
+        future.result(timeout=TIMEOUT)
+        wait_until(lambda: len(self.added_episodes) == n_episodes)
+        self.assertEqual([e.l_indexes.dtype for e in self.added_episodes], [str(i) for i in range(n_episodes)])
+
+    def test_close(self):
+        self.learner.close()
+        self.t_server.join(timeout=TIMEOUT)
+        self.assertFalse(self.t_server.is_alive())
+        self.learner._evolver_stub.close.assert_called_once()
+        self.learner.learner_trainer_process.close.assert_called_once()
+
+        # Closing again after the server loop is closed
+        self.learner.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
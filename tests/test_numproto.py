@@ -0,0 +1,102 @@
+import importlib.util
+import sys
+import unittest
+from io import BytesIO
+from pathlib import Path
+
+import numpy as np
+
+sys.path.append(str(Path(__file__).resolve().parent.parent.joinpath('ds/proto')))
+import ndarray_pb2
+from ds.proto.numproto import (ndarray_to_proto, proto_to_ndarray,
+                               register_codec)
+
+
+def round_trip(nda):
+    serialized = ndarray_to_proto(nda).SerializeToString()
+    return proto_to_ndarray(ndarray_pb2.NDarray.FromString(serialized))
+
+
+class TestNumproto(unittest.TestCase):
+    def test_round_trip(self):
+        for nda in [np.random.randn(1, 20, 8, 8, 3).astype(np.float32),
+                    np.random.randn(3, 4),
+                    np.arange(10)[np.newaxis],
+                    np.random.rand(1, 10) < 0.5,
+                    np.random.randint(0, 255, size=(2, 5), dtype=np.uint8),
+                    np.random.randn(4, 6).astype(np.float32).T,  # Not C contiguous
+                    np.array(3.)]:
+            e_nda = round_trip(nda)
+            self.assertEqual(e_nda.dtype, nda.dtype)
+            self.assertEqual(e_nda.shape, nda.shape)
+            np.testing.assert_array_equal(e_nda, nda)
+
+        self.assertIsNone(round_trip(None))
+        self.assertIsNone(round_trip(np.empty((0, 3))))
+
+    def test_zero_copy(self):
+        nda_proto = ndarray_to_proto(np.random.randn(1, 20, 4).astype(np.float32))
+        nda = proto_to_ndarray(nda_proto)
+        self.assertFalse(nda.flags.writeable)
+
+        base = nda
+        while isinstance(base, np.ndarray):
+            base = base.base
+        self.assertIsInstance(base, bytes)
+
+    def test_legacy(self):
+        def legacy_ndarray_to_proto(nda):
+            nda_bytes = BytesIO()
+            np.save(nda_bytes, nda, allow_pickle=False)
+            return ndarray_pb2.NDarray(data=nda_bytes.getvalue())
+
+        nda = np.random.randn(1, 20, 4).astype(np.float32)
+        np.testing.assert_array_equal(proto_to_ndarray(legacy_ndarray_to_proto(nda)), nda)
+        self.assertIsNone(proto_to_ndarray(legacy_ndarray_to_proto(np.empty(0))))
+
+    def test_codec(self):
+        codecs = ['zlib']
+        for codec, module in [('lz4', 'lz4'), ('zstd', 'zstandard')]:
+            if importlib.util.find_spec(module) is not None:
+                codecs.append(codec)
+
+        nda = np.repeat(np.random.randn(1, 20, 1).astype(np.float32), 8, axis=-1)
+        for codec in codecs:
+            nda_proto = ndarray_to_proto(nda, codec)
+            self.assertEqual(nda_proto.codec, codec)
+            self.assertLess(len(nda_proto.data), nda.nbytes)
+
+            e_nda = proto_to_ndarray(ndarray_pb2.NDarray.FromString(nda_proto.SerializeToString()))
+            self.assertEqual(e_nda.dtype, nda.dtype)
+            np.testing.assert_array_equal(e_nda, nda)
+
+        # Raw bytes are kept if not compressible
+        nda_proto = ndarray_to_proto(np.random.randint(0, 255, size=(1, 8), dtype=np.uint8), 'zlib')
+        self.assertEqual(nda_proto.codec, '')
+
+        with self.assertRaises(ValueError):
+            ndarray_to_proto(nda, 'unknown')
+
+    def test_register_codec(self):
+        register_codec('reversed', lambda data, level: data[::-1][:-1], lambda data: b'\0' + data[::-1])
+
+        nda = np.array([[0, 1, 2]], dtype=np.uint8)
+        nda_proto = ndarray_to_proto(nda, 'reversed')
+        self.assertEqual(nda_proto.data, b'\2\1')
+        np.testing.assert_array_equal(proto_to_ndarray(nda_proto), nda)
+
+    def test_quantize(self):
+        nda = np.random.rand(1, 20, 8, 8, 3).astype(np.float32)
+        nda_proto = ndarray_to_proto(nda, 'zlib', quantize=True)
+        self.assertTrue(nda_proto.quantized)
+        self.assertLessEqual(len(nda_proto.data), nda.size)
+
+        e_nda = proto_to_ndarray(nda_proto)
+        self.assertEqual(e_nda.dtype, np.float32)
+        np.testing.assert_allclose(e_nda, nda, atol=0.5 / 255 + 1e-6)
+
+        # Only floating arrays are quantized
+        nda = np.arange(10)[np.newaxis]
+        nda_proto = ndarray_to_proto(nda, quantize=True)
+        self.assertFalse(nda_proto.quantized)
+        np.testing.assert_array_equal(proto_to_ndarray(nda_proto), nda)
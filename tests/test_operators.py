@@ -0,0 +1,100 @@
+import unittest
+
+import numpy as np
+
+from algorithm.batch_buffer import BatchBuffer
+from algorithm.utils import episode_to_batch
+
+OBS_SHAPES = [(4, ), (6, 6, 3)]
+ACTION_SIZE = 2
+SEQ_HIDDEN_STATE_SHAPE = (8, )
+
+
+def gen_episode(episode_len):
+    return [
+        np.arange(episode_len)[np.newaxis],
+        np.random.rand(1, episode_len) < 0.1,
+        [np.random.randn(1, episode_len, *s).astype(np.float32) for s in OBS_SHAPES],
+        np.random.randn(1, episode_len, ACTION_SIZE).astype(np.float32),
+        np.random.randn(1, episode_len).astype(np.float32),
+        [np.random.randn(1, *s).astype(np.float32) for s in OBS_SHAPES],
+        np.random.rand(1, episode_len) < 0.1,
+        np.random.rand(1, episode_len).astype(np.float32),
+        np.random.randn(1, episode_len, *SEQ_HIDDEN_STATE_SHAPE).astype(np.float32)
+    ]
+
+
+class TestEpisodeToBatch(unittest.TestCase):
+    def test_episode_to_batch(self):
+        bn = 7
+        episode_len = 50
+        episode_length = 40  # The episode is padded to the max episode length
+        episode = gen_episode(episode_len)
+
+        (bn_indexes,
+         bn_padding_masks,
+         bn_obses_list,
+         bn_actions,
+         bn_rewards,
+         next_obs_list,
+         bn_dones,
+         bn_probs,
+         f_seq_hidden_states) = episode_to_batch(bn, episode_length, *episode)
+
+        (l_indexes,
+         l_padding_masks,
+         l_obses_list,
+         l_actions,
+         l_rewards,
+         l_next_obs_list,
+         l_dones,
+         l_probs,
+         l_seq_hidden_states) = episode
+
+        n_windows = episode_length - bn + 1
+        for i in range(n_windows):
+            np.testing.assert_array_equal(bn_indexes[i], l_indexes[0, i:i + bn])
+            np.testing.assert_array_equal(bn_padding_masks[i], l_padding_masks[0, i:i + bn])
+            for bn_obses, l_obses in zip(bn_obses_list, l_obses_list):
+                np.testing.assert_array_equal(bn_obses[i], l_obses[0, i:i + bn])
+            np.testing.assert_array_equal(bn_actions[i], l_actions[0, i:i + bn])
+            np.testing.assert_array_equal(bn_rewards[i], l_rewards[0, i:i + bn])
+            np.testing.assert_array_equal(bn_dones[i], l_dones[0, i:i + bn])
+            np.testing.assert_array_equal(bn_probs[i], l_probs[0, i:i + bn])
+            np.testing.assert_array_equal(f_seq_hidden_states[i], l_seq_hidden_states[0, i:i + 1])
+
+        for next_obs, l_obses, l_next_obs in zip(next_obs_list, l_obses_list, l_next_obs_list):
+            self.assertEqual(next_obs.shape, (n_windows, *l_obses.shape[2:]))
+            np.testing.assert_array_equal(next_obs[:-1], l_obses[0, bn:episode_length])
+            np.testing.assert_array_equal(next_obs[-1], l_next_obs[0])
+
+        # Views without copying the episode
+        self.assertTrue(np.shares_memory(bn_obses_list[1], l_obses_list[1]))
+
+
+class TestBatchBuffer(unittest.TestCase):
+    def test_put_episode(self):
+        bn = 5
+        batch_size = 16
+        batch_buffer = BatchBuffer(burn_in_step=2, n_step=3, batch_size=batch_size)
+
+        window_indexes = []
+        batched_indexes = []
+        for i, episode_len in enumerate([30, 41, 27]):
+            episode = gen_episode(episode_len)
+            episode[0] += i * 100
+            window_indexes.append(episode[0][0, :episode_len - bn + 1])
+
+            batch_buffer.put_episode(*episode)
+            for batch in batch_buffer.get_batch():
+                self.assertEqual(batch[0].shape, (batch_size, bn))
+                self.assertEqual(batch[2][1].shape, (batch_size, bn, *OBS_SHAPES[1]))
+                self.assertTrue(batch[2][1].flags.c_contiguous)
+                batched_indexes.append(batch[0][:, 0])
+
+        # Every window is batched at most once, the rest are kept for the next episode
+        window_indexes = np.concatenate(window_indexes)
+        batched_indexes = np.concatenate(batched_indexes)
+        self.assertEqual(len(batched_indexes), len(window_indexes) // batch_size * batch_size)
+        self.assertEqual(len(np.unique(batched_indexes)), len(batched_indexes))
+        self.assertTrue(np.isin(batched_indexes, window_indexes).all())
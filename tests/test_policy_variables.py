@@ -0,0 +1,197 @@
+import asyncio
+import sys
+import threading
+import unittest
+import warnings
+from pathlib import Path
+from types import SimpleNamespace
+
+import numpy as np
+import torch
+
+sys.path.append(str(Path(__file__).resolve().parent.parent.joinpath('ds/proto')))
+from ds.actor import StubController
+from ds.learner import LearnerService
+from ds.proto import learner_pb2
+from ds.sac_ds_base import SAC_DS_Base
+
+KEYFRAME_INTERVAL = 3
+
+
+class FakeLearner:
+    _get_actor_register_result = None
+    _add_episode = None
+    _get_policy_variables = None
+    _choose_action = None
+    _get_nn_variables = None
+    _udpate_nn_variables = None
+    _force_close = None
+
+    def __init__(self):
+        self.base_config = {
+            'policy_variables_keyframe_interval': KEYFRAME_INTERVAL,
+            'inference_max_batch_size': 1,
+            'inference_max_latency': 0
+        }
+
+        self._policy_variables_cond = threading.Condition()
+        self._policy_variables_version = 0
+        self._policy_variables_cache = None
+
+    def _wait_policy_variables(self, version, timeout=None):
+        with self._policy_variables_cond:
+            self._policy_variables_cond.wait_for(lambda: self._policy_variables_version > version, timeout)
+            return self._policy_variables_version, self._policy_variables_cache
+
+    def update_policy_variables(self, variables):
+        with self._policy_variables_cond:
+            # Like numpy variables of sac_bak on CPU, the cache is updated in place
+            if self._policy_variables_cache is None:
+                self._policy_variables_cache = [v.copy() for v in variables]
+            else:
+                for c_v, v in zip(self._policy_variables_cache, variables):
+                    c_v[...] = v
+            self._policy_variables_version += 1
+            self._policy_variables_cond.notify_all()
+
+
+def gen_variables_list(n):
+    """
+    The first variable changes every version, the second one never changes
+    """
+    variables = [np.random.randn(16, 8).astype(np.float32), np.random.randn(8).astype(np.float32)]
+    variables_list = []
+    for _ in range(n):
+        variables_list.append([v.copy() for v in variables])
+        variables[0] += np.random.randn(16, 8).astype(np.float32) * 0.01
+
+    return variables_list
+
+
+class TestPolicyVariables(unittest.TestCase):
+    def setUp(self):
+        self.stub = StubController('localhost', 1)
+
+    def tearDown(self):
+        self.stub.close()
+
+    def assert_decoded(self, decoded, variables):
+        self.assertIsNotNone(decoded)
+        for d_v, v in zip(decoded, variables):
+            self.assertEqual(d_v.dtype, v.dtype)
+            np.testing.assert_allclose(d_v, v, atol=1e-3)
+
+    def test_round_trip(self):
+        async def run():
+            learner = FakeLearner()
+            service = LearnerService(learner)
+            keyframe_version = 0
+            for version, variables in enumerate(gen_variables_list(2 * KEYFRAME_INTERVAL + 1), 1):
+                learner.update_policy_variables(variables)
+                proto_keyframe, proto_delta = service._get_proto_policy_variables(version,
+                                                                                  learner._policy_variables_cache)
+
+                # Keyframes roll over every KEYFRAME_INTERVAL versions
+                self.assertEqual(proto_keyframe.version, (version - 1) // KEYFRAME_INTERVAL * KEYFRAME_INTERVAL + 1)
+                if proto_keyframe.version == version:
+                    self.assertIsNone(proto_delta)
+                else:
+                    self.assertEqual(proto_delta.keyframe_version, proto_keyframe.version)
+                    # Changed variables are sent as differences from the keyframe
+                    self.assertEqual(proto_delta.variables[0].dtype, np.dtype(np.float16).str)
+                    self.assertNotEqual(proto_delta.variables[0].data, b'')
+                    # Unchanged variables are sent as None
+                    self.assertEqual(proto_delta.variables[1].data, b'')
+
+                if proto_keyframe.version != keyframe_version:
+                    keyframe_version = proto_keyframe.version
+                    decoded = self.stub._decode_policy_variables(proto_keyframe)
+                if proto_delta is not None:
+                    decoded = self.stub._decode_policy_variables(proto_delta)
+                self.assert_decoded(decoded, variables)
+
+        asyncio.run(run())
+
+    def test_update_policy_variables(self):
+        async def run():
+            learner = FakeLearner()
+            service = LearnerService(learner)
+            variables = gen_variables_list(1)[0]
+            learner.update_policy_variables(variables)
+            proto_keyframe, _ = service._get_proto_policy_variables(1, learner._policy_variables_cache)
+            return self.stub._decode_policy_variables(proto_keyframe)
+
+        decoded = asyncio.run(run())
+        self.assertFalse(decoded[0].flags.writeable)
+
+        params = [torch.nn.Parameter(torch.zeros(v.shape, dtype=torch.float32)) for v in decoded]
+        sac = SimpleNamespace(device='cpu', get_policy_variables=lambda get_numpy: params)
+        with warnings.catch_warnings():
+            # Sharing read-only arrays warns
+            warnings.simplefilter('error')
+            SAC_DS_Base.update_policy_variables(sac, decoded)
+
+        for p, v in zip(params, decoded):
+            np.testing.assert_array_equal(p.detach().numpy(), v)
+
+    def test_stream(self):
+        async def next_response(response_iterator):
+            return await asyncio.wait_for(response_iterator.__anext__(), timeout=5)
+
+        async def run():
+            learner = FakeLearner()
+            service = LearnerService(learner)
+
+            async def update_policy_variables(variables):
+                learner.update_policy_variables(variables)
+                version = learner._policy_variables_version
+                while (service._proto_policy_variables is None
+                       or max(p.version for p in service._proto_policy_variables if p is not None) != version):
+                    await asyncio.sleep(0.01)
+
+            variables_list = gen_variables_list(KEYFRAME_INTERVAL + 3)
+            for variables in variables_list[:KEYFRAME_INTERVAL + 2]:
+                await update_policy_variables(variables)
+            # The latest keyframe is KEYFRAME_INTERVAL + 1, followed by a delta
+
+            # Reconnecting with a stale keyframe receives the latest keyframe first
+            response_iterator = service.StreamPolicyVariables(
+                learner_pb2.PolicyVariablesRequest(version=2, keyframe_version=1),
+                None)
+            response = await next_response(response_iterator)
+            self.assertEqual(response.version, KEYFRAME_INTERVAL + 1)
+            self.assertEqual(response.keyframe_version, KEYFRAME_INTERVAL + 1)
+            self.assert_decoded(self.stub._decode_policy_variables(response), variables_list[KEYFRAME_INTERVAL])
+
+            response = await next_response(response_iterator)
+            self.assertEqual(response.version, KEYFRAME_INTERVAL + 2)
+            self.assert_decoded(self.stub._decode_policy_variables(response), variables_list[KEYFRAME_INTERVAL + 1])
+
+            # New versions are pushed to the waiting stream
+            await update_policy_variables(variables_list[KEYFRAME_INTERVAL + 2])
+            response = await next_response(response_iterator)
+            self.assertEqual(response.version, KEYFRAME_INTERVAL + 3)
+            self.assertEqual(response.keyframe_version, KEYFRAME_INTERVAL + 1)
+            self.assert_decoded(self.stub._decode_policy_variables(response), variables_list[KEYFRAME_INTERVAL + 2])
+            await response_iterator.aclose()
+
+            # A delta whose keyframe is missing cannot be decoded, so that actor reconnects
+            stub = StubController('localhost', 1)
+            self.assertIsNone(stub._decode_policy_variables(service._proto_policy_variables[1]))
+            stub.close()
+
+            # Reconnecting with the latest keyframe only receives deltas
+            response_iterator = service.StreamPolicyVariables(
+                learner_pb2.PolicyVariablesRequest(version=KEYFRAME_INTERVAL + 1,
+                                                   keyframe_version=KEYFRAME_INTERVAL + 1),
+                None)
+            response = await next_response(response_iterator)
+            self.assertEqual(response.version, KEYFRAME_INTERVAL + 3)
+            self.assertEqual(response.keyframe_version, KEYFRAME_INTERVAL + 1)
+            await response_iterator.aclose()
+
+        asyncio.run(run())
+
+
+if __name__ == '__main__':
+    unittest.main()
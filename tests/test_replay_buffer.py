@@ -0,0 +1,327 @@
+import tempfile
+import threading
+import time
+import unittest
+from pathlib import Path
+
+import numpy as np
+
+from algorithm.replay_buffer import (DataStorage, FrameDedupDataStorage,
+                                     MemmapDataStorage, PrioritizedReplayBuffer,
+                                     SumTree, VectorizedSumTree)
+
+BATCH = 16
+CAPACITY = 128
+
+
+def gen_episode(episode_len):
+    return {
+        'index': np.arange(episode_len),
+        'obs_0': np.random.randn(episode_len, 4).astype(np.float32),
+        'obs_1': np.random.rand(episode_len, 6, 6, 3).astype(np.float32),
+        'reward': np.random.randn(episode_len).astype(np.float32),
+    }
+
+
+class TestPrioritizedReplayBuffer(unittest.TestCase):
+    def test_sample_windows(self):
+        replay_buffer = PrioritizedReplayBuffer(BATCH, CAPACITY)
+        self.assertIsNone(replay_buffer.sample_windows(window=4))
+
+        for _ in range(10):
+            replay_buffer.add(gen_episode(30), ignore_size=3)
+
+        window = 4
+        data_ids, trans, is_weights = replay_buffer.sample_windows(window=window)
+        self.assertEqual(data_ids.shape, (BATCH, ))
+        self.assertEqual(is_weights.shape, (BATCH, 1))
+        self.assertEqual(trans['obs_0'].shape, (BATCH, window, 4))
+        self.assertEqual(trans['obs_1'].shape, (BATCH, window, 6, 6, 3))
+        self.assertEqual(trans['reward'].shape, (BATCH, window))
+
+        for i in range(window):
+            t_trans = replay_buffer.get_storage_data(data_ids + i)
+            for k, v in t_trans.items():
+                np.testing.assert_array_equal(trans[k][:, i], v)
+
+    def test_mutex_concurrency(self):
+        replay_buffer = PrioritizedReplayBuffer(BATCH, CAPACITY, concurrency='mutex')
+        self.assertFalse(replay_buffer.is_lg_batch_size)
+
+        replay_buffer.add(gen_episode(30), ignore_size=3)
+        self.assertEqual(replay_buffer.size, 30)
+        self.assertTrue(replay_buffer.is_lg_batch_size)
+
+        data_ids, _, _ = replay_buffer.sample_windows(window=4)
+        replay_buffer.update(data_ids, np.random.rand(BATCH))
+
+    def test_update_overwritten(self):
+        replay_buffer = PrioritizedReplayBuffer(BATCH, CAPACITY)
+        replay_buffer.add(gen_episode(CAPACITY))
+
+        # Sampled before the first 30 transitions are overwritten
+        data_ids = np.arange(0, CAPACITY, 4).astype(np.uint64)
+        replay_buffer.add(gen_episode(30))
+        overwritten = data_ids < 30
+        e_reward = replay_buffer.get_storage_data(data_ids)['reward']
+
+        replay_buffer.update(data_ids, np.full(len(data_ids), replay_buffer.td_error_min))
+        replay_buffer.update_transitions(data_ids, 'reward', np.zeros(len(data_ids), dtype=np.float32))
+
+        sum_tree = replay_buffer._sum_tree
+        p = sum_tree._tree[sum_tree.data_idx_to_leaf_idx(data_ids % CAPACITY)]
+        np.testing.assert_allclose(p[overwritten], replay_buffer.td_error_max)
+        np.testing.assert_allclose(p[~overwritten], replay_buffer.td_error_min ** replay_buffer.alpha, rtol=1e-5)
+
+        reward = replay_buffer.get_storage_data(data_ids)['reward']
+        np.testing.assert_array_equal(reward[overwritten], e_reward[overwritten])
+        np.testing.assert_array_equal(reward[~overwritten], 0)
+
+    def test_snapshot(self):
+        for snapshot_compression in [False, True]:
+            replay_buffer = PrioritizedReplayBuffer(BATCH, CAPACITY,
+                                                    snapshot_compression=snapshot_compression,
+                                                    snapshot_chunk_size=50)
+            for _ in range(3):
+                replay_buffer.add(gen_episode(30), ignore_size=3)
+            replay_buffer.update(np.arange(10), np.random.rand(10))
+
+            with tempfile.TemporaryDirectory() as snapshot_dir:
+                snapshot_path = Path(snapshot_dir).joinpath('100.replay')
+                replay_buffer.save_snapshot_async(snapshot_path)
+                replay_buffer.wait_snapshot()
+
+                restored_replay_buffer = PrioritizedReplayBuffer(BATCH, CAPACITY)
+                self.assertTrue(restored_replay_buffer.load_snapshot(snapshot_path))
+
+            self.assertEqual(restored_replay_buffer.size, replay_buffer.size)
+            np.testing.assert_array_equal(restored_replay_buffer._sum_tree._tree, replay_buffer._sum_tree._tree)
+            self.assertEqual(restored_replay_buffer._sum_tree.max, replay_buffer._sum_tree.max)
+
+            ids = np.arange(replay_buffer.size)
+            for k, v in replay_buffer.get_storage_data(ids).items():
+                np.testing.assert_array_equal(restored_replay_buffer.get_storage_data(ids)[k], v)
+
+            # Pointers are restored
+            episode = gen_episode(30)
+            replay_buffer.add(episode)
+            restored_replay_buffer.add(episode)
+            np.testing.assert_array_equal(restored_replay_buffer.get_storage_data_ids(ids),
+                                          replay_buffer.get_storage_data_ids(ids))
+
+    def test_snapshot_while_adding(self):
+        replay_buffer = PrioritizedReplayBuffer(BATCH, CAPACITY, snapshot_chunk_size=8)
+
+        def td_error(tag):
+            return 0.01 + tag % 90 / 100
+
+        # Every key and the priority of a transition are derived from the tag of its episode
+        def gen_tagged_episode(tag, episode_len=5):
+            return {
+                'index': np.full(episode_len, tag),
+                'obs_0': np.full((episode_len, 4), tag, dtype=np.float32),
+                'reward': np.full(episode_len, tag, dtype=np.float32),
+                'done': np.full(episode_len, tag % 2 == 0)
+            }
+
+        stopped = threading.Event()
+
+        def add():
+            tag = 0
+            while not stopped.is_set():
+                replay_buffer.add_with_td_error(np.full(5, td_error(tag)), gen_tagged_episode(tag))
+                tag += 1
+                time.sleep(0.0001)
+
+        replay_buffer.add_with_td_error(np.full(5, td_error(0)), gen_tagged_episode(0))
+        t = threading.Thread(target=add)
+        t.start()
+
+        try:
+            with tempfile.TemporaryDirectory() as snapshot_dir:
+                for i in range(10):
+                    snapshot_path = Path(snapshot_dir).joinpath(f'{i}.replay')
+                    replay_buffer.save_snapshot(snapshot_path)
+
+                    restored_replay_buffer = PrioritizedReplayBuffer(BATCH, CAPACITY)
+                    self.assertTrue(restored_replay_buffer.load_snapshot(snapshot_path))
+
+                    size = restored_replay_buffer.size
+                    trans = restored_replay_buffer.get_storage_data(np.arange(size))
+                    tags = trans['index']
+                    np.testing.assert_array_equal(trans['obs_0'], np.repeat(tags[:, None], 4, axis=1))
+                    np.testing.assert_array_equal(trans['reward'], tags)
+                    np.testing.assert_array_equal(trans['done'], tags % 2 == 0)
+
+                    sum_tree = restored_replay_buffer._sum_tree
+                    p = sum_tree._tree[sum_tree.data_idx_to_leaf_idx(np.arange(size))]
+                    np.testing.assert_allclose(p, np.power(td_error(tags), restored_replay_buffer.alpha), rtol=1e-5)
+
+                    # The latest transition is the one before the restored pointer
+                    latest_pointer = (restored_replay_buffer._trans_storage._id - 1) % CAPACITY
+                    self.assertEqual(tags[latest_pointer], tags.max())
+        finally:
+            stopped.set()
+            t.join()
+
+    def test_snapshot_chunk_locks(self):
+        for storage in ['ram', 'memmap']:
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                replay_buffer = PrioritizedReplayBuffer(BATCH, CAPACITY, storage=storage,
+                                                        storage_dir=Path(tmp_dir).joinpath('storage'),
+                                                        snapshot_chunk_size=16)
+                replay_buffer.add(gen_episode(CAPACITY))
+
+                get_raw_chunk = replay_buffer._trans_storage.get_raw_chunk
+                add_threads = []
+
+                # Writers are not blocked between chunks.
+                # An episode added in the middle of the snapshot overwrites the first chunks
+                def get_raw_chunk_while_adding(key, start, end):
+                    if len(add_threads) == 0 and key == 'obs_0' and start == 64:
+                        t = threading.Thread(target=replay_buffer.add, args=(gen_episode(20), ))
+                        t.start()
+                        add_threads.append(t)
+                    elif len(add_threads) == 1:
+                        add_threads[0].join(timeout=5)
+                        self.assertFalse(add_threads[0].is_alive())
+                    return get_raw_chunk(key, start, end)
+
+                replay_buffer._trans_storage.get_raw_chunk = get_raw_chunk_while_adding
+
+                snapshot_path = Path(tmp_dir).joinpath('100.replay')
+                replay_buffer.save_snapshot(snapshot_path)
+                self.assertEqual(len(add_threads), 1)
+
+                restored_replay_buffer = PrioritizedReplayBuffer(BATCH, CAPACITY)
+                self.assertTrue(restored_replay_buffer.load_snapshot(snapshot_path))
+
+            self.assertEqual(restored_replay_buffer._trans_storage._id, replay_buffer._trans_storage._id)
+            np.testing.assert_array_equal(restored_replay_buffer._sum_tree._tree, replay_buffer._sum_tree._tree)
+            ids = np.arange(CAPACITY)
+            for k, v in replay_buffer.get_storage_data(ids).items():
+                np.testing.assert_array_equal(restored_replay_buffer.get_storage_data(ids)[k], v)
+
+
+class TestSumTree(unittest.TestCase):
+    def test_vectorized_sum_tree(self):
+        capacity = 1024
+        sum_tree = SumTree(capacity)
+        vectorized_sum_tree = VectorizedSumTree(capacity)
+
+        for batch in [1, 7, 300, capacity]:
+            data_idx = np.random.randint(capacity, size=batch)
+            p = np.random.rand(batch).astype(np.float32)
+            sum_tree.update(data_idx, p)
+            vectorized_sum_tree.update(data_idx, p)
+            np.testing.assert_allclose(sum_tree._tree, vectorized_sum_tree._tree, rtol=1e-5)
+
+        np.random.seed(0)
+        leaf_idx, p = sum_tree.sample(BATCH)
+        np.random.seed(0)
+        vectorized_leaf_idx, vectorized_p = vectorized_sum_tree.sample(BATCH)
+        np.testing.assert_array_equal(leaf_idx, vectorized_leaf_idx)
+        np.testing.assert_array_equal(p, vectorized_p)
+
+    def test_max(self):
+        capacity = 1024
+        for sum_tree in [SumTree(capacity), VectorizedSumTree(capacity)]:
+            for batch in [1, 7, 300, capacity]:
+                data_idx = np.random.randint(capacity, size=batch)
+                sum_tree.update(data_idx, np.random.rand(batch).astype(np.float32))
+                self.assertEqual(sum_tree.max, sum_tree._tree[capacity - 1:].max())
+
+            # Max priority decreases when the max leaf is updated
+            data_idx = np.argmax(sum_tree._tree[capacity - 1:])
+            sum_tree.update(np.array([data_idx]), np.zeros(1, dtype=np.float32))
+            self.assertEqual(sum_tree.max, sum_tree._tree[capacity - 1:].max())
+
+
+class TestMemmapDataStorage(unittest.TestCase):
+    def test_memmap_storage(self):
+        with tempfile.TemporaryDirectory() as storage_dir:
+            ram_storage = DataStorage(CAPACITY)
+            memmap_storage = MemmapDataStorage(CAPACITY, storage_dir, cache_size=32)
+
+            for _ in range(10):
+                episode = gen_episode(30)
+                ram_storage.add(episode)
+                memmap_storage.add(episode)
+
+            ids = np.random.randint(0, 10 * CAPACITY, size=BATCH)
+            np.testing.assert_array_equal(ram_storage.get_ids(ids), memmap_storage.get_ids(ids))
+            for k, v in ram_storage.get(ids).items():
+                np.testing.assert_array_equal(v, memmap_storage.get(ids)[k])
+            for k, v in ram_storage.get_windows(ids, 4).items():
+                np.testing.assert_array_equal(v, memmap_storage.get_windows(ids, 4)[k])
+
+            reward = np.random.randn(BATCH).astype(np.float32)
+            ram_storage.update(ids, 'reward', reward)
+            memmap_storage.update(ids, 'reward', reward)
+            np.testing.assert_array_equal(ram_storage.get(ids)['reward'], memmap_storage.get(ids)['reward'])
+
+            copied_storage = MemmapDataStorage(CAPACITY, Path(storage_dir).joinpath('copied'), cache_size=32)
+            copied_storage.copy(memmap_storage)
+            for k, v in ram_storage.get(ids).items():
+                np.testing.assert_array_equal(v, copied_storage.get(ids)[k])
+
+
+class TestFrameDedupDataStorage(unittest.TestCase):
+    def test_dedup_storage(self):
+        ram_storage = DataStorage(CAPACITY)
+        dedup_storage = FrameDedupDataStorage(CAPACITY, init_frame_capacity=8)
+
+        for _ in range(10):
+            episode = gen_episode(30)
+            # Burn-in paddings
+            episode['obs_1'][:10] = 0
+            ram_storage.add(episode)
+            dedup_storage.add(episode)
+
+        # Each of the last 5 episodes in buffer is partially overwritten, only one padding frame is shared
+        self.assertLessEqual(dedup_storage.frame_size['obs_1'], CAPACITY - 4 * 9)
+
+        ids = np.random.randint(0, 10 * CAPACITY, size=BATCH)
+        np.testing.assert_array_equal(ram_storage.get_ids(ids), dedup_storage.get_ids(ids))
+        for k, v in ram_storage.get(ids).items():
+            np.testing.assert_array_equal(v, dedup_storage.get(ids)[k])
+        for k, v in ram_storage.get_windows(ids, 4).items():
+            np.testing.assert_array_equal(v, dedup_storage.get_windows(ids, 4)[k])
+
+        restored_storage = FrameDedupDataStorage(CAPACITY)
+        for k in dedup_storage.keys:
+            restored_storage.restore_raw_chunk(k, 0, dedup_storage.get_raw_chunk(k, 0, CAPACITY))
+        restored_storage.restore_state(dedup_storage.size, dedup_storage._id)
+        for k, v in ram_storage.get(ids).items():
+            np.testing.assert_array_equal(v, restored_storage.get(ids)[k])
+
+    def test_prepare(self):
+        ram_storage = DataStorage(CAPACITY)
+        dedup_storage = FrameDedupDataStorage(CAPACITY, init_frame_capacity=8)
+
+        episode = gen_episode(30)
+        episode['obs_1'][:10] = 0
+        ram_storage.add(episode)
+        dedup_storage.add(episode)
+
+        # Frames are prepared out of the lock, and found in the frame pool
+        reused_episode = gen_episode(30)
+        reused_episode['obs_1'][:20] = episode['obs_1'][10:]
+        reused_episode['obs_1'][20:] = 0
+        prepared = dedup_storage.prepare(reused_episode)
+        self.assertTrue(np.all(prepared['obs_1'].candidates[:21] != -1))
+        # Paddings share the first padding frame in the episode
+        np.testing.assert_array_equal(prepared['obs_1'].firsts[21:], 20)
+
+        # Found frames are released before the prepared episode is added
+        for _ in range(CAPACITY // 30 + 1):
+            new_episode = gen_episode(30)
+            ram_storage.add(new_episode)
+            dedup_storage.add(new_episode)
+        ram_storage.add(reused_episode)
+        dedup_storage.add(reused_episode, prepared)
+
+        ids = np.arange(dedup_storage._id - CAPACITY, dedup_storage._id)
+        for k, v in ram_storage.get(ids).items():
+            np.testing.assert_array_equal(v, dedup_storage.get(ids)[k])
+        self.assertEqual(dedup_storage.frame_size['obs_1'], CAPACITY - 9)
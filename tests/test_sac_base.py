@@ -0,0 +1,398 @@
+import unittest
+from unittest import mock
+from itertools import chain
+
+import numpy as np
+import torch
+
+import tests.nn_vanilla as nn_vanilla
+from algorithm.sac_base import SAC_Base
+from algorithm.utils.enums import SEQ_ENCODER
+from algorithm.utils.operators import (squash_correction_log_prob,
+                                       squash_correction_prob)
+from tests.get_synthesis_data import *
+
+OBS_SHAPES = [(10,)]
+
+
+class TestUpdateTargetVariables(unittest.TestCase):
+    def test_update_target_variables(self):
+        for fused_ensemble_q in [False, True]:
+            sac = SAC_Base(
+                obs_shapes=OBS_SHAPES,
+                d_action_size=3,
+                c_action_size=2,
+                model_abs_dir=None,
+                model=nn_vanilla,
+                ensemble_q_num=3,
+                fused_ensemble_q=fused_ensemble_q
+            )
+
+            with torch.no_grad():
+                for q in (sac.model_q_ensemble.parameters() if fused_ensemble_q
+                          else sac.model_q_list[1].parameters()):
+                    q.add_(torch.randn_like(q))
+
+            target_q_list = [{k: v.clone() for k, v in q.state_dict().items()} for q in sac.model_target_q_list]
+            q_list = [{k: v.clone() for k, v in q.state_dict().items()} for q in sac.model_q_list]
+
+            tau = 0.1
+            sac._update_target_variables(tau=tau)
+            for t_q, e_t_q, e_q in zip(sac.model_target_q_list, target_q_list, q_list):
+                for k, v in t_q.state_dict().items():
+                    torch.testing.assert_close(v, e_t_q[k] * (1. - tau) + e_q[k] * tau)
+
+            sac._update_target_variables()
+            for t_q, q in zip(sac.model_target_q_list, sac.model_q_list):
+                for k, v in t_q.state_dict().items():
+                    torch.testing.assert_close(v, q.state_dict()[k], rtol=0, atol=0)
+
+
+def two_pass_get_y(sac: SAC_Base,
+                   n_obses_list, n_states, n_actions, n_rewards,
+                   next_obs_list, next_state, n_dones, n_mu_probs=None):
+    """
+    `_get_y` evaluating the current and the next states in two passes, as before they were merged
+    """
+    d_alpha = torch.exp(sac.log_d_alpha)
+    c_alpha = torch.exp(sac.log_c_alpha)
+
+    next_n_obses_list = [torch.cat([n_obses[:, 1:, ...], next_obs.unsqueeze(1)], dim=1)
+                         for n_obses, next_obs in zip(n_obses_list, next_obs_list)]
+    next_n_states = torch.cat([n_states[:, 1:, ...], next_state.unsqueeze(1)], dim=1)
+
+    d_policy, c_policy = sac.model_policy(n_states, n_obses_list)
+    next_d_policy, next_c_policy = sac.model_policy(next_n_states, next_n_obses_list)
+
+    if sac.c_action_size:
+        n_c_actions_sampled = c_policy.rsample()
+        next_n_c_actions_sampled = next_c_policy.rsample()
+    else:
+        n_c_actions_sampled = torch.empty(0, device=sac.device)
+        next_n_c_actions_sampled = torch.empty(0, device=sac.device)
+
+    d_q, c_q = sac._get_stacked_q(n_states, torch.tanh(n_c_actions_sampled), target=True)
+    next_d_q, next_c_q = sac._get_stacked_q(next_n_states, torch.tanh(next_n_c_actions_sampled), target=True)
+
+    d_y, c_y = None, None
+
+    if sac.d_action_size:
+        stacked_next_d_q = next_d_q[torch.randperm(sac.ensemble_q_num)[:sac.ensemble_q_sample]]
+
+        if sac.discrete_dqn_like:
+            next_d_eval_q, _ = sac._get_stacked_q(next_n_states, torch.tanh(next_n_c_actions_sampled))
+            stacked_next_d_eval_q = next_d_eval_q[torch.randperm(sac.ensemble_q_num)[:sac.ensemble_q_sample]]
+
+            d_y = sac.get_dqn_like_d_y(n_rewards, n_dones,
+                                       stacked_next_d_eval_q,
+                                       stacked_next_d_q)
+        else:
+            stacked_d_q = d_q[torch.randperm(sac.ensemble_q_num)[:sac.ensemble_q_sample]]
+
+            min_q, _ = torch.min(stacked_d_q, dim=0)
+            min_next_q, _ = torch.min(stacked_next_d_q, dim=0)
+
+            probs = d_policy.probs
+            next_probs = next_d_policy.probs
+            tmp_v = min_q - d_alpha * torch.log(probs.clamp(min=1e-8))
+            tmp_next_v = min_next_q - d_alpha * torch.log(next_probs.clamp(min=1e-8))
+
+            v = torch.sum(probs * tmp_v, dim=-1)
+            next_v = torch.sum(next_probs * tmp_next_v, dim=-1)
+
+            n_pi_probs = None
+            if sac.use_n_step_is:
+                n_pi_probs = torch.exp(d_policy.log_prob(n_actions[..., :sac.d_action_size]))
+
+            d_y = sac._v_trace(n_rewards, n_dones, n_mu_probs, n_pi_probs, v, next_v)
+
+    if sac.c_action_size:
+        n_actions_log_prob = torch.sum(squash_correction_log_prob(c_policy, n_c_actions_sampled), dim=-1)
+        next_n_actions_log_prob = torch.sum(squash_correction_log_prob(next_c_policy, next_n_c_actions_sampled), dim=-1)
+
+        stacked_c_q = c_q[torch.randperm(sac.ensemble_q_num)[:sac.ensemble_q_sample]]
+        stacked_next_c_q = next_c_q[torch.randperm(sac.ensemble_q_num)[:sac.ensemble_q_sample]]
+
+        min_q, _ = stacked_c_q.min(dim=0)
+        min_next_q, _ = stacked_next_c_q.min(dim=0)
+
+        v = min_q.squeeze(dim=-1) - c_alpha * n_actions_log_prob
+        next_v = min_next_q.squeeze(dim=-1) - c_alpha * next_n_actions_log_prob
+
+        n_pi_probs = None
+        if sac.use_n_step_is:
+            n_c_actions = n_actions[..., sac.d_action_size:]
+            n_pi_probs = squash_correction_prob(c_policy, torch.atanh(n_c_actions)).prod(axis=-1)
+
+        c_y = sac._v_trace(n_rewards, n_dones, n_mu_probs, n_pi_probs, v, next_v)
+
+    return d_y, c_y
+
+
+class TestGetY(unittest.TestCase):
+    def test_two_pass(self):
+        batch, n = 16, 4
+
+        for d_action_size, c_action_size, kwargs in [
+            (3, 0, {}),
+            (3, 0, {'use_n_step_is': False}),
+            (3, 0, {'discrete_dqn_like': True}),
+            (0, 2, {}),
+            (0, 2, {'use_n_step_is': False}),
+            (3, 2, {})
+        ]:
+            with self.subTest(d_action_size=d_action_size, c_action_size=c_action_size, **kwargs):
+                sac = SAC_Base(
+                    obs_shapes=OBS_SHAPES,
+                    d_action_size=d_action_size,
+                    c_action_size=c_action_size,
+                    model_abs_dir=None,
+                    model=nn_vanilla,
+                    n_step=n,
+                    ensemble_q_num=3,
+                    ensemble_q_sample=2,
+                    use_replay_buffer=False,
+                    **kwargs
+                )
+
+                m_obses_list = [torch.randn(batch, n + 1, *s) for s in OBS_SHAPES]
+                m_states = torch.randn(batch, n + 1, sac.model_q_list[0].state_size)
+                n_d_actions = torch.nn.functional.one_hot(torch.randint(max(d_action_size, 1), (batch, n)),
+                                                          max(d_action_size, 1))[..., :d_action_size].float()
+                n_c_actions = torch.tanh(torch.randn(batch, n, c_action_size))
+                n_actions = torch.cat([n_d_actions, n_c_actions], dim=-1)
+                n_rewards = torch.randn(batch, n)
+                n_dones = torch.rand(batch, n) < 0.2
+                n_mu_probs = torch.rand(batch, n).clamp(min=0.1)
+
+                # Continuous actions are the means, and ensemble Qs are sampled in order
+                with mock.patch.object(torch.distributions.Normal, 'rsample', lambda self, *args: self.loc * 1.), \
+                        mock.patch('torch.randperm', lambda n, *args, **kwargs: torch.arange(n)):
+                    with torch.no_grad():
+                        d_y, c_y = sac._get_y(m_obses_list, m_states, n_actions, n_rewards.clone(), n_dones, n_mu_probs)
+                        e_d_y, e_c_y = two_pass_get_y(sac,
+                                                      [o[:, :-1] for o in m_obses_list], m_states[:, :-1],
+                                                      n_actions, n_rewards.clone(),
+                                                      [o[:, -1] for o in m_obses_list], m_states[:, -1],
+                                                      n_dones, n_mu_probs)
+
+                for y, e_y, action_size in [(d_y, e_d_y, d_action_size), (c_y, e_c_y, c_action_size)]:
+                    if action_size:
+                        self.assertEqual(y.shape, (batch, 1))
+                        torch.testing.assert_close(y, e_y, rtol=1e-5, atol=1e-5)
+                    else:
+                        self.assertIsNone(y)
+
+
+class TestMixedPrecision(unittest.TestCase):
+    def test_train(self):
+        for mixed_precision in ['bf16', 'fp16']:
+            sac = SAC_Base(
+                obs_shapes=OBS_SHAPES,
+                d_action_size=3,
+                c_action_size=2,
+                model_abs_dir=None,
+                model=nn_vanilla,
+                batch_size=16,
+                n_step=3,
+                device='cpu',
+                mixed_precision=mixed_precision
+            )
+
+            step = 0
+            while step < 5:
+                sac.put_episode(*gen_episode_trans(OBS_SHAPES,
+                                                   d_action_size=3,
+                                                   c_action_size=2,
+                                                   episode_len=40))
+                step = sac.train()
+
+            for param in chain(sac.model_policy.parameters(), sac.model_q_list[0].parameters()):
+                self.assertEqual(param.dtype, torch.float32)
+                self.assertTrue(torch.isfinite(param).all())
+            self.assertEqual(sac.log_d_alpha.dtype, torch.float32)
+            self.assertEqual(sac.log_c_alpha.dtype, torch.float32)
+
+
+class TestCompile(unittest.TestCase):
+    def _gen_sac(self, use_compile):
+        torch.manual_seed(0)
+        return SAC_Base(
+            obs_shapes=OBS_SHAPES,
+            d_action_size=3,
+            c_action_size=2,
+            model_abs_dir=None,
+            model=nn_vanilla,
+            use_normalization=True,
+            use_compile=use_compile
+        )
+
+    def test_parity(self):
+        from torch._dynamo.utils import counters
+
+        sac = self._gen_sac(False)
+        compiled_sac = self._gen_sac(True)
+
+        obs_list = gen_batch_obs(OBS_SHAPES)[0]
+        for _ in range(2):
+            action, prob = sac.choose_action(obs_list, disable_sample=True)
+            compiled_action, compiled_prob = compiled_sac.choose_action(obs_list, disable_sample=True)
+            np.testing.assert_allclose(compiled_action, action, rtol=1e-5, atol=1e-6)
+            np.testing.assert_allclose(compiled_prob, prob, rtol=1e-5, atol=1e-6)
+
+            # Updated normalizer statistics are seen by the compiled graph
+            normalizer_obs_list = [torch.randn(32, *s) * 3 + 1 for s in OBS_SHAPES]
+            sac._udpate_normalizer(normalizer_obs_list)
+            compiled_sac._udpate_normalizer(normalizer_obs_list)
+
+        state = torch.randn(16, 10)
+        c_action = torch.randn(16, 2)
+        for q, compiled_q in zip(sac.model_q_list, compiled_sac.model_q_list):
+            for v, compiled_v in zip(q(state, c_action), compiled_q(state, c_action)):
+                torch.testing.assert_close(compiled_v, v)
+
+        # Compiled graphs are reused by later calls and by other instances in the same process
+        unique_graphs = counters['stats']['unique_graphs']
+        compiled_sac.choose_action(obs_list, disable_sample=True)
+        self._gen_sac(True).choose_action(obs_list, disable_sample=True)
+        self.assertEqual(counters['stats']['unique_graphs'], unique_graphs)
+
+
+class TestAsyncWriteBack(unittest.TestCase):
+    CONV_OBS_SHAPES = [(10,), (30, 30, 3)]
+
+    def _gen_sac(self, seq_encoder):
+        if seq_encoder == SEQ_ENCODER.RNN:
+            import tests.nn_conv_rnn as nn_conv
+        elif seq_encoder == SEQ_ENCODER.ATTN:
+            import tests.nn_conv_attn as nn_conv
+        else:
+            import tests.nn_conv_vanilla as nn_conv
+
+        return SAC_Base(
+            obs_shapes=self.CONV_OBS_SHAPES,
+            d_action_size=3,
+            c_action_size=2,
+            model_abs_dir=None,
+            model=nn_conv,
+            batch_size=8,
+            burn_in_step=2,
+            n_step=3,
+            seq_encoder=seq_encoder,
+            async_write_back=True
+        )
+
+    def test_refreshed(self):
+        batch, bn = 8, 5
+        for seq_encoder in [None, SEQ_ENCODER.RNN, SEQ_ENCODER.ATTN]:
+            sac = self._gen_sac(seq_encoder)
+
+            bn_obses_list, bn_actions, bn_rewards, next_obs_list, bn_dones, bn_mu_probs = [
+                [torch.from_numpy(t) for t in d] if isinstance(d, list) else torch.from_numpy(d)
+                for d in gen_batch_trans(self.CONV_OBS_SHAPES, 3, 2, bn, batch=batch)
+            ]
+            bn_indexes = torch.arange(bn).repeat(batch, 1)
+            bn_padding_masks = torch.zeros((batch, bn), dtype=torch.bool)
+            f_seq_hidden_states = None
+            if seq_encoder is not None:
+                f_seq_hidden_states = torch.randn(batch, 1, *sac.seq_hidden_state_shape)
+            batch_trans = [bn_indexes, bn_padding_masks, bn_obses_list, bn_actions,
+                           bn_rewards, next_obs_list, bn_dones, bn_mu_probs.abs(), f_seq_hidden_states]
+
+            # The target networks are not changed by the soft update before training,
+            # and the same actions are sampled in `_get_y`
+            sac._update_target_variables()
+            torch.manual_seed(0)
+            e_td_error = sac._get_td_error(*batch_trans)
+            torch.manual_seed(0)
+            td_error, bn_pi_probs, bn_seq_hidden_states = sac._train(*batch_trans, priority_is=torch.ones(batch, 1))
+            torch.testing.assert_close(td_error, e_td_error, rtol=1e-4, atol=1e-5)
+
+            l_trans = [bn_indexes, bn_padding_masks, bn_obses_list, bn_actions, f_seq_hidden_states]
+            torch.testing.assert_close(bn_pi_probs, sac.get_l_probs(*l_trans), rtol=1e-4, atol=1e-6)
+            if seq_encoder is None:
+                self.assertIsNone(bn_seq_hidden_states)
+            else:
+                torch.testing.assert_close(bn_seq_hidden_states, sac.get_l_seq_hidden_states(*l_trans),
+                                           rtol=1e-4, atol=1e-5)
+
+    def test_train(self):
+        sac = self._gen_sac(SEQ_ENCODER.ATTN)
+
+        with mock.patch.object(sac.replay_buffer, 'update', wraps=sac.replay_buffer.update) as update, \
+                mock.patch.object(sac.replay_buffer, 'update_transitions',
+                                  wraps=sac.replay_buffer.update_transitions) as update_transitions:
+            step = 0
+            while step < 5:
+                sac.put_episode(*gen_episode_trans(self.CONV_OBS_SHAPES,
+                                                   d_action_size=3,
+                                                   c_action_size=2,
+                                                   seq_hidden_state_shape=sac.seq_hidden_state_shape,
+                                                   episode_len=40))
+                step = sac.train()
+            sac.wait_write_back()
+
+        # td_error, then seq_hidden_state and mu_prob for every step
+        self.assertEqual(update.call_count, step)
+        self.assertEqual(update_transitions.call_count, step * 2)
+
+
+class TestPrefetch(unittest.TestCase):
+    def _gen_sac(self, **kwargs):
+        return SAC_Base(
+            obs_shapes=OBS_SHAPES,
+            d_action_size=3,
+            c_action_size=2,
+            model_abs_dir=None,
+            model=nn_vanilla,
+            batch_size=16,
+            n_step=3,
+            prefetch_batches=2,
+            **kwargs
+        )
+
+    def test_train(self):
+        for async_write_back in [False, True]:
+            sac = self._gen_sac(async_write_back=async_write_back)
+            self.assertEqual(sac.train(), 0)  # The replay buffer is not ready
+
+            step = 0
+            while step < 5:
+                sac.put_episode(*gen_episode_trans(OBS_SHAPES,
+                                                   d_action_size=3,
+                                                   c_action_size=2,
+                                                   episode_len=40))
+                step = sac.train()
+            sac.wait_write_back()
+
+            self.assertLessEqual(sac._prefetch_queue.qsize(), 2)
+            pointers, batch = sac._get_prefetched_batch()
+            self.assertEqual(pointers.shape, (16,))
+            bn_obses = batch[2][0]
+            self.assertEqual(bn_obses.shape, (16, 3, *OBS_SHAPES[0]))
+            self.assertEqual(bn_obses.device, sac.device)
+
+    def test_close(self):
+        sac = self._gen_sac(async_write_back=True)
+        sac.put_episode(*gen_episode_trans(OBS_SHAPES,
+                                           d_action_size=3,
+                                           c_action_size=2,
+                                           episode_len=40))
+        sac.train()
+        prefetch_thread = sac._prefetch_thread
+
+        sac.close()
+        self.assertFalse(prefetch_thread.is_alive())
+        self.assertIsNone(sac._prefetch_thread)
+        self.assertIsNone(sac._write_back_future)
+
+    def test_exception(self):
+        sac = self._gen_sac()
+        sac.put_episode(*gen_episode_trans(OBS_SHAPES,
+                                           d_action_size=3,
+                                           c_action_size=2,
+                                           episode_len=40))
+
+        with mock.patch.object(sac, '_sample_from_replay_buffer', side_effect=RuntimeError('sample')):
+            with self.assertRaisesRegex(RuntimeError, 'sample'):
+                sac.train()
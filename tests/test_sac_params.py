@@ -53,6 +53,8 @@ class TestSeqEncoderModel(unittest.TestCase):
         )
 
         seq_hidden_state_shape = sac.seq_hidden_state_shape
+        if param_dict['seq_encoder'] == SEQ_ENCODER.ATTN:
+            attn_kv_cache = sac.get_initial_attn_kv_cache()
 
         step = 0
         while step < 10:
@@ -66,6 +68,13 @@ class TestSeqEncoderModel(unittest.TestCase):
                                                                d_action_size=param_dict['d_action_size'],
                                                                c_action_size=param_dict['c_action_size'],
                                                                seq_hidden_state_shape=seq_hidden_state_shape))
+                obs_list, pre_action, attn_hidden_state = gen_batch_obs_for_rnn(OBS_SHAPES,
+                                                                                d_action_size=param_dict['d_action_size'],
+                                                                                c_action_size=param_dict['c_action_size'],
+                                                                                seq_hidden_state_shape=seq_hidden_state_shape)
+                sac.choose_attn_action_incremental(np.full(len(pre_action), step),
+                                                   obs_list, pre_action, attn_hidden_state,
+                                                   attn_kv_cache)
             sac.put_episode(*gen_episode_trans(OBS_SHAPES,
                                                d_action_size=param_dict['d_action_size'],
                                                c_action_size=param_dict['c_action_size'],
@@ -27,3 +27,74 @@ class TestEpisodeMultiheadAttention(unittest.TestCase):
              hidden_state=torch.rand((BATCH, 2, EMBED_DIM)),
              is_prev_hidden_state=True,
              key_padding_mask=torch.randint(0, 2, (BATCH, 10), dtype=torch.bool))
+
+    def test_attn_mask(self):
+        attn = EpisodeMultiheadAttention(EMBED_DIM, 2, num_layers=2)
+        key = torch.rand((BATCH, 10, EMBED_DIM))
+        key_padding_mask = torch.randint(0, 2, (BATCH, 10), dtype=torch.bool)
+
+        output, *_ = attn(key, query_length=3, key_padding_mask=key_padding_mask)
+
+        # Each sample is masked by its own key padding mask
+        for i in range(BATCH):
+            sample_output, *_ = attn(key[i:i + 1], query_length=3, key_padding_mask=key_padding_mask[i:i + 1])
+            torch.testing.assert_close(output[i:i + 1], sample_output)
+
+    def test_kv_cache(self):
+        num_layers = 3
+        attn = EpisodeMultiheadAttention(EMBED_DIM, 2, num_layers=num_layers)
+        kv_cache = EpisodeKVCache()
+        hidden_state_size = EMBED_DIM * (num_layers - 1)
+
+        window_key = torch.zeros((BATCH, 0, EMBED_DIM))
+        window_hidden_state = torch.zeros((BATCH, 0, hidden_state_size))
+        window_padding_mask = torch.zeros((BATCH, 0), dtype=torch.bool)
+        hidden_state = torch.zeros((BATCH, 1, hidden_state_size))
+        incremental_hidden_state = hidden_state
+
+        for step in range(20):
+            key = torch.rand((BATCH, 1, EMBED_DIM))
+            padding_mask = torch.zeros((BATCH, 1), dtype=torch.bool)
+
+            output, next_hidden_state, _ = attn(torch.concat([window_key, key], dim=1),
+                                                query_length=1,
+                                                hidden_state=window_hidden_state,
+                                                is_prev_hidden_state=False,
+                                                key_padding_mask=torch.concat([window_padding_mask, padding_mask], dim=1))
+            with episode_kv_cache(attn, kv_cache):
+                incremental_output, incremental_next_hidden_state, _ = attn(key,
+                                                                            query_length=1,
+                                                                            hidden_state=incremental_hidden_state,
+                                                                            key_padding_mask=padding_mask)
+
+            torch.testing.assert_close(incremental_output, output)
+            torch.testing.assert_close(incremental_next_hidden_state, next_hidden_state)
+
+            window_key = torch.concat([window_key, key], dim=1)
+            window_hidden_state = torch.concat([window_hidden_state, hidden_state], dim=1)
+            window_padding_mask = torch.concat([window_padding_mask, padding_mask], dim=1)
+            hidden_state = next_hidden_state
+            incremental_hidden_state = incremental_next_hidden_state
+
+            # Episodes of some agents are done
+            if step % 7 == 6:
+                done = torch.rand(BATCH) < 0.5
+                window_padding_mask[done] = True
+                hidden_state[done] = 0
+                incremental_hidden_state[done] = 0
+                kv_cache.reset(done)
+
+
+class TestAbsolutePositionalEncoding(unittest.TestCase):
+    def test_pe(self):
+        max_seq_len, d_model = 100, 16
+        pos_encoding = AbsolutePositionalEncoding(d_model, max_seq_len)
+
+        pe = torch.zeros(max_seq_len, d_model)
+        for pos in range(max_seq_len):
+            for i in range(0, d_model, 2):
+                pe[pos, i] = math.sin(pos / (10000 ** ((2 * i) / d_model)))
+                pe[pos, i + 1] = math.cos(pos / (10000 ** ((2 * (i + 1)) / d_model)))
+
+        torch.testing.assert_close(pos_encoding.pe, pe, rtol=0, atol=0)
+        torch.testing.assert_close(pos_encoding(torch.tensor([[3, 7]])), pe[[3, 7]].unsqueeze(0))
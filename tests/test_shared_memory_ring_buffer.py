@@ -0,0 +1,133 @@
+import multiprocessing as mp
+import unittest
+
+import numpy as np
+
+from ds.utils import SharedMemoryRingBuffer, get_episode_shapes_dtypes
+
+MAX_EPISODE_LENGTH = 20
+OBS_SHAPES = [(3,), (4, 4, 3)]
+ACTION_SIZE = 2
+
+
+def gen_episode(episode_len, i=0):
+    return [
+        np.arange(episode_len, dtype=np.int32)[np.newaxis],
+        np.zeros((1, episode_len), dtype=bool),
+        [np.full((1, episode_len, *s), i, dtype=np.float32) for s in OBS_SHAPES],
+        np.full((1, episode_len, ACTION_SIZE), i, dtype=np.float32),
+        np.full((1, episode_len), i, dtype=np.float32),
+        [np.full((1, *s), i, dtype=np.float32) for s in OBS_SHAPES],
+        np.zeros((1, episode_len), dtype=bool),
+        np.ones((1, episode_len), dtype=np.float32),
+        None
+    ]
+
+
+def gen_ring_buffer(queue_size):
+    ring_buffer = SharedMemoryRingBuffer(queue_size)
+    ring_buffer.init_from_shapes(*get_episode_shapes_dtypes(MAX_EPISODE_LENGTH, OBS_SHAPES, ACTION_SIZE))
+    return ring_buffer
+
+
+def assert_episode_equal(episode, e_episode):
+    for e, e_e in zip(episode, e_episode):
+        if isinstance(e, list):
+            for e_i, e_e_i in zip(e, e_e):
+                np.testing.assert_array_equal(e_i, e_e_i)
+        elif e is None:
+            assert e_e is None
+        else:
+            assert e.dtype == e_e.dtype
+            np.testing.assert_array_equal(e, e_e)
+
+
+def _put_episodes(ring_buffer, n):
+    for i in range(n):
+        ring_buffer.put(gen_episode(i % MAX_EPISODE_LENGTH + 1, i))
+
+
+class TestSharedMemoryRingBuffer(unittest.TestCase):
+    def test_put_get(self):
+        ring_buffer = gen_ring_buffer(3)
+        self.assertEqual(ring_buffer.get(timeout=0), (None, None))
+
+        for episode_len in [1, 7, MAX_EPISODE_LENGTH]:
+            ring_buffer.put(gen_episode(episode_len, episode_len))
+            episode, entry_idx = ring_buffer.get(timeout=0)
+            assert_episode_equal(episode, gen_episode(episode_len, episode_len))
+
+            # Zero-copy views of the shared memory
+            self.assertIs(episode[2][1].base, ring_buffer.shm.buf.obj)
+            ring_buffer.release(entry_idx)
+
+        with self.assertRaises(ValueError):
+            ring_buffer.put(gen_episode(MAX_EPISODE_LENGTH * 4))
+
+    def test_variable_length(self):
+        # Short episodes take only the space they need
+        ring_buffer = gen_ring_buffer(8)
+        for i in range(8):
+            ring_buffer.put(gen_episode(2, i))
+        for i in range(8):
+            episode, entry_idx = ring_buffer.get(timeout=0)
+            assert_episode_equal(episode, gen_episode(2, i))
+            ring_buffer.release(entry_idx)
+
+    def test_drop_oldest(self):
+        ring_buffer = gen_ring_buffer(2)
+        for i in range(5):
+            ring_buffer.put(gen_episode(MAX_EPISODE_LENGTH, i))
+
+        episode_3, entry_idx_3 = ring_buffer.get(timeout=0)
+        assert_episode_equal(episode_3, gen_episode(MAX_EPISODE_LENGTH, 3))
+
+        # The episode being read is not overwritten, `put` drops the new episode without blocking
+        self.assertFalse(ring_buffer.put(gen_episode(MAX_EPISODE_LENGTH, 100)))
+        assert_episode_equal(episode_3, gen_episode(MAX_EPISODE_LENGTH, 3))
+
+        ring_buffer.release(entry_idx_3)
+        self.assertTrue(ring_buffer.put(gen_episode(MAX_EPISODE_LENGTH, 5)))
+
+        for i in [4, 5]:
+            episode, entry_idx = ring_buffer.get(timeout=0)
+            assert_episode_equal(episode, gen_episode(MAX_EPISODE_LENGTH, i))
+            ring_buffer.release(entry_idx)
+        self.assertEqual(ring_buffer.get(timeout=0), (None, None))
+
+    def test_wrap(self):
+        ring_buffer = gen_ring_buffer(3)
+        entries = []
+        for i in range(50):
+            episode_len = i % MAX_EPISODE_LENGTH + 1
+            ring_buffer.put(gen_episode(episode_len, i))
+            entries.append(ring_buffer.get(timeout=0))
+            assert_episode_equal(entries[-1][0], gen_episode(episode_len, i))
+            if len(entries) == 2:
+                # Released out of order
+                for _, entry_idx in entries[::-1]:
+                    ring_buffer.release(entry_idx)
+                entries = []
+
+    def test_processes(self):
+        ring_buffer = gen_ring_buffer(4)
+        n = 100
+        producer = mp.Process(target=_put_episodes, args=(ring_buffer, n))
+        producer.start()
+
+        received = []
+        while producer.is_alive() or received[-1:] != [n - 1]:
+            episode, entry_idx = ring_buffer.get(timeout=0.1)
+            if episode is None:
+                if not producer.is_alive():
+                    break
+                continue
+
+            i = int(episode[4][0, 0])
+            assert_episode_equal(episode, gen_episode(i % MAX_EPISODE_LENGTH + 1, i))
+            received.append(i)
+            ring_buffer.release(entry_idx)
+
+        producer.join()
+        self.assertEqual(received, sorted(received))
+        self.assertEqual(received[-1], n - 1)